@@ -0,0 +1,444 @@
+import argparse
+import json
+import platform
+import plistlib
+import random
+import subprocess
+import sys
+from io import BytesIO
+from multiprocessing import Process
+from os import makedirs, path, readlink
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Any, Callable, Optional
+from zipfile import ZIP_DEFLATED, ZipFile
+
+import gallery_api
+import postprocess
+import theme_scraper
+from json_array import write_json_array
+from job_queue import JobQueue, ResultQueue
+
+PATH = readlink(__file__) if path.islink(__file__) else __file__
+SRC_DIR = path.dirname(PATH)
+TOP_DIR = path.dirname(SRC_DIR)
+LOG_DIR = path.join(TOP_DIR, "log")
+BASELINE_PATH = path.join(LOG_DIR, "benchmark_baseline.json")
+CLI_PATH = path.join(SRC_DIR, "cli.py")
+
+SEED = 0
+NUM_EXTENSIONS = 300
+NUM_PAGES = 200
+NUM_THEME_RECORDS = 8000
+NUM_IPC_JOBS = 8000
+NUM_IPC_WORKERS = 4
+REPEAT = 3
+# Flag a stage once it gets this much slower than the baseline
+REGRESSION_THRESHOLD = 0.2
+# Subcommands whose startup is timed, i.e. `cli.py --startup-only <command>`.
+# "python" is a bare interpreter, for reference.
+STARTUP_COMMANDS = {
+    "python": None,
+    "postprocess": ["postprocess"],
+    "dataset": ["dataset"],
+    "analyze": ["analyze"],
+    "retry-failed": ["retry-failed", "--download-backend", "http"],
+    "scrape": ["scrape", "--metadata-backend", "gallery"],
+    "list": ["list", "--backend", "gallery"],
+    "coordinator": ["coordinator"],
+    "pipeline": ["pipeline"],
+}
+
+FORMATS = ["json", "jsonc", "tmTheme"]
+COLOR_KEYS = [
+    "editor.background",
+    "editor.foreground",
+    "editor.lineHighlightBackground",
+    "editor.selectionBackground",
+    "editorCursor.foreground",
+    "editorLineNumber.foreground",
+    "sideBar.background",
+    "activityBar.background",
+    "statusBar.background",
+    "tab.activeBackground",
+    "terminal.ansiRed",
+    "terminal.ansiGreen",
+    "terminal.ansiBlue",
+]
+SCOPES = [
+    "comment",
+    "string",
+    "keyword",
+    "keyword.operator",
+    "constant.numeric",
+    "entity.name.function",
+    "entity.name.type",
+    "variable",
+    "variable.parameter",
+    "support.function",
+    "storage.type",
+    "punctuation",
+]
+
+## Synthetic corpus
+# Everything is derived from a seeded RNG, so a given SEED always produces the
+# same archives, pages and records
+
+
+def random_color(rng: random.Random) -> str:
+    return "#" + "".join(rng.choice("0123456789abcdef") for _ in range(6))
+
+
+def make_theme(rng: random.Random) -> dict[str, Any]:
+    return {
+        "name": f"Theme {rng.randrange(1 << 20)}",
+        "type": rng.choice(["dark", "light"]),
+        "colors": {k: random_color(rng) for k in COLOR_KEYS},
+        "tokenColors": [
+            {
+                "name": scope,
+                "scope": [scope, f"{scope}.{rng.choice(SCOPES)}"],
+                "settings": {
+                    "foreground": random_color(rng),
+                    "fontStyle": rng.choice(["", "italic", "bold"]),
+                },
+            }
+            for scope in rng.sample(SCOPES, rng.randint(4, len(SCOPES)))
+        ],
+    }
+
+
+def to_jsonc(theme: dict[str, Any]) -> bytes:
+    # Comments and trailing commas, like most hand-written themes
+    lines = ["// Generated theme", "{"]
+    for k, v in theme.items():
+        lines.append(f"  /* {k} */")
+        lines.append(f"  {json.dumps(k)}: {json.dumps(v, indent=2)},")
+    lines.append("}")
+    return "\n".join(lines).encode()
+
+
+def to_tmtheme(theme: dict[str, Any]) -> bytes:
+    settings = [{"settings": {"background": theme["colors"]["editor.background"]}}]
+    for rule in theme["tokenColors"]:
+        settings.append(
+            {
+                "name": rule["name"],
+                "scope": ", ".join(rule["scope"]),
+                "settings": rule["settings"],
+            }
+        )
+    return plistlib.dumps({"name": theme["name"], "settings": settings})
+
+
+def make_vsix(rng: random.Random, i: int) -> bytes:
+    fmt = FORMATS[i % len(FORMATS)]
+    ext = "tmTheme" if fmt == "tmTheme" else "json"
+    themes = []
+    buf = BytesIO()
+    with ZipFile(buf, "w", ZIP_DEFLATED) as zip_ref:
+        for j in range(rng.randint(1, 3)):
+            theme = make_theme(rng)
+            theme_path = f"themes/theme-{j}.{ext}"
+            if fmt == "json":
+                data = json.dumps(theme, indent=2).encode()
+            elif fmt == "jsonc":
+                data = to_jsonc(theme)
+            else:
+                data = to_tmtheme(theme)
+            zip_ref.writestr(f"extension/{theme_path}", data)
+            themes.append(
+                {
+                    "label": theme["name"],
+                    "uiTheme": "vs-dark" if theme["type"] == "dark" else "vs",
+                    "path": f"./{theme_path}",
+                }
+            )
+        package = {
+            "name": f"theme-{i}",
+            "displayName": f"Synthetic Theme {i}",
+            "publisher": "benchmark",
+            "version": "1.0.0",
+            "contributes": {"themes": themes},
+        }
+        zip_ref.writestr("extension/package.json", json.dumps(package, indent=2))
+        zip_ref.writestr("[Content_Types].xml", "<Types/>")
+        zip_ref.writestr("extension.vsixmanifest", "<PackageManifest/>")
+    return buf.getvalue()
+
+
+def make_page(rng: random.Random, i: int) -> str:
+    # The markup analyze_page and theme_from_html look for on an item page
+    categories = "".join(
+        f'<a class="meta-data-list-link" aria-label="Category {c}">{c}</a>'
+        for c in ["Themes"]
+    )
+    tags = "".join(
+        f'<a class="meta-data-list-link" aria-label="Tag {t}">{t}</a>'
+        for t in rng.sample(["dark", "light", "theme", "color-theme", "minimal"], 3)
+    )
+    filler = "".join(
+        f"<div class='row'><p>{'lorem ipsum ' * 8}</p></div>" for _ in range(40)
+    )
+    return f"""<!DOCTYPE html>
+<html><head><title>Synthetic Theme {i}</title></head><body>
+<div class="ux-item-header">
+<span class="ux-item-name">Synthetic Theme {i}</span>
+<a class="ux-item-publisher-link">benchmark</a>
+{'<div class="verified-domain-icon"></div>' if i % 2 == 0 else ''}
+<span class="installs-text"> {rng.randrange(10**6):,} installs</span>
+<span class="ux-item-rating-count">({rng.randrange(1000)})</span>
+<span class="ux-item-review-rating" title="Average rating: {rng.randint(0, 5)} out of 5"></span>
+<div class="ux-item-shortdesc">A synthetic theme for benchmarking</div>
+<span class="item-price-category">Free</span>
+</div>
+{filler}
+<div class="ux-section-resources">{categories}{tags}
+<a href="https://github.com/benchmark/theme-{i}">Repository</a></div>
+</body></html>"""
+
+
+def make_theme_record(rng: random.Random, i: int) -> dict[str, Any]:
+    return {
+        "name": f"Synthetic Theme {i}",
+        "theme": {
+            "uiTheme": rng.choice(["vs", "vs-dark", "hc-black"]),
+            "path": f"themes/theme-{i}.json",
+            "format": "json",
+            "contents": make_theme(rng),
+        },
+    }
+
+
+class Corpus:
+    def __init__(
+        self,
+        seed: int = SEED,
+        num_extensions: int = NUM_EXTENSIONS,
+        num_pages: int = NUM_PAGES,
+        num_theme_records: int = NUM_THEME_RECORDS,
+    ):
+        rng = random.Random(seed)
+        self.vsixes = [make_vsix(rng, i) for i in range(num_extensions)]
+        self.pages = [make_page(rng, i) for i in range(num_pages)]
+        self.theme_records = [
+            make_theme_record(rng, i) for i in range(num_theme_records)
+        ]
+
+    def describe(self) -> dict[str, int]:
+        return {
+            "vsixes": len(self.vsixes),
+            "vsix_bytes": sum(len(v) for v in self.vsixes),
+            "pages": len(self.pages),
+            "theme_records": len(self.theme_records),
+        }
+
+
+## Stages
+
+
+def ipc_worker(jobs: JobQueue, results: ResultQueue):
+    with results.batcher("benchmark") as sink:
+        for batch in jobs.batches():
+            for job in batch:
+                sink.add("echo", job)
+                sink.job_done()
+            sink.flush()
+
+
+def dispatch(num_jobs: int, num_workers: int) -> int:
+    # A round trip through the same queues multiprocess_scraper uses, with
+    # workers that do nothing but echo their jobs back
+    jobs = JobQueue()
+    results = ResultQueue()
+    jobs.put(gallery_api.item_url(f"benchmark.theme-{i}") for i in range(num_jobs))
+    jobs.close(num_workers)
+    workers = [
+        Process(target=ipc_worker, args=(jobs, results)) for _ in range(num_workers)
+    ]
+    for p in workers:
+        p.start()
+    completed = 0
+    for batch in results.collect(workers):
+        if batch is not None:
+            completed += batch.completed
+    for p in workers:
+        p.join()
+    assert completed == num_jobs, f"Dispatched {num_jobs} jobs, got {completed} back"
+    return completed
+
+
+def start(command: Optional[list[str]]):
+    args = ["-c", "pass"] if command is None else [CLI_PATH, "--startup-only", *command]
+    subprocess.run([sys.executable, *args], check=True)
+
+
+def stages(corpus: Corpus, work_dir: str) -> dict[str, tuple[Callable[[], Any], int]]:
+    # name: (run once, number of items it handles)
+    themes_json = path.join(work_dir, "themes.json")
+    themes_csv = path.join(work_dir, "themes.csv")
+
+    def zip_read():
+        for vsix in corpus.vsixes:
+            with ZipFile(BytesIO(vsix), "r") as zip_ref:
+                for member in zip_ref.namelist():
+                    zip_ref.read(member)
+
+    def parse():
+        for i, vsix in enumerate(corpus.vsixes):
+            results = theme_scraper.analyze_vsix_archive(vsix, name=f"theme-{i}")
+            assert results.err is None, results.err
+
+    def metadata():
+        for i, html in enumerate(corpus.pages):
+            theme_scraper.theme_from_html(
+                gallery_api.item_url(f"benchmark.theme-{i}"), html
+            )
+
+    def export_json():
+        with open(themes_json, "w") as f:
+            write_json_array(corpus.theme_records, f)
+
+    def export_csv():
+        postprocess.themes_to_csv(themes_json, themes_csv)
+
+    # export_json writes the input for export_csv, so keep them in this order
+    return {
+        "zip_read": (zip_read, len(corpus.vsixes)),
+        "parse": (parse, len(corpus.vsixes)),
+        "metadata": (metadata, len(corpus.pages)),
+        "export_json": (export_json, len(corpus.theme_records)),
+        "export_csv": (export_csv, len(corpus.theme_records)),
+        "ipc": (lambda: dispatch(NUM_IPC_JOBS, NUM_IPC_WORKERS), NUM_IPC_JOBS),
+        **{
+            f"startup_{name}": (lambda command=command: start(command), 1)
+            for name, command in STARTUP_COMMANDS.items()
+        },
+    }
+
+
+def time_stage(fn: Callable[[], Any], repeat: int = REPEAT) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = perf_counter()
+        fn()
+        best = min(best, perf_counter() - start)
+    return best
+
+
+def run(
+    corpus: Corpus, repeat: int = REPEAT, only: Optional[list[str]] = None
+) -> dict[str, Any]:
+    out = {}
+    with TemporaryDirectory() as work_dir:
+        for name, (fn, num_items) in stages(corpus, work_dir).items():
+            if (
+                only
+                and name not in only
+                and not (
+                    # export_csv reads what export_json writes
+                    name == "export_json"
+                    and "export_csv" in only
+                )
+            ):
+                continue
+            seconds = time_stage(fn, repeat)
+            out[name] = {
+                "seconds": seconds,
+                "items": num_items,
+                "items_per_second": num_items / seconds if seconds > 0 else None,
+            }
+    return out
+
+
+## Baseline
+
+
+def environment() -> dict[str, str]:
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+    }
+
+
+def compare(
+    results: dict[str, Any],
+    baseline: dict[str, Any],
+    threshold: float = REGRESSION_THRESHOLD,
+) -> dict[str, float]:
+    # Relative slowdown of every stage that got more than `threshold` slower
+    regressions = {}
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]["seconds"]
+        change = (result["seconds"] - before) / before if before > 0 else 0
+        if change > threshold:
+            regressions[name] = change
+    return regressions
+
+
+def print_report(
+    results: dict[str, Any], baseline: dict[str, Any], regressions: dict[str, float]
+):
+    print(f"{'stage':<20} {'items':>7} {'seconds':>9} {'items/s':>11} {'vs base':>9}")
+    for name, result in results.items():
+        change = ""
+        if name in baseline and baseline[name]["seconds"] > 0:
+            ratio = result["seconds"] / baseline[name]["seconds"] - 1
+            change = f"{ratio:+.1%}"
+        flag = "  REGRESSION" if name in regressions else ""
+        print(
+            f"{name:<20} {result['items']:>7} {result['seconds']:>9.4f}"
+            f" {result['items_per_second'] or 0:>11.1f} {change:>9}{flag}"
+        )
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Time each scraper stage on a synthetic corpus and compare "
+        "against a saved baseline"
+    )
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument(
+        "--save", action="store_true", help="Overwrite the baseline with this run"
+    )
+    parser.add_argument("--only", nargs="+", help="Only run these stages")
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    corpus = Corpus(seed=args.seed)
+    results = run(corpus, repeat=args.repeat, only=args.only)
+
+    baseline = {}
+    if path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            saved = json.load(f)
+        if saved.get("corpus") == corpus.describe():
+            baseline = saved["stages"]
+        else:
+            print(f"Baseline {args.baseline} was made with a different corpus")
+    regressions = compare(results, baseline, args.threshold)
+    print_report(results, baseline, regressions)
+
+    if args.save:
+        makedirs(path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(
+                {
+                    "environment": environment(),
+                    "corpus": corpus.describe(),
+                    "stages": {**baseline, **results},
+                },
+                f,
+                indent=2,
+            )
+    return 1 if len(regressions) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
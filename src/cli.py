@@ -0,0 +1,292 @@
+import argparse
+import sys
+from importlib import import_module
+from typing import Any, Callable, Optional
+
+# Subcommands import what they need once they've been picked, so that e.g.
+# postprocess or a cache reparse never load selenium, bs4 or requests
+
+# Subcommands that hand the rest of the command line to a module's main()
+TOOLS = {
+    "postprocess": ("postprocess", "Convert the dataset to CSV"),
+    "shards": ("shards", "Inspect a sharded theme dataset"),
+    "dataset": ("theme_dataset", "List themes in the dataset"),
+    "dedup": ("dedup", "Store blocks shared between themes once"),
+    "contrast": ("contrast", "WCAG contrast and palette statistics"),
+    "color-table": ("color_table", "Flatten theme colors into a NumPy table"),
+    "color-index": ("color_index", "Build or query a color similarity index"),
+    "coordinator": ("coordinator", "Coordinate a crawl across several nodes"),
+    "parser-bench": ("theme_parser", "Compare the theme parser against json5"),
+    "benchmark": ("benchmark", "Time each scraper stage"),
+}
+
+# Option: the multiprocess_scraper setting it replaces. Options that aren't
+# given keep the module's setting.
+SETTINGS = {
+    "state": "STATE_DB",
+    "max_attempts": "MAX_ATTEMPTS",
+    "batch_size": "JOB_BATCH_SIZE",
+    "log_level": "LOGLEVEL",
+    "metrics": "METRICS",
+    "sharded_output": "SHARDED_OUTPUT",
+    "throttle": "THROTTLE",
+    "headless": "HEADLESS",
+    "delta": "DELTA_CRAWL",
+    "metadata_backend": "METADATA_BACKEND",
+    "scrapers": "NUM_SCRAPERS",
+    "download_backend": "DOWNLOAD_BACKEND",
+    "analyzers": "NUM_VSIX_ANALYZERS",
+    "parsers": "NUM_PARSERS",
+    "separate_parsers": "SEPARATE_PARSERS",
+    "vsix_cache": "USE_VSIX_CACHE",
+    "cache_size": "VSIX_CACHE_SIZE",
+    "listed_versions": "USE_LISTED_VERSIONS",
+}
+
+# Option: the pipeline setting it replaces
+PIPELINE_SETTINGS = {
+    "metadata": "SCRAPE_METADATA",
+    "gallery_api": "USE_GALLERY_API",
+    "metadata_workers": "NUM_METADATA_WORKERS",
+    "download_workers": "NUM_DOWNLOAD_WORKERS",
+    "parsers": "NUM_PARSERS",
+    "queue_size": "QUEUE_SIZE",
+}
+
+# What each crawl subcommand runs
+STAGES = {
+    "scrape": {
+        "SCRAPE_METADATA": True,
+        "ANALYZE_VSIX": False,
+        "ANALYZE_FAILED_ONLY": False,
+        "REPARSE_CACHED": False,
+    },
+    "download": {
+        "SCRAPE_METADATA": False,
+        "ANALYZE_VSIX": True,
+        "ANALYZE_FAILED_ONLY": False,
+        "REPARSE_CACHED": False,
+    },
+    "analyze": {"REPARSE_CACHED": True},
+    "retry-failed": {
+        "SCRAPE_METADATA": False,
+        "ANALYZE_VSIX": True,
+        "ANALYZE_FAILED_ONLY": True,
+        "DELTA_CRAWL": False,
+        "REPARSE_CACHED": False,
+    },
+}
+
+
+def crawl_settings(args: argparse.Namespace) -> dict[str, Any]:
+    settings = dict(STAGES.get(args.command, {}))
+    for option, name in SETTINGS.items():
+        if getattr(args, option, None) is not None:
+            settings[name] = getattr(args, option)
+    if args.command == "scrape" and args.download:
+        settings["ANALYZE_VSIX"] = True
+    if "NUM_PARSERS" in settings:
+        settings["PARSE_QUEUE_BATCHES"] = 2 * settings["NUM_PARSERS"]
+    return settings
+
+
+def load_crawl(args: argparse.Namespace) -> Callable[[], Any]:
+    import multiprocess_scraper
+
+    multiprocess_scraper.configure(**crawl_settings(args))
+    return multiprocess_scraper.run
+
+
+def load_pipeline(args: argparse.Namespace) -> Callable[[], Any]:
+    import multiprocess_scraper
+    import pipeline
+
+    multiprocess_scraper.configure(**crawl_settings(args))
+    for option, name in PIPELINE_SETTINGS.items():
+        if getattr(args, option) is not None:
+            setattr(pipeline, name, getattr(args, option))
+    return pipeline.run
+
+
+def load_list(args: argparse.Namespace) -> Callable[[], Any]:
+    import theme_list_scraper
+
+    if args.timeout is not None:
+        theme_list_scraper.TIMEOUT = args.timeout
+    return lambda: theme_list_scraper.scrape_list(
+        backend=args.backend, headless=args.headless is not False
+    )
+
+
+def load_tool(args: argparse.Namespace) -> Callable[[], Any]:
+    module = import_module(TOOLS[args.command][0])
+    return lambda: module.main(args.rest)
+
+
+def add_crawl_options(parser: argparse.ArgumentParser):
+    parser.add_argument("--state", help="Crawl state database")
+    parser.add_argument("--max-attempts", type=int)
+    parser.add_argument("--batch-size", type=int, help="Jobs per queue batch")
+    parser.add_argument("--log-level", type=int, choices=range(5))
+    parser.add_argument("--metrics", action=argparse.BooleanOptionalAction)
+    parser.add_argument(
+        "--sharded-output",
+        action=argparse.BooleanOptionalAction,
+        help="Also write data/shards",
+    )
+
+
+def add_http_options(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--throttle",
+        action=argparse.BooleanOptionalAction,
+        help="Share a rate limit between the HTTP backends",
+    )
+    parser.add_argument("--headless", action=argparse.BooleanOptionalAction)
+
+
+def add_delta_option(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--delta",
+        action=argparse.BooleanOptionalAction,
+        help="Only crawl what changed in data/theme_list.json",
+    )
+
+
+def add_metadata_options(parser: argparse.ArgumentParser):
+    parser.add_argument("--metadata-backend", choices=["selenium", "http", "gallery"])
+    parser.add_argument("--scrapers", type=int, help="Metadata scraper processes")
+
+
+def add_download_options(parser: argparse.ArgumentParser):
+    parser.add_argument("--download-backend", choices=["selenium", "http"])
+    parser.add_argument("--analyzers", type=int, help="Download processes")
+    parser.add_argument(
+        "--separate-parsers",
+        action=argparse.BooleanOptionalAction,
+        help="Parse archives on their own pool of processes",
+    )
+    add_parser_options(parser)
+    parser.add_argument(
+        "--vsix-cache",
+        action=argparse.BooleanOptionalAction,
+        help="Keep downloaded archives in the VSIX cache",
+    )
+    parser.add_argument("--cache-size", type=int, help="VSIX cache size in bytes")
+    parser.add_argument(
+        "--listed-versions",
+        action=argparse.BooleanOptionalAction,
+        help="Look archives up in the cache by the version in the theme list",
+    )
+
+
+def add_parser_options(parser: argparse.ArgumentParser):
+    parser.add_argument("--parsers", type=int, help="Parser processes")
+
+
+def make_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Scrape VS Code themes from the marketplace. Options that "
+        "aren't given keep the settings at the top of each module."
+    )
+    parser.add_argument(
+        "--startup-only",
+        action="store_true",
+        help="Import everything the subcommand needs, then exit without running it",
+    )
+    sub = parser.add_subparsers(dest="command", required=True, metavar="command")
+
+    p = sub.add_parser("list", help="List the theme extensions on the marketplace")
+    p.add_argument("--backend", choices=["selenium", "gallery"])
+    p.add_argument("--timeout", type=float, help="Seconds to wait for a scroll")
+    p.add_argument("--headless", action=argparse.BooleanOptionalAction)
+    p.set_defaults(load=load_list)
+
+    p = sub.add_parser("scrape", help="Scrape extension metadata")
+    add_crawl_options(p)
+    add_http_options(p)
+    add_delta_option(p)
+    add_metadata_options(p)
+    p.add_argument(
+        "--download", action="store_true", help="Download archives in the same run"
+    )
+    add_download_options(p)
+    p.set_defaults(load=load_crawl)
+
+    p = sub.add_parser("download", help="Download and analyze extension archives")
+    add_crawl_options(p)
+    add_http_options(p)
+    add_delta_option(p)
+    add_download_options(p)
+    p.set_defaults(load=load_crawl)
+
+    p = sub.add_parser("analyze", help="Re-parse the archives in the VSIX cache")
+    add_crawl_options(p)
+    add_parser_options(p)
+    p.set_defaults(load=load_crawl)
+
+    p = sub.add_parser("retry-failed", help="Retry failed downloads and analyses")
+    add_crawl_options(p)
+    add_http_options(p)
+    add_download_options(p)
+    p.set_defaults(load=load_crawl)
+
+    p = sub.add_parser(
+        "pipeline",
+        help="List, scrape, download and parse in one streaming pass over HTTP",
+    )
+    p.add_argument("--state", help="Crawl state database")
+    p.add_argument("--max-attempts", type=int)
+    p.add_argument("--log-level", type=int, choices=range(5))
+    p.add_argument("--metrics", action=argparse.BooleanOptionalAction)
+    p.add_argument(
+        "--sharded-output",
+        action=argparse.BooleanOptionalAction,
+        help="Also write data/shards",
+    )
+    p.add_argument(
+        "--throttle",
+        action=argparse.BooleanOptionalAction,
+        help="Share a rate limit between the stages",
+    )
+    p.add_argument(
+        "--metadata", action=argparse.BooleanOptionalAction, help="Scrape metadata"
+    )
+    p.add_argument(
+        "--gallery-api",
+        action=argparse.BooleanOptionalAction,
+        help="Metadata from extensionquery rather than the item page",
+    )
+    p.add_argument("--metadata-workers", type=int, help="Metadata threads")
+    p.add_argument("--download-workers", type=int, help="Download threads")
+    add_parser_options(p)
+    p.add_argument("--queue-size", type=int, help="Items queued between stages")
+    p.add_argument(
+        "--vsix-cache",
+        action=argparse.BooleanOptionalAction,
+        help="Keep downloaded archives in the VSIX cache",
+    )
+    p.add_argument("--cache-size", type=int, help="VSIX cache size in bytes")
+    p.set_defaults(load=load_pipeline)
+
+    for name, (_, help) in TOOLS.items():
+        # Everything after the name, --help included, is left for the module
+        p = sub.add_parser(name, help=help, add_help=False)
+        p.set_defaults(load=load_tool)
+    return parser
+
+
+def main(argv: Optional[list[str]] = None) -> Any:
+    parser = make_parser()
+    args, rest = parser.parse_known_args(argv)
+    if args.command not in TOOLS and len(rest) > 0:
+        parser.error(f"unrecognized arguments: {' '.join(rest)}")
+    args.rest = rest
+    run = args.load(args)
+    if args.startup_only:
+        return None
+    return run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,287 @@
+import argparse
+from dataclasses import dataclass
+from os import path
+from typing import Any, Iterable, Optional
+
+import numpy as np
+
+from color_table import (
+    KIND_BACKGROUND,
+    KIND_COLORS,
+    KIND_FOREGROUND,
+    KIND_SETTINGS,
+    iter_theme_colors,
+    parse_hex,
+)
+from postprocess import DATA_DIR, iter_json_records
+
+# Each feature is (name, weight, where to look for it in order of preference)
+FEATURES = [
+    (
+        "editor.background",
+        2.0,
+        [(KIND_COLORS, "editor.background"), (KIND_SETTINGS, "background")],
+    ),
+    (
+        "editor.foreground",
+        2.0,
+        [(KIND_COLORS, "editor.foreground"), (KIND_SETTINGS, "foreground")],
+    ),
+    (
+        "editor.selectionBackground",
+        0.5,
+        [(KIND_COLORS, "editor.selectionBackground"), (KIND_SETTINGS, "selection")],
+    ),
+    (
+        "editor.lineHighlightBackground",
+        0.5,
+        [
+            (KIND_COLORS, "editor.lineHighlightBackground"),
+            (KIND_SETTINGS, "lineHighlight"),
+        ],
+    ),
+    ("sideBar.background", 0.5, [(KIND_COLORS, "sideBar.background")]),
+    ("activityBar.background", 0.5, [(KIND_COLORS, "activityBar.background")]),
+    ("statusBar.background", 0.5, [(KIND_COLORS, "statusBar.background")]),
+    ("comment", 1.0, [(KIND_FOREGROUND, "comment")]),
+    ("string", 1.0, [(KIND_FOREGROUND, "string")]),
+    ("keyword", 1.0, [(KIND_FOREGROUND, "keyword")]),
+    ("constant.numeric", 1.0, [(KIND_FOREGROUND, "constant.numeric")]),
+    ("entity.name.function", 1.0, [(KIND_FOREGROUND, "entity.name.function")]),
+    ("entity.name.type", 1.0, [(KIND_FOREGROUND, "entity.name.type")]),
+    ("variable", 1.0, [(KIND_FOREGROUND, "variable")]),
+    ("storage", 1.0, [(KIND_FOREGROUND, "storage")]),
+]
+FEATURE_NAMES = [name for name, _, _ in FEATURES]
+# What VS Code falls back to when a theme leaves the editor colors out
+DEFAULT_BACKGROUND = {"vs": "#ffffff", "vs-dark": "#1e1e1e", "hc-black": "#000000"}
+DEFAULT_FOREGROUND = {"vs": "#000000", "vs-dark": "#d4d4d4", "hc-black": "#ffffff"}
+BATCH_SIZE = 1024  # queries per distance matrix
+
+
+def srgb_to_oklab(rgb: np.ndarray) -> np.ndarray:
+    # rgb in [0, 1], any leading shape
+    linear = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    lms = linear @ np.array(
+        [
+            [0.4122214708, 0.2119034982, 0.0883024619],
+            [0.5363325363, 0.6806995451, 0.2817188376],
+            [0.0514459929, 0.1073969566, 0.6299787005],
+        ]
+    )
+    return np.cbrt(lms) @ np.array(
+        [
+            [0.2104542553, 1.9779984951, 0.0259040371],
+            [0.7936177850, -2.4285922050, 0.7827717662],
+            [-0.0040720468, 0.4505937099, -0.8086757660],
+        ]
+    )
+
+
+def theme_colors(contents: Any) -> dict[tuple[int, str], tuple[int, int, int, int]]:
+    # First color for every (kind, key), with token rules also reachable
+    # through each scope of a multi-scope selector
+    out = {}
+    for kind, key, value in iter_theme_colors(contents):
+        color = parse_hex(value)
+        if color is None:
+            continue
+        keys = [key]
+        if kind in [KIND_FOREGROUND, KIND_BACKGROUND]:
+            keys += [s.strip() for s in key.split(",")]
+        for k in keys:
+            out.setdefault((kind, k), color)
+    return out
+
+
+def theme_features(contents: Any, ui_theme: str) -> np.ndarray:
+    # RGBA per feature, uint8 of shape (len(FEATURES), 4). Missing token colors
+    # fall back to the foreground and missing UI colors to the background.
+    colors = theme_colors(contents)
+    out = np.zeros((len(FEATURES), 4), dtype=np.uint8)
+    for i, (name, _, sources) in enumerate(FEATURES):
+        for source in sources:
+            if source in colors:
+                out[i] = colors[source]
+                break
+        else:
+            if name == "editor.background":
+                out[i] = parse_hex(DEFAULT_BACKGROUND.get(ui_theme, "#1e1e1e"))
+            elif name == "editor.foreground":
+                out[i] = parse_hex(DEFAULT_FOREGROUND.get(ui_theme, "#d4d4d4"))
+            elif name.startswith(("editor.", "sideBar.", "activityBar.", "statusBar.")):
+                out[i] = out[0]
+            else:
+                out[i] = out[1]
+    return out
+
+
+def to_vectors(rgba: np.ndarray) -> np.ndarray:
+    # (n, len(FEATURES), 4) uint8 -> (n, len(FEATURES) * 3) weighted OKLab.
+    # Translucent colors are blended over the editor background first.
+    rgba = rgba.astype(np.float32) / 255
+    alpha = rgba[..., 3:]
+    rgb = rgba[..., :3] * alpha + rgba[:, :1, :3] * (1 - alpha)
+    lab = srgb_to_oklab(rgb)
+    weights = np.sqrt(np.array([w for _, w, _ in FEATURES], dtype=np.float32))
+    return (lab * weights[None, :, None]).reshape(len(rgba), -1).astype(np.float32)
+
+
+@dataclass
+class ColorIndex:
+    theme_name: np.ndarray
+    theme_path: np.ndarray
+    theme_ui: np.ndarray
+    rgba: np.ndarray  # uint8, shape (n, len(FEATURES), 4)
+    vectors: np.ndarray  # float32, shape (n, len(FEATURES) * 3)
+    norms: np.ndarray  # float32 squared norms of vectors
+
+    def save(self, fpath: str):
+        # Uncompressed so that loading is just reading the arrays back
+        np.savez(fpath, features=np.array(FEATURE_NAMES), **self.__dict__)
+
+    @classmethod
+    def load(cls, fpath: str) -> "ColorIndex":
+        with np.load(fpath) as f:
+            if list(f["features"]) != FEATURE_NAMES:
+                raise ValueError(f"{fpath} was built with different features")
+            return cls(**{k: f[k] for k in f.files if k != "features"})
+
+    def __len__(self) -> int:
+        return len(self.theme_name)
+
+    def find(self, name: str) -> int:
+        matches = np.flatnonzero(self.theme_name == name)
+        if len(matches) == 0:
+            raise KeyError(name)
+        return int(matches[0])
+
+    def search(
+        self, queries: np.ndarray, k: int = 10, dims: Optional[np.ndarray] = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        # Brute-force k nearest neighbors of each query vector, restricted to
+        # `dims` if given. Returns (indices, distances), both (len(queries), k).
+        queries = np.atleast_2d(queries).astype(np.float32)
+        vectors, norms = self.vectors, self.norms
+        if dims is not None:
+            queries = queries[:, dims]
+            vectors = vectors[:, dims]
+            norms = np.einsum("ij,ij->i", vectors, vectors)
+        k = min(k, len(vectors))
+        indices = np.empty((len(queries), k), dtype=np.int64)
+        distances = np.empty((len(queries), k), dtype=np.float32)
+        if k == 0:
+            return indices, distances
+        for start in range(0, len(queries), BATCH_SIZE):
+            q = queries[start : start + BATCH_SIZE]
+            d = (
+                norms[None, :]
+                - 2 * (q @ vectors.T)
+                + np.einsum("ij,ij->i", q, q)[:, None]
+            )
+            nearest = np.argpartition(d, k - 1, axis=1)[:, :k]
+            d_nearest = np.take_along_axis(d, nearest, axis=1)
+            order = np.argsort(d_nearest, axis=1, kind="stable")
+            indices[start : start + len(q)] = np.take_along_axis(nearest, order, 1)
+            distances[start : start + len(q)] = np.sqrt(
+                np.maximum(np.take_along_axis(d_nearest, order, 1), 0)
+            )
+        return indices, distances
+
+    def similar_to(self, name: str, k: int = 10) -> list[tuple[str, str, float]]:
+        i = self.find(name)
+        indices, distances = self.search(self.vectors[i], k + 1)
+        return [
+            (str(self.theme_name[j]), str(self.theme_path[j]), float(d))
+            for j, d in zip(indices[0], distances[0])
+            if j != i
+        ][:k]
+
+    def nearest_colors(
+        self, colors: dict[str, str], k: int = 10
+    ) -> list[tuple[str, str, float]]:
+        # e.g. {"editor.background": "#272822", "editor.foreground": "#f8f8f2"},
+        # compared on those features only
+        rgba = np.zeros((1, len(FEATURES), 4), dtype=np.uint8)
+        rgba[0, :] = parse_hex(colors.get("editor.background", "#000000"))
+        dims = []
+        for name, value in colors.items():
+            i = FEATURE_NAMES.index(name)
+            color = parse_hex(value)
+            if color is None:
+                raise ValueError(f"Not a hex color: {value}")
+            rgba[0, i] = color
+            dims.extend(range(i * 3, i * 3 + 3))
+        indices, distances = self.search(to_vectors(rgba), k, dims=np.array(dims))
+        return [
+            (str(self.theme_name[j]), str(self.theme_path[j]), float(d))
+            for j, d in zip(indices[0], distances[0])
+        ]
+
+
+def build_color_index(records: Iterable[dict[str, Any]]) -> ColorIndex:
+    names, paths, uis, rgba = [], [], [], []
+    for record in records:
+        theme = record["theme"]
+        names.append(record["name"])
+        paths.append(theme["path"])
+        uis.append(theme["uiTheme"])
+        rgba.append(theme_features(theme["contents"], theme["uiTheme"]))
+    rgba = (
+        np.stack(rgba)
+        if len(rgba) > 0
+        else np.zeros((0, len(FEATURES), 4), dtype=np.uint8)
+    )
+    vectors = to_vectors(rgba)
+    return ColorIndex(
+        theme_name=np.array(names, dtype=str),
+        theme_path=np.array(paths, dtype=str),
+        theme_ui=np.array(uis, dtype=str),
+        rgba=rgba,
+        vectors=vectors,
+        norms=np.einsum("ij,ij->i", vectors, vectors),
+    )
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Build or query a perceptual color similarity index of themes"
+    )
+    parser.add_argument("--themes", default=path.join(DATA_DIR, "themes.json"))
+    parser.add_argument("--index", default=path.join(DATA_DIR, "color_index.npz"))
+    parser.add_argument(
+        "--build", action="store_true", help="Rebuild the index from --themes"
+    )
+    parser.add_argument("--like", help="Find the themes closest to this theme name")
+    parser.add_argument(
+        "--color",
+        action="append",
+        default=[],
+        metavar="FEATURE=#HEX",
+        help=f"Find the themes closest to these colors, features: {FEATURE_NAMES}",
+    )
+    parser.add_argument("-k", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    if args.build or not path.exists(args.index):
+        with open(args.themes, "r") as f:
+            index = build_color_index(iter_json_records(f))
+        index.save(args.index)
+        print(f"Indexed {len(index)} themes")
+    else:
+        index = ColorIndex.load(args.index)
+
+    if args.like:
+        results = index.similar_to(args.like, args.k)
+    elif len(args.color) > 0:
+        results = index.nearest_colors(
+            dict(c.split("=", 1) for c in args.color), args.k
+        )
+    else:
+        return
+    for name, theme_path, distance in results:
+        print(f"{distance:8.4f}  {name}  ({theme_path})")
+
+
+if __name__ == "__main__":
+    main()
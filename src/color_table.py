@@ -0,0 +1,227 @@
+import argparse
+import re
+from array import array
+from dataclasses import dataclass
+from os import path
+from typing import Any, Iterable, Iterator, Optional
+
+import numpy as np
+
+from postprocess import DATA_DIR, iter_json_records
+
+HEX_COLOR = re.compile(r"^\s*#([0-9a-fA-F]{3,4}|[0-9a-fA-F]{6}|[0-9a-fA-F]{8})\s*$")
+
+# Where in a theme a color came from
+KIND_COLORS = 0  # "colors" map of a json theme
+KIND_FOREGROUND = 1  # tokenColors / tmTheme rule foreground
+KIND_BACKGROUND = 2  # tokenColors / tmTheme rule background
+KIND_SETTINGS = 3  # global (unscoped) tmTheme or tokenColors settings
+KIND_SEMANTIC = 4  # semanticTokenColors
+KINDS = ["colors", "foreground", "background", "settings", "semantic"]
+
+
+def parse_hex(color: Any) -> Optional[tuple[int, int, int, int]]:
+    if not isinstance(color, str):
+        return None
+    match = HEX_COLOR.match(color)
+    if match is None:
+        return None
+    digits = match.group(1)
+    if len(digits) <= 4:
+        digits = "".join(c * 2 for c in digits)
+    if len(digits) == 6:
+        digits += "ff"
+    return tuple(int(digits[i : i + 2], 16) for i in range(0, 8, 2))
+
+
+def scope_key(scope: Any) -> str:
+    if isinstance(scope, list):
+        return ", ".join(str(s) for s in scope)
+    return str(scope).strip()
+
+
+def iter_rule_colors(rules: Any) -> Iterator[tuple[int, str, Any]]:
+    if not isinstance(rules, list):
+        return
+    for rule in rules:
+        if not isinstance(rule, dict) or not isinstance(rule.get("settings"), dict):
+            continue
+        settings = rule["settings"]
+        if "scope" not in rule:
+            for k, v in settings.items():
+                yield KIND_SETTINGS, k, v
+            continue
+        scope = scope_key(rule["scope"])
+        if "foreground" in settings:
+            yield KIND_FOREGROUND, scope, settings["foreground"]
+        if "background" in settings:
+            yield KIND_BACKGROUND, scope, settings["background"]
+
+
+def iter_theme_colors(contents: Any) -> Iterator[tuple[int, str, Any]]:
+    if not isinstance(contents, dict):
+        return
+    if isinstance(contents.get("colors"), dict):
+        for k, v in contents["colors"].items():
+            yield KIND_COLORS, k, v
+    yield from iter_rule_colors(contents.get("tokenColors"))
+    # tmTheme plists keep their rules under "settings"
+    yield from iter_rule_colors(contents.get("settings"))
+    if isinstance(contents.get("semanticTokenColors"), dict):
+        for k, v in contents["semanticTokenColors"].items():
+            if isinstance(v, dict):
+                v = v.get("foreground")
+            yield KIND_SEMANTIC, k, v
+
+
+class Vocab:
+    def __init__(self):
+        self.ids: dict[str, int] = {}
+
+    def __call__(self, value: str) -> int:
+        if value not in self.ids:
+            self.ids[value] = len(self.ids)
+        return self.ids[value]
+
+    def to_array(self) -> np.ndarray:
+        return np.array(list(self.ids.keys()), dtype=str)
+
+
+@dataclass
+class ColorTable:
+    # One row per theme
+    theme_name: np.ndarray
+    theme_path: np.ndarray
+    theme_ui: np.ndarray  # int32 codes into ui_themes
+    theme_format: np.ndarray  # int32 codes into formats
+    ui_themes: np.ndarray
+    formats: np.ndarray
+    # One row per color
+    theme_id: np.ndarray  # int32
+    kind: np.ndarray  # uint8, see KINDS
+    key_id: np.ndarray  # int32 codes into keys
+    rgba: np.ndarray  # uint8, shape (n, 4)
+    keys: np.ndarray
+
+    def save(self, fpath: str):
+        np.savez_compressed(fpath, **self.__dict__)
+
+    @classmethod
+    def load(cls, fpath: str) -> "ColorTable":
+        with np.load(fpath) as f:
+            return cls(**{k: f[k] for k in f.files})
+
+    def key(self, name: str) -> int:
+        matches = np.flatnonzero(self.keys == name)
+        return int(matches[0]) if len(matches) > 0 else -1
+
+    def colors_for(self, key: str, kind: int = KIND_COLORS) -> np.ndarray:
+        return (self.key_id == self.key(key)) & (self.kind == kind)
+
+
+def build_color_table(records: Iterable[dict[str, Any]]) -> ColorTable:
+    names, paths = [], []
+    theme_ui, theme_format = array("i"), array("i")
+    ui_vocab, format_vocab, key_vocab = Vocab(), Vocab(), Vocab()
+    theme_id, kind, key_id = array("i"), array("B"), array("i")
+    rgba = bytearray()
+
+    for i, record in enumerate(records):
+        theme = record["theme"]
+        names.append(record["name"])
+        paths.append(theme["path"])
+        theme_ui.append(ui_vocab(theme["uiTheme"]))
+        theme_format.append(format_vocab(theme["format"]))
+        for k, key, value in iter_theme_colors(theme["contents"]):
+            color = parse_hex(value)
+            if color is None:
+                continue
+            theme_id.append(i)
+            kind.append(k)
+            key_id.append(key_vocab(key))
+            rgba.extend(color)
+
+    return ColorTable(
+        theme_name=np.array(names, dtype=str),
+        theme_path=np.array(paths, dtype=str),
+        theme_ui=np.frombuffer(theme_ui, dtype=np.int32).copy(),
+        theme_format=np.frombuffer(theme_format, dtype=np.int32).copy(),
+        ui_themes=ui_vocab.to_array(),
+        formats=format_vocab.to_array(),
+        theme_id=np.frombuffer(theme_id, dtype=np.int32).copy(),
+        kind=np.frombuffer(kind, dtype=np.uint8).copy(),
+        key_id=np.frombuffer(key_id, dtype=np.int32).copy(),
+        rgba=np.frombuffer(bytes(rgba), dtype=np.uint8).reshape(-1, 4).copy(),
+        keys=key_vocab.to_array(),
+    )
+
+
+def pack_rgba(rgba: np.ndarray) -> np.ndarray:
+    return rgba.astype(np.uint32) @ np.array([1 << 24, 1 << 16, 1 << 8, 1], np.uint32)
+
+
+def unpack_rgba(packed: np.ndarray) -> np.ndarray:
+    shifts = np.array([24, 16, 8, 0], dtype=np.uint32)
+    return ((packed[..., None] >> shifts) & 0xFF).astype(np.uint8)
+
+
+def to_hex(rgba: np.ndarray) -> str:
+    return "#" + "".join(f"{c:02x}" for c in rgba)
+
+
+def most_common(
+    table: ColorTable, key: str, kind: int = KIND_COLORS, n: int = 10
+) -> list[tuple[str, int]]:
+    colors, counts = np.unique(
+        pack_rgba(table.rgba[table.colors_for(key, kind)]), return_counts=True
+    )
+    order = np.argsort(-counts, kind="stable")[:n]
+    return [(to_hex(unpack_rgba(colors[i])), int(counts[i])) for i in order]
+
+
+def hue(rgba: np.ndarray) -> np.ndarray:
+    # HSV hue in degrees, 0 for greys
+    rgb = rgba[..., :3].astype(np.float32) / 255
+    cmax, cmin = rgb.max(axis=-1), rgb.min(axis=-1)
+    delta = cmax - cmin
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    safe = np.where(delta == 0, 1, delta)
+    h = np.select(
+        [delta == 0, cmax == r, cmax == g],
+        [0, ((g - b) / safe) % 6, (b - r) / safe + 2],
+        (r - g) / safe + 4,
+    )
+    return h * 60
+
+
+def hue_histograms(
+    table: ColorTable, bins: int = 36, kinds: Optional[list[int]] = None
+) -> dict[str, np.ndarray]:
+    mask = np.ones(len(table.kind), dtype=bool)
+    if kinds is not None:
+        mask = np.isin(table.kind, kinds)
+    ui = table.theme_ui[table.theme_id[mask]]
+    hues = hue(table.rgba[mask])
+    return {
+        str(name): np.histogram(hues[ui == i], bins=bins, range=(0, 360))[0]
+        for i, name in enumerate(table.ui_themes)
+    }
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Flatten every theme color in themes.json into a NumPy table"
+    )
+    parser.add_argument("--themes", default=path.join(DATA_DIR, "themes.json"))
+    parser.add_argument("--out", default=path.join(DATA_DIR, "colors.npz"))
+    args = parser.parse_args(argv)
+
+    with open(args.themes, "r") as f:
+        table = build_color_table(iter_json_records(f))
+    table.save(args.out)
+    print(f"{len(table.theme_name)} themes, {len(table.kind)} colors")
+    print("Most common editor.background:", most_common(table, "editor.background"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+import argparse
+import csv
+import hashlib
+import json
+from array import array
+from dataclasses import dataclass
+from os import path, replace
+from typing import Any, Iterable, Optional
+
+import numpy as np
+
+from color_index import DEFAULT_BACKGROUND, DEFAULT_FOREGROUND
+from color_table import parse_hex
+from postprocess import DATA_DIR, iter_json_records
+
+# WCAG 2 minimum contrast ratios for normal and large text
+AA = 4.5
+AA_LARGE = 3.0
+SIDECAR_PATH = path.join(DATA_DIR, "contrast.npz")
+
+# Every foreground color of a theme is paired with the background it is drawn
+# on: "x.foreground" / "xForeground" colors with the matching "x.background" /
+# "xBackground" if the theme has one, token rules with their own background,
+# and everything else with the editor background. Translucent backgrounds are
+# composited over the editor background, and translucent foregrounds over
+# their background, before taking the WCAG contrast ratio.
+
+
+def background_key(key: str) -> Optional[str]:
+    # "tab.activeForeground" -> "tab.activeBackground"
+    i = key.rfind("oreground")
+    if i < 1 or key[i - 1] not in "fF":
+        return None
+    return (
+        key[: i - 1] + ("B" if key[i - 1] == "F" else "b") + "ackground" + key[i + 9 :]
+    )
+
+
+def theme_hash(record: dict[str, Any]) -> str:
+    theme = record["theme"]
+    data = json.dumps(
+        [theme["uiTheme"], theme["contents"]], sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.blake2b(data.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def iter_rules(contents: dict[str, Any]) -> Iterable[dict[str, Any]]:
+    for key in ["tokenColors", "settings"]:
+        if isinstance(contents.get(key), list):
+            for rule in contents[key]:
+                if isinstance(rule, dict) and isinstance(rule.get("settings"), dict):
+                    yield rule
+
+
+def editor_colors(contents: Any, ui_theme: str) -> tuple[tuple, tuple]:
+    # (background, foreground) the editor resolves to, like color_index
+    background = foreground = None
+    if isinstance(contents, dict):
+        if isinstance(contents.get("colors"), dict):
+            background = parse_hex(contents["colors"].get("editor.background"))
+            foreground = parse_hex(contents["colors"].get("editor.foreground"))
+        for rule in iter_rules(contents):
+            if "scope" not in rule:
+                background = background or parse_hex(rule["settings"].get("background"))
+                foreground = foreground or parse_hex(rule["settings"].get("foreground"))
+    default_background = parse_hex(DEFAULT_BACKGROUND.get(ui_theme, "#1e1e1e"))
+    default_foreground = parse_hex(DEFAULT_FOREGROUND.get(ui_theme, "#d4d4d4"))
+    return background or default_background, foreground or default_foreground
+
+
+def theme_pairs(contents: Any) -> Iterable[tuple[tuple, Optional[tuple]]]:
+    # (foreground, background or None for the editor background)
+    if not isinstance(contents, dict):
+        return
+    colors = contents.get("colors")
+    if isinstance(colors, dict):
+        for key, value in colors.items():
+            bg_key = background_key(key)
+            if bg_key is None or key == "editor.foreground":
+                continue
+            fg = parse_hex(value)
+            if fg is not None:
+                yield fg, parse_hex(colors.get(bg_key))
+    for rule in iter_rules(contents):
+        if "scope" not in rule:
+            continue
+        fg = parse_hex(rule["settings"].get("foreground"))
+        if fg is not None:
+            yield fg, parse_hex(rule["settings"].get("background"))
+    if isinstance(contents.get("semanticTokenColors"), dict):
+        for value in contents["semanticTokenColors"].values():
+            if isinstance(value, dict):
+                value = value.get("foreground")
+            fg = parse_hex(value)
+            if fg is not None:
+                yield fg, None
+
+
+## Vectorized math, on float RGBA in [0, 1]
+
+
+def composite(fg: np.ndarray, bg: np.ndarray) -> np.ndarray:
+    # Over an opaque background, giving opaque RGBA
+    alpha = fg[..., 3:]
+    out = np.ones_like(fg)
+    out[..., :3] = fg[..., :3] * alpha + bg[..., :3] * (1 - alpha)
+    return out
+
+
+def relative_luminance(rgb: np.ndarray) -> np.ndarray:
+    linear = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    return linear[..., :3] @ np.array([0.2126, 0.7152, 0.0722], dtype=rgb.dtype)
+
+
+def contrast_ratio(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    la, lb = relative_luminance(a), relative_luminance(b)
+    return (np.maximum(la, lb) + 0.05) / (np.minimum(la, lb) + 0.05)
+
+
+def pack_rgb(rgb: np.ndarray) -> np.ndarray:
+    q = np.rint(rgb[..., :3] * 255).astype(np.int64)
+    return (q[..., 0] << 16) | (q[..., 1] << 8) | q[..., 2]
+
+
+@dataclass
+class ContrastTable:
+    # One row per theme
+    theme_name: np.ndarray
+    theme_path: np.ndarray
+    theme_ui: np.ndarray
+    hash: np.ndarray
+    num_pairs: np.ndarray  # int32
+    min_contrast: np.ndarray  # float32, nan without pairs
+    median_contrast: np.ndarray  # float32, nan without pairs
+    below_aa: np.ndarray  # float32 share of pairs under AA
+    below_aa_large: np.ndarray  # float32 share of pairs under AA_LARGE
+    editor_contrast: np.ndarray  # float32, editor foreground on background
+    background_luminance: np.ndarray  # float32
+    palette_size: np.ndarray  # int32 distinct effective colors
+
+    def save(self, fpath: str):
+        with open(fpath + ".tmp", "wb") as f:
+            np.savez(f, **self.__dict__)
+        replace(fpath + ".tmp", fpath)
+
+    @classmethod
+    def load(cls, fpath: str) -> "ContrastTable":
+        with np.load(fpath) as f:
+            return cls(**{k: f[k] for k in f.files})
+
+    def __len__(self) -> int:
+        return len(self.hash)
+
+    def take(self, rows: np.ndarray) -> "ContrastTable":
+        return ContrastTable(**{k: v[rows] for k, v in self.__dict__.items()})
+
+    def to_csv(self, fpath: str):
+        columns = list(self.__dict__.keys())
+        with open(fpath, "w", encoding="utf-8", newline="") as f:
+            w = csv.writer(f)
+            w.writerow(columns)
+            w.writerows(zip(*(self.__dict__[c].tolist() for c in columns)))
+
+
+def analyze(records: list[dict[str, Any]], hashes: list[str]) -> ContrastTable:
+    # Flattens the pairs of every theme into arrays, then computes everything
+    # in one go
+    n = len(records)
+    editor = np.zeros((n, 2, 4), dtype=np.uint8)
+    defaults = np.zeros((n, 4), dtype=np.uint8)
+    theme_id = array("i")
+    fg, bg = bytearray(), bytearray()
+    has_bg = array("B")
+    for i, record in enumerate(records):
+        contents, ui_theme = record["theme"]["contents"], record["theme"]["uiTheme"]
+        editor[i] = editor_colors(contents, ui_theme)
+        defaults[i] = parse_hex(DEFAULT_BACKGROUND.get(ui_theme, "#1e1e1e"))
+        for pair_fg, pair_bg in theme_pairs(contents):
+            theme_id.append(i)
+            fg.extend(pair_fg)
+            bg.extend(pair_bg or (0, 0, 0, 0))
+            has_bg.append(pair_bg is not None)
+
+    theme = np.frombuffer(theme_id, dtype=np.int32)
+    to_float = lambda b: np.frombuffer(bytes(b), np.uint8).reshape(-1, 4) / 255
+    fg_rgba, bg_rgba = to_float(fg), to_float(bg)
+    has_bg = np.frombuffer(has_bg, dtype=np.uint8).astype(bool)
+
+    # A translucent editor background sits on the default for its uiTheme
+    editor_bg = composite(editor[:, 0] / 255, defaults / 255)
+    editor_fg = composite(editor[:, 1] / 255, editor_bg)
+    bg_eff = np.where(
+        has_bg[:, None], composite(bg_rgba, editor_bg[theme]), editor_bg[theme]
+    )
+    fg_eff = composite(fg_rgba, bg_eff)
+    ratio = contrast_ratio(fg_eff, bg_eff)
+
+    # Per-theme order statistics from a single sort
+    counts = np.bincount(theme, minlength=n)
+    sorted_ratio = ratio[np.lexsort((ratio, theme))]
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    has_pairs = counts > 0
+    min_contrast = np.full(n, np.nan)
+    median_contrast = np.full(n, np.nan)
+    min_contrast[has_pairs] = sorted_ratio[starts[has_pairs]]
+    lower = starts + (counts - 1) // 2
+    upper = starts + counts // 2
+    median_contrast[has_pairs] = (
+        sorted_ratio[lower[has_pairs]] + sorted_ratio[upper[has_pairs]]
+    ) / 2
+    share = lambda mask: np.bincount(theme, weights=mask, minlength=n) / np.maximum(
+        counts, 1
+    )
+
+    # Distinct effective colors per theme, editor colors included
+    packed = np.concatenate(
+        [
+            (theme.astype(np.int64) << 24) | pack_rgb(fg_eff),
+            (theme.astype(np.int64) << 24) | pack_rgb(bg_eff),
+            (np.arange(n, dtype=np.int64) << 24) | pack_rgb(editor_bg),
+            (np.arange(n, dtype=np.int64) << 24) | pack_rgb(editor_fg),
+        ]
+    )
+    palette_size = np.bincount(np.unique(packed) >> 24, minlength=n)
+
+    return ContrastTable(
+        theme_name=np.array([r["name"] for r in records], dtype=str),
+        theme_path=np.array([r["theme"]["path"] for r in records], dtype=str),
+        theme_ui=np.array([r["theme"]["uiTheme"] for r in records], dtype=str),
+        hash=np.array(hashes, dtype=str),
+        num_pairs=counts.astype(np.int32),
+        min_contrast=min_contrast.astype(np.float32),
+        median_contrast=median_contrast.astype(np.float32),
+        below_aa=share(ratio < AA).astype(np.float32),
+        below_aa_large=share(ratio < AA_LARGE).astype(np.float32),
+        editor_contrast=contrast_ratio(editor_fg, editor_bg).astype(np.float32),
+        background_luminance=relative_luminance(editor_bg).astype(np.float32),
+        palette_size=palette_size.astype(np.int32),
+    )
+
+
+def build_contrast_table(
+    records: Iterable[dict[str, Any]], cached: Optional[ContrastTable] = None
+) -> tuple[ContrastTable, int]:
+    # Only themes whose contents hash isn't in `cached` are analyzed. Returns
+    # the table, in the order of `records`, and how many themes were analyzed.
+    cached_rows = {}
+    if cached is not None:
+        cached_rows = {h: i for i, h in enumerate(cached.hash.tolist())}
+    names, paths, rows = [], [], []
+    todo, todo_hashes = [], []
+    for record in records:
+        names.append(record["name"])
+        paths.append(record["theme"]["path"])
+        h = theme_hash(record)
+        if h in cached_rows:
+            rows.append(cached_rows[h])
+        else:
+            # Fresh rows go after the cached ones
+            rows.append(-1 - len(todo))
+            todo.append(record)
+            todo_hashes.append(h)
+    table = analyze(todo, todo_hashes)
+    num_cached = 0
+    if cached is not None:
+        num_cached = len(cached)
+        table = ContrastTable(
+            **{
+                k: np.concatenate([cached.__dict__[k], v])
+                for k, v in table.__dict__.items()
+            }
+        )
+    rows = np.array(rows, dtype=np.int64)
+    table = table.take(np.where(rows >= 0, rows, num_cached - 1 - rows))
+    # The hash leaves names and paths out, so take this run's
+    table.theme_name = np.array(names, dtype=str)
+    table.theme_path = np.array(paths, dtype=str)
+    return table, len(todo)
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="WCAG contrast and palette statistics for every theme"
+    )
+    parser.add_argument("--themes", default=path.join(DATA_DIR, "themes.json"))
+    parser.add_argument("--out", default=SIDECAR_PATH)
+    parser.add_argument("--csv", help="Also write the table to this CSV file")
+    parser.add_argument(
+        "--rebuild", action="store_true", help="Ignore the existing --out"
+    )
+    args = parser.parse_args(argv)
+
+    cached = None
+    if path.exists(args.out) and not args.rebuild:
+        cached = ContrastTable.load(args.out)
+    with open(args.themes, "r") as f:
+        table, num_analyzed = build_contrast_table(iter_json_records(f), cached)
+    table.save(args.out)
+    if args.csv:
+        table.to_csv(args.csv)
+
+    print(f"{len(table)} themes, {num_analyzed} analyzed, the rest cached")
+    if len(table) > 0:
+        below = np.mean(table.editor_contrast < AA)
+        print(
+            f"Editor text below AA in {below:.1%} of themes, median share of "
+            f"colors below AA {np.median(table.below_aa):.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
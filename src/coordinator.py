@@ -0,0 +1,363 @@
+## Runs multiprocess_scraper workers on several machines against one crawl state.
+# One host serves the crawl state over HTTP and hands out expiring leases on
+# pending items; every node leases batches for its local workers and posts
+# their results back. Results are applied idempotently, so a lease completed
+# twice, or by a node whose lease had expired, does no harm.
+
+import argparse
+import json
+import socket
+from collections import Counter
+from multiprocessing import Process
+from os import getpid, path
+from threading import Event, Lock, Thread
+from time import sleep, time
+from typing import TYPE_CHECKING, Any, Optional
+
+import multiprocess_scraper
+from crawl_state import CrawlState
+from job_queue import JobQueue, ResultBatch, ResultQueue
+from metrics import Histogram
+from multiprocess_scraper import Collector, info, warn
+from rate_limit import Throttle
+from theme_scraper import EnhancedJSONEncoder, Theme
+
+if TYPE_CHECKING:
+    from http.server import HTTPServer
+
+PORT = 8765
+LEASE_SECONDS = 300
+# Renew outstanding leases this often, well before they expire
+RENEW_INTERVAL = LEASE_SECONDS / 3
+# How many batches of jobs a node keeps leased per local worker
+LEASED_BATCHES_PER_WORKER = 2
+REQUEST_TIMEOUT = 60  # seconds
+POLL_INTERVAL = 5  # seconds
+
+
+def encode_batch(batch: ResultBatch) -> str:
+    results = dict(batch.results)
+    if "metrics" in results:
+        results["metrics"] = [
+            [
+                # Not asdict(), which would rebuild the Counter from its items
+                [stage, worker, {**h.__dict__, "errors": dict(h.errors)}]
+                for (stage, worker), h in delta.items()
+            ]
+            for delta in results["metrics"]
+        ]
+    return json.dumps(
+        {"stage": batch.stage, "results": results, "completed": batch.completed},
+        cls=EnhancedJSONEncoder,
+    )
+
+
+def decode_batch(data: dict[str, Any]) -> ResultBatch:
+    results = data["results"]
+    if "metadata" in results:
+        results["metadata"] = [Theme(**m) for m in results["metadata"]]
+    if "metrics" in results:
+        results["metrics"] = [
+            {
+                (stage, worker): Histogram(**{**h, "errors": Counter(h["errors"])})
+                for stage, worker, h in delta
+            }
+            for delta in results["metrics"]
+        ]
+    return ResultBatch(data["stage"], results, data["completed"])
+
+
+def result_url(channel: str, item: Any) -> str:
+    return item.url if channel == "metadata" else item["url"]
+
+
+class Coordinator:
+    # Also usable in-process as the local stand-in for CoordinatorClient
+    def __init__(
+        self,
+        state: CrawlState,
+        collector: Collector,
+        job: str,
+        lease_seconds: float = LEASE_SECONDS,
+        max_attempts: Optional[int] = None,
+        failed_only=False,
+    ):
+        self.state = state
+        self.collector = collector
+        self.job = job
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts or multiprocess_scraper.MAX_ATTEMPTS
+        self.failed_only = failed_only
+        self.lock = Lock()
+        self.finished = Event()
+
+    def lease(self, node: str, n: int) -> tuple[list[tuple[str, str]], bool]:
+        # Returns (url, lease id) pairs, and whether the crawl is over
+        with self.lock:
+            granted = self.state.lease(
+                self.job,
+                node,
+                n,
+                self.lease_seconds,
+                self.max_attempts,
+                self.failed_only,
+            )
+            if len(granted) == 0 and self.state.active_leases(self.job) == 0:
+                self.finished.set()
+            return granted, self.finished.is_set()
+
+    def renew(self, lease_ids: list[str]):
+        with self.lock:
+            self.state.renew(lease_ids, self.lease_seconds)
+
+    def complete(self, lease_ids: list[str], batch: ResultBatch):
+        with self.lock:
+            held, duplicate = self.state.complete_leases(lease_ids)
+            # Late results from expired leases still count if nobody beat them
+            keep = lambda url: url in held or (
+                url not in duplicate and not self.state.is_done(self.job, url)
+            )
+            out = ResultBatch(batch.stage)
+            kept = set()
+            for channel in ["metadata", "themes", "failed"]:
+                for item in batch.results.get(channel, []):
+                    if keep(result_url(channel, item)):
+                        kept.add(result_url(channel, item))
+                        out.add(channel, item)
+            out.completed = len(kept)
+            for channel in ["parsers", "cache"] if len(kept) > 0 else []:
+                for item in batch.results.get(channel, []):
+                    out.add(channel, item)
+            for delta in batch.results.get("metrics", []):
+                out.add("metrics", delta)
+            self.collector.add(out)
+
+    def flush(self):
+        with self.lock:
+            self.collector.flush()
+
+
+def handler_class(coordinator: Coordinator) -> type:
+    # Nodes never serve, so only the coordinator imports http.server
+    from http.server import BaseHTTPRequestHandler
+
+    class CoordinatorHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            if self.path == "/lease":
+                granted, done = coordinator.lease(body["node"], body["n"])
+                out = {"jobs": granted, "done": done}
+            elif self.path == "/renew":
+                coordinator.renew(body["leases"])
+                out = {}
+            elif self.path == "/complete":
+                coordinator.complete(body["leases"], decode_batch(body["batch"]))
+                out = {}
+            else:
+                self.send_error(404)
+                return
+            data = json.dumps(out).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return CoordinatorHandler
+
+
+class CoordinatorClient:
+    def __init__(self, base_url: str):
+        # Imported here, so that serving the crawl state doesn't pay for it
+        import requests
+
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+
+    def post(self, route: str, payload: str) -> dict[str, Any]:
+        res = self.session.post(
+            self.base_url + route,
+            data=payload,
+            headers={"Content-Type": "application/json"},
+            timeout=REQUEST_TIMEOUT,
+        )
+        res.raise_for_status()
+        return res.json()
+
+    def lease(self, node: str, n: int) -> tuple[list[tuple[str, str]], bool]:
+        out = self.post("/lease", json.dumps({"node": node, "n": n}))
+        return [tuple(job) for job in out["jobs"]], out["done"]
+
+    def renew(self, lease_ids: list[str]):
+        self.post("/renew", json.dumps({"leases": lease_ids}))
+
+    def complete(self, lease_ids: list[str], batch: ResultBatch):
+        self.post(
+            "/complete",
+            f'{{"leases": {json.dumps(lease_ids)}, "batch": {encode_batch(batch)}}}',
+        )
+
+
+def start_workers(
+    job: str, jobs: JobQueue, results: ResultQueue, num_workers: int
+) -> list[Process]:
+    throttle = None
+    if multiprocess_scraper.THROTTLE:
+        throttle = Throttle(workers=num_workers)
+    workers = []
+    for i in range(num_workers):
+        if job == "metadata":
+            args = (jobs, results, throttle)
+            target = multiprocess_scraper.scrape
+        else:
+            download_dir = path.join(
+                multiprocess_scraper.TEMP_DIR, f"node_{getpid()}_analyzer_{i}"
+            )
+            args = (jobs, results, download_dir, throttle)
+            target = multiprocess_scraper.analyze_vsix
+        workers.append(multiprocess_scraper.start_worker(target, *args))
+    return workers
+
+
+def run_node(
+    coordinator: Coordinator | CoordinatorClient,
+    job: str,
+    num_workers: int,
+    node: Optional[str] = None,
+):
+    # Keeps num_workers local workers busy with leased jobs until the
+    # coordinator has nothing left
+    node = node or f"{socket.gethostname()}-{getpid()}"
+    batch_size = multiprocess_scraper.JOB_BATCH_SIZE
+    jobs = JobQueue(batch_size=batch_size)
+    results = ResultQueue()
+    workers = start_workers(job, jobs, results, num_workers)
+    leases: dict[str, str] = {}
+    done = False
+    closed = False
+    last_renew = time()
+
+    def refill():
+        nonlocal done, closed
+        while (
+            not done
+            and len(leases) < LEASED_BATCHES_PER_WORKER * batch_size * num_workers
+        ):
+            granted, done = coordinator.lease(node, batch_size * num_workers)
+            if len(granted) == 0:
+                break
+            leases.update(granted)
+            jobs.put(url for url, _ in granted)
+        if done and len(leases) == 0 and not closed:
+            jobs.close(num_workers)
+            closed = True
+
+    refill()
+    for batch in results.collect(workers, timeout=POLL_INTERVAL):
+        if batch is not None:
+            urls = {
+                result_url(channel, item)
+                for channel in ["metadata", "themes", "failed"]
+                for item in batch.results.get(channel, [])
+            }
+            coordinator.complete([leases.pop(u) for u in urls if u in leases], batch)
+        if len(leases) > 0 and time() - last_renew >= RENEW_INTERVAL:
+            coordinator.renew(list(leases.values()))
+            last_renew = time()
+        if not done or len(leases) == 0:
+            refill()
+    for p in workers:
+        p.join()
+    if len(leases) > 0:
+        warn(f"[Node {node}] {len(leases)} leased jobs left unfinished")
+
+
+def serve(
+    coordinator: Coordinator, host: str = "", port: int = PORT
+) -> tuple["HTTPServer", Thread]:
+    from http.server import HTTPServer
+
+    server = HTTPServer((host, port), handler_class(coordinator))
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, thread
+
+
+def wait_until_finished(coordinator: Coordinator):
+    while not coordinator.finished.wait(multiprocess_scraper.CHECKPOINT_INTERVAL):
+        coordinator.flush()
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Coordinate a crawl across several nodes"
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name, help in [
+        ("serve", "Serve the crawl state to nodes"),
+        ("work", "Run a node against a coordinator"),
+        ("local", "Serve and run several nodes on this machine"),
+    ]:
+        p = sub.add_parser(name, help=help)
+        p.add_argument("--job", choices=["metadata", "vsix"], default="vsix")
+        if name != "work":
+            p.add_argument("--port", type=int, default=PORT)
+            p.add_argument("--lease-seconds", type=float, default=LEASE_SECONDS)
+            p.add_argument("--failed-only", action="store_true")
+        if name != "serve":
+            p.add_argument("--workers", type=int, default=4, help="Per node")
+        if name == "work":
+            p.add_argument("--url", default=f"http://localhost:{PORT}")
+            p.add_argument("--node", help="Defaults to hostname-pid")
+        if name == "local":
+            p.add_argument("--nodes", type=int, default=2)
+    args = parser.parse_args(argv)
+
+    if args.command == "work":
+        run_node(CoordinatorClient(args.url), args.job, args.workers, args.node)
+        return
+
+    state = CrawlState(multiprocess_scraper.STATE_DB, cls=EnhancedJSONEncoder)
+    collector = Collector(state, {args.job: None})
+    coordinator = Coordinator(
+        state,
+        collector,
+        args.job,
+        lease_seconds=args.lease_seconds,
+        failed_only=args.failed_only,
+    )
+    server, _ = serve(coordinator, port=args.port)
+    info(f"[Coordinator] Serving {args.job} jobs on port {server.server_port}")
+    nodes = []
+    if args.command == "local":
+        url = f"http://localhost:{server.server_port}"
+        for i in range(args.nodes):
+            nodes.append(
+                multiprocess_scraper.start_worker(
+                    run_node,
+                    CoordinatorClient(url),
+                    args.job,
+                    args.workers,
+                    f"local-{i}",
+                )
+            )
+    wait_until_finished(coordinator)
+    for p in nodes:
+        p.join()
+    if args.command == "serve":
+        # Give remote nodes a chance to hear that we're done
+        sleep(2 * POLL_INTERVAL)
+    server.shutdown()
+    collector.close()
+    collector.print_summary()
+    multiprocess_scraper.export_dataset(
+        state, metadata=args.job == "metadata", themes=args.job == "vsix"
+    )
+    state.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,453 @@
+import json
+import sqlite3
+from os import makedirs, path
+from time import time
+from typing import Any, Iterable, Iterator, Optional, Type
+
+import gallery_api
+
+MAX_ATTEMPTS = 3
+STAGES = ["metadata", "download", "analysis"]
+# The stages each kind of worker job goes through
+JOBS = {"metadata": ["metadata"], "vsix": ["download", "analysis"]}
+# Failures that will fail the same way however many times we retry
+PERMANENT_ERRORS = ["[Analysis] Not a theme extension"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    item_name TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    metadata TEXT,
+    {stage_columns},
+    version TEXT,
+    last_updated TEXT,
+    removed_at REAL
+);
+CREATE TABLE IF NOT EXISTS themes (
+    item_name TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    record TEXT NOT NULL,
+    PRIMARY KEY (item_name, idx)
+);
+CREATE TABLE IF NOT EXISTS leases (
+    item_name TEXT NOT NULL,
+    job TEXT NOT NULL,
+    lease_id TEXT NOT NULL UNIQUE,
+    node TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    completed_at REAL,
+    -- Times the item was handed out without a result coming back
+    grants INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (item_name, job)
+);
+""".format(
+    stage_columns=",\n    ".join(
+        f"{stage}_status TEXT NOT NULL DEFAULT 'pending',\n"
+        f"    {stage}_attempts INTEGER NOT NULL DEFAULT 0,\n"
+        f"    {stage}_error TEXT,\n"
+        f"    {stage}_updated_at REAL"
+        for stage in STAGES
+    )
+)
+
+
+# Columns added since the first release of the schema, for older state files
+MIGRATIONS = {
+    "version": "ALTER TABLE items ADD COLUMN version TEXT",
+    "last_updated": "ALTER TABLE items ADD COLUMN last_updated TEXT",
+    "removed_at": "ALTER TABLE items ADD COLUMN removed_at REAL",
+}
+
+
+def has_changed(known: tuple[Optional[str], Optional[str], Any], entry: dict) -> bool:
+    # Whether a theme list entry needs an item's (version, last_updated,
+    # removed_at) fetched again. Items we have no version for count as changed,
+    # as we can't tell which version their results are for.
+    version, last_updated, removed_at = known
+    return removed_at is not None or (
+        entry.get("version") is not None
+        and (version, last_updated) != (entry.get("version"), entry.get("lastUpdated"))
+    )
+
+
+class CrawlState:
+    def __init__(self, fpath: str, cls: Optional[Type[json.JSONEncoder]] = None):
+        makedirs(path.dirname(fpath) or ".", exist_ok=True)
+        self.cls = cls
+        # The coordinator uses it from its server thread, behind its own lock
+        self.db = sqlite3.connect(fpath, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(items)")}
+        for column, statement in MIGRATIONS.items():
+            if column not in columns:
+                self.db.execute(statement)
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def commit(self):
+        self.db.commit()
+
+    def add_urls(self, urls: Iterable[str]):
+        self.add_entries({"url": url} for url in urls)
+
+    def add_entries(self, entries: Iterable[dict[str, Any]]):
+        # Theme list entries (gallery_api.list_themes), with the version and
+        # lastUpdated recorded for new items. Items we already have keep theirs,
+        # as their results may be for an older version.
+        self.db.executemany(
+            """
+            INSERT OR IGNORE INTO items (item_name, url, version, last_updated)
+            VALUES (?, ?, ?, ?)
+            """,
+            (
+                (
+                    gallery_api.item_name_from_url(entry["url"]),
+                    entry["url"],
+                    entry.get("version"),
+                    entry.get("lastUpdated"),
+                )
+                for entry in entries
+            ),
+        )
+        self.db.commit()
+
+    def _pending_conditions(
+        self, job: str, max_attempts: int, failed_only: bool
+    ) -> tuple[list[str], list[Any]]:
+        stages = JOBS[job]
+        conditions = [f"{stages[-1]}_status != 'done'", "removed_at IS NULL"]
+        params = []
+        for stage in stages:
+            conditions.append(
+                f"""{stage}_attempts < ? AND ({stage}_error IS NULL
+                OR {stage}_error NOT IN ({",".join("?" * len(PERMANENT_ERRORS))}))"""
+            )
+            params.extend([max_attempts, *PERMANENT_ERRORS])
+        if failed_only:
+            conditions.append(
+                "("
+                + " OR ".join(f"{stage}_status = 'failed'" for stage in stages)
+                + ")"
+            )
+        return conditions, params
+
+    def pending(
+        self, job: str, max_attempts: int = MAX_ATTEMPTS, failed_only=False
+    ) -> list[str]:
+        conditions, params = self._pending_conditions(job, max_attempts, failed_only)
+        rows = self.db.execute(
+            f"SELECT url FROM items WHERE {' AND '.join(conditions)} ORDER BY rowid",
+            params,
+        )
+        return [row[0] for row in rows]
+
+    def settled(self, job: str, max_attempts: int = MAX_ATTEMPTS) -> set[str]:
+        # Items pending() won't hand out: done, given up on or removed
+        conditions, params = self._pending_conditions(job, max_attempts, False)
+        rows = self.db.execute(
+            f"SELECT url FROM items WHERE NOT ({' AND '.join(conditions)})", params
+        )
+        return {row[0] for row in rows}
+
+    def downloaded(self) -> list[str]:
+        rows = self.db.execute(
+            """
+            SELECT url FROM items
+            WHERE download_status = 'done' AND removed_at IS NULL ORDER BY rowid
+            """
+        )
+        return [row[0] for row in rows]
+
+    def versions(self) -> dict[str, str]:
+        # url: version, as last recorded from the theme list
+        rows = self.db.execute(
+            "SELECT url, version FROM items WHERE version IS NOT NULL"
+        )
+        return dict(rows.fetchall())
+
+    def is_done(self, job: str, url: str) -> bool:
+        row = self.db.execute(
+            f"SELECT {JOBS[job][-1]}_status FROM items WHERE item_name = ?",
+            (gallery_api.item_name_from_url(url),),
+        ).fetchone()
+        return row is not None and row[0] == "done"
+
+    ## Leases
+    # Pending items are handed out to one node at a time until their lease
+    # expires. Items that were handed out max_attempts times without any result
+    # coming back are given up on, like any other failing item.
+
+    def lease(
+        self,
+        job: str,
+        node: str,
+        n: int,
+        lease_seconds: float,
+        max_attempts: int = MAX_ATTEMPTS,
+        failed_only=False,
+    ) -> list[tuple[str, str]]:
+        from uuid import uuid4
+
+        now = time()
+        conditions, params = self._pending_conditions(job, max_attempts, failed_only)
+        rows = self.db.execute(
+            f"""
+            SELECT item_name, url FROM items
+            WHERE {' AND '.join(conditions)} AND NOT EXISTS (
+                SELECT 1 FROM leases
+                WHERE leases.item_name = items.item_name AND leases.job = ?
+                AND leases.completed_at IS NULL
+                AND (leases.expires_at > ? OR leases.grants >= ?)
+            )
+            ORDER BY rowid LIMIT ?
+            """,
+            [*params, job, now, max_attempts, n],
+        ).fetchall()
+        out = []
+        for item_name, url in rows:
+            lease_id = uuid4().hex
+            self.db.execute(
+                """
+                INSERT INTO leases (item_name, job, lease_id, node, expires_at, grants)
+                VALUES (?, ?, ?, ?, ?, 1)
+                ON CONFLICT (item_name, job) DO UPDATE SET
+                    lease_id = excluded.lease_id,
+                    node = excluded.node,
+                    expires_at = excluded.expires_at,
+                    completed_at = NULL,
+                    grants = leases.grants + 1
+                """,
+                (item_name, job, lease_id, node, now + lease_seconds),
+            )
+            out.append((url, lease_id))
+        self.db.commit()
+        return out
+
+    def renew(self, lease_ids: list[str], lease_seconds: float):
+        self.db.executemany(
+            """
+            UPDATE leases SET expires_at = ?
+            WHERE lease_id = ? AND completed_at IS NULL
+            """,
+            ((time() + lease_seconds, lease_id) for lease_id in lease_ids),
+        )
+        self.db.commit()
+
+    def complete_leases(self, lease_ids: list[str]) -> tuple[set[str], set[str]]:
+        # Returns the urls of leases that were still open, which are now
+        # completed, and of leases that had already been completed before
+        held, duplicate = set(), set()
+        for lease_id in lease_ids:
+            row = self.db.execute(
+                """
+                SELECT items.url, leases.completed_at FROM leases
+                JOIN items ON items.item_name = leases.item_name
+                WHERE leases.lease_id = ?
+                """,
+                (lease_id,),
+            ).fetchone()
+            if row is None:
+                continue
+            if row[1] is not None:
+                duplicate.add(row[0])
+                continue
+            held.add(row[0])
+            self.db.execute(
+                """
+                UPDATE leases SET completed_at = ?, grants = 0 WHERE lease_id = ?
+                """,
+                (time(), lease_id),
+            )
+        return held, duplicate
+
+    def active_leases(self, job: str) -> int:
+        row = self.db.execute(
+            """
+            SELECT COUNT(*) FROM leases
+            WHERE job = ? AND completed_at IS NULL AND expires_at > ?
+            """,
+            (job, time()),
+        ).fetchone()
+        return row[0]
+
+    def listed(self) -> dict[str, tuple[Optional[str], Optional[str], Any]]:
+        # item_name: (version, last_updated, removed_at), to compare theme list
+        # entries against with has_changed()
+        rows = self.db.execute(
+            "SELECT item_name, version, last_updated, removed_at FROM items"
+        )
+        return {name: tuple(known) for name, *known in rows}
+
+    def sync_list(
+        self, entries: list[dict[str, Any]], remove_unlisted=True
+    ) -> dict[str, Any]:
+        # Diffs a theme list (gallery_api.list_themes) against the versions we
+        # have, sending new and updated items back through every stage and
+        # marking the ones that disappeared. Without remove_unlisted, entries
+        # can be one page of the list at a time, see remove_unlisted().
+        delta = {"added": [], "updated": [], "removed": [], "unchanged": 0}
+        reset = ", ".join(
+            f"{stage}_status = 'pending', {stage}_attempts = 0, {stage}_error = NULL"
+            for stage in STAGES
+        )
+        for entry in entries:
+            name = gallery_api.item_name_from_url(entry["url"])
+            version, last_updated = entry.get("version"), entry.get("lastUpdated")
+            known = self.db.execute(
+                """
+                SELECT version, last_updated, removed_at FROM items
+                WHERE item_name = ?
+                """,
+                (name,),
+            ).fetchone()
+            if known is None:
+                self.db.execute(
+                    """
+                    INSERT INTO items (item_name, url, version, last_updated)
+                    VALUES (?, ?, ?, ?)
+                    """,
+                    (name, entry["url"], version, last_updated),
+                )
+                delta["added"].append(entry["url"])
+            elif has_changed(known, entry):
+                self.db.execute(
+                    f"""
+                    UPDATE items SET {reset}, version = ?, last_updated = ?,
+                        removed_at = NULL
+                    WHERE item_name = ?
+                    """,
+                    (version, last_updated, name),
+                )
+                delta["updated"].append(
+                    {
+                        "url": entry["url"],
+                        "from": known[0],
+                        "to": version,
+                        "lastUpdated": last_updated,
+                    }
+                )
+            else:
+                self.db.execute(
+                    "UPDATE items SET version = ?, last_updated = ? WHERE item_name = ?",
+                    (version, last_updated, name),
+                )
+                delta["unchanged"] += 1
+        if remove_unlisted:
+            delta["removed"] = self.remove_unlisted(entry["url"] for entry in entries)
+        self.db.commit()
+        return delta
+
+    def remove_unlisted(self, urls: Iterable[str]) -> list[str]:
+        # Marks the items missing from a complete theme list as removed, and
+        # returns their urls
+        listed = {gallery_api.item_name_from_url(url) for url in urls}
+        rows = self.db.execute(
+            "SELECT item_name, url FROM items WHERE removed_at IS NULL"
+        ).fetchall()
+        now = time()
+        removed = []
+        for name, url in rows:
+            if name not in listed:
+                self.db.execute(
+                    "UPDATE items SET removed_at = ? WHERE item_name = ?", (now, name)
+                )
+                removed.append(url)
+        self.db.commit()
+        return removed
+
+    def _set_status(self, url: str, stage: str, status: str, err: Optional[str] = None):
+        self.db.execute(
+            f"""
+            UPDATE items SET
+                {stage}_status = ?,
+                {stage}_attempts = {stage}_attempts + 1,
+                {stage}_error = ?,
+                {stage}_updated_at = ?
+            WHERE item_name = ?
+            """,
+            (status, err, time(), gallery_api.item_name_from_url(url)),
+        )
+
+    def record_metadata(self, url: str, metadata: Any):
+        self.db.execute(
+            "UPDATE items SET metadata = ? WHERE item_name = ?",
+            (
+                json.dumps(metadata, cls=self.cls),
+                gallery_api.item_name_from_url(url),
+            ),
+        )
+        self._set_status(url, "metadata", "done")
+
+    def record_themes(self, url: str, themes: list[dict[str, Any]]):
+        name = gallery_api.item_name_from_url(url)
+        self.db.execute("DELETE FROM themes WHERE item_name = ?", (name,))
+        self.db.executemany(
+            "INSERT INTO themes (item_name, idx, path, record) VALUES (?, ?, ?, ?)",
+            (
+                (name, i, theme["theme"]["path"], json.dumps(theme, cls=self.cls))
+                for i, theme in enumerate(themes)
+            ),
+        )
+        self._set_status(url, "download", "done")
+        self._set_status(url, "analysis", "done")
+
+    def record_failure(self, url: str, stage: str, reason: str):
+        if stage == "analysis":
+            self._set_status(url, "download", "done")
+        self._set_status(url, stage, "failed", reason)
+
+    def iter_metadata(self, include_removed=False) -> Iterator[Any]:
+        rows = self.db.execute(
+            f"""
+            SELECT metadata FROM items WHERE metadata IS NOT NULL
+            {"" if include_removed else "AND removed_at IS NULL"}
+            ORDER BY rowid
+            """
+        )
+        for row in rows:
+            yield json.loads(row[0])
+
+    def iter_themes(self, include_removed=False) -> Iterator[dict[str, Any]]:
+        rows = self.db.execute(
+            f"""
+            SELECT themes.record FROM themes
+            JOIN items ON items.item_name = themes.item_name
+            {"" if include_removed else "WHERE items.removed_at IS NULL"}
+            ORDER BY items.rowid, themes.idx
+            """
+        )
+        for row in rows:
+            yield json.loads(row[0])
+
+    def failures(self, stages: list[str]) -> list[dict[str, str]]:
+        out = []
+        for stage in stages:
+            rows = self.db.execute(
+                f"""
+                SELECT url, {stage}_error FROM items
+                WHERE {stage}_status = 'failed' AND removed_at IS NULL
+                ORDER BY rowid
+                """
+            )
+            out.extend({"url": url, "reason": reason} for url, reason in rows)
+        return out
+
+    def summary(self) -> dict[str, dict[str, int]]:
+        out = {}
+        for stage in STAGES:
+            rows = self.db.execute(
+                f"SELECT {stage}_status, COUNT(*) FROM items GROUP BY {stage}_status"
+            )
+            out[stage] = dict(rows.fetchall())
+        return out
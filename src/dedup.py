@@ -0,0 +1,144 @@
+import argparse
+import hashlib
+import json
+from os import path, replace
+from typing import Any, Iterable, Iterator, Optional
+
+from json_array import write_json_array
+from postprocess import DATA_DIR, iter_json_records
+
+# Key of the stand-in a stored block is replaced with
+REF = "$block"
+# Theme keys holding a color map, and keys holding lists of token rules
+# ("settings" being where tmTheme plists keep theirs)
+MAP_KEYS = ["colors", "semanticTokenColors"]
+RULE_KEYS = ["tokenColors", "settings"]
+ID_BYTES = 12
+
+# Variants of one theme, and themes forked from each other, tend to share their
+# color maps and most of their token rules. Deduplicating stores each distinct
+# map or rule once in a block store keyed by content hash, and puts a
+# {"$block": id} reference in its place in the theme.
+
+
+def block_id(block: Any) -> str:
+    data = json.dumps(block, sort_keys=True, separators=(",", ":"))
+    return hashlib.blake2b(data.encode("utf-8"), digest_size=ID_BYTES).hexdigest()
+
+
+def is_ref(value: Any) -> bool:
+    return isinstance(value, dict) and len(value) == 1 and REF in value
+
+
+class BlockStore:
+    def __init__(self, blocks: Optional[dict[str, Any]] = None):
+        self.blocks: dict[str, Any] = blocks if blocks is not None else {}
+        self.num_refs = 0
+
+    def put(self, block: Any) -> dict[str, str]:
+        key = block_id(block)
+        self.blocks.setdefault(key, block)
+        self.num_refs += 1
+        return {REF: key}
+
+    def compact(self, record: dict[str, Any]) -> dict[str, Any]:
+        # A copy of a themes.json record with its blocks moved into the store
+        contents = record["theme"]["contents"]
+        if not isinstance(contents, dict):
+            return record
+        contents = dict(contents)
+        for key in MAP_KEYS:
+            if isinstance(contents.get(key), dict) and not is_ref(contents[key]):
+                contents[key] = self.put(contents[key])
+        for key in RULE_KEYS:
+            if isinstance(contents.get(key), list):
+                contents[key] = [
+                    self.put(rule)
+                    if isinstance(rule, dict) and not is_ref(rule)
+                    else rule
+                    for rule in contents[key]
+                ]
+        return {**record, "theme": {**record["theme"], "contents": contents}}
+
+    def expand(self, record: dict[str, Any]) -> dict[str, Any]:
+        # The inverse of compact()
+        contents = record["theme"]["contents"]
+        if not isinstance(contents, dict):
+            return record
+        contents = dict(contents)
+        for key in MAP_KEYS:
+            if is_ref(contents.get(key)):
+                contents[key] = self.blocks[contents[key][REF]]
+        for key in RULE_KEYS:
+            if isinstance(contents.get(key), list):
+                contents[key] = [
+                    self.blocks[rule[REF]] if is_ref(rule) else rule
+                    for rule in contents[key]
+                ]
+        return {**record, "theme": {**record["theme"], "contents": contents}}
+
+    def save(self, fpath: str):
+        with open(fpath + ".tmp", "w") as f:
+            json.dump(self.blocks, f, separators=(",", ":"))
+        replace(fpath + ".tmp", fpath)
+
+    @classmethod
+    def load(cls, fpath: str) -> "BlockStore":
+        with open(fpath, "r") as f:
+            return cls(json.load(f))
+
+
+def compact_records(
+    records: Iterable[dict[str, Any]], store: BlockStore
+) -> Iterator[dict[str, Any]]:
+    for record in records:
+        yield store.compact(record)
+
+
+def expand_records(
+    records: Iterable[dict[str, Any]], store: BlockStore
+) -> Iterator[dict[str, Any]]:
+    for record in records:
+        yield store.expand(record)
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Store the color maps and token rules shared between themes once"
+    )
+    parser.add_argument("--themes", default=path.join(DATA_DIR, "themes.json"))
+    parser.add_argument(
+        "--out", default=path.join(DATA_DIR, "themes.dedup.json"), help="Themes"
+    )
+    parser.add_argument(
+        "--blocks", default=path.join(DATA_DIR, "theme_blocks.json"), help="Blocks"
+    )
+    parser.add_argument(
+        "--expand",
+        action="store_true",
+        help="Turn --out and --blocks back into a plain --themes file",
+    )
+    args = parser.parse_args(argv)
+
+    if args.expand:
+        store = BlockStore.load(args.blocks)
+        with open(args.out, "r") as src, open(args.themes + ".tmp", "w") as dst:
+            write_json_array(expand_records(iter_json_records(src), store), dst)
+        replace(args.themes + ".tmp", args.themes)
+        return
+
+    store = BlockStore()
+    with open(args.themes, "r") as src, open(args.out + ".tmp", "w") as dst:
+        write_json_array(compact_records(iter_json_records(src), store), dst)
+    replace(args.out + ".tmp", args.out)
+    store.save(args.blocks)
+    before = path.getsize(args.themes)
+    after = path.getsize(args.out) + path.getsize(args.blocks)
+    print(
+        f"{store.num_refs} blocks stored as {len(store.blocks)}, "
+        f"{before} -> {after} bytes ({after / max(before, 1):.1%})"
+    )
+
+
+if __name__ == "__main__":
+    main()
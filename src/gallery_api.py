@@ -0,0 +1,325 @@
+## Resources:
+# https://github.com/microsoft/vscode/blob/main/src/vs/platform/extensionManagement/common/extensionGalleryService.ts
+
+from time import sleep
+from typing import TYPE_CHECKING, Any, Iterator, Optional
+
+from rate_limit import MAX_RETRIES, THROTTLE_STATUSES, Throttle, backoff_delay
+
+# requests is imported once a session is opened, so that the URL helpers below
+# stay cheap to import
+if TYPE_CHECKING:
+    import requests
+
+MARKETPLACE_URL = "https://marketplace.visualstudio.com"
+ITEM_URL_PREFIX = f"{MARKETPLACE_URL}/items?itemName="
+EXTENSION_QUERY_PATH = "/_apis/public/gallery/extensionquery"
+API_VERSION = "3.0-preview.1"
+REQUEST_TIMEOUT = 30  # seconds
+DOWNLOAD_CHUNK_SIZE = 1 << 16
+POOL_SIZE = 16
+
+# FilterType
+FILTER_TAG = 1
+FILTER_EXTENSION_NAME = 7
+FILTER_CATEGORY = 5
+FILTER_TARGET = 8
+FILTER_EXCLUDE_WITH_FLAGS = 12
+
+# Flags
+INCLUDE_VERSIONS = 0x1
+INCLUDE_FILES = 0x2
+INCLUDE_CATEGORY_AND_TAGS = 0x4
+INCLUDE_VERSION_PROPERTIES = 0x10
+INCLUDE_ASSET_URI = 0x80
+INCLUDE_STATISTICS = 0x100
+INCLUDE_LATEST_VERSION_ONLY = 0x200
+UNPUBLISHED = 0x1000
+
+METADATA_FLAGS = (
+    INCLUDE_VERSIONS
+    | INCLUDE_FILES
+    | INCLUDE_CATEGORY_AND_TAGS
+    | INCLUDE_VERSION_PROPERTIES
+    | INCLUDE_ASSET_URI
+    | INCLUDE_STATISTICS
+    | INCLUDE_LATEST_VERSION_ONLY
+)
+
+LIST_FLAGS = INCLUDE_VERSIONS | INCLUDE_LATEST_VERSION_ONLY
+SORT_BY_INSTALLS = 4
+THEME_CRITERIA = [
+    {"filterType": FILTER_TARGET, "value": "Microsoft.VisualStudio.Code"},
+    {"filterType": FILTER_CATEGORY, "value": "Themes"},
+    {"filterType": FILTER_EXCLUDE_WITH_FLAGS, "value": str(UNPUBLISHED)},
+]
+PAGE_SIZE = 100
+NUM_PAGE_WORKERS = 8
+
+# Set in each worker to share request rate and concurrency limits with the
+# others, see rate_limit.Throttle
+throttle: Optional[Throttle] = None
+
+SOURCE_LINK_PROPERTIES = [
+    "Microsoft.VisualStudio.Services.Links.Source",
+    "Microsoft.VisualStudio.Services.Links.GitHub",
+    "Microsoft.VisualStudio.Services.Links.Repository",
+]
+
+
+def item_name_from_url(url: str) -> str:
+    return url.replace(ITEM_URL_PREFIX, "")
+
+
+def item_url(item_name: str) -> str:
+    return ITEM_URL_PREFIX + item_name
+
+
+def vsix_url(
+    item_name: str, version: str = "latest", base_url: str = MARKETPLACE_URL
+) -> str:
+    publisher, name = item_name.split(".", 1)
+    return (
+        f"{base_url}/_apis/public/gallery/publishers/{publisher}"
+        f"/vsextensions/{name}/{version}/vspackage"
+    )
+
+
+class HttpSessionContext:
+    def __init__(self, pool_size=POOL_SIZE, retries=3):
+        self.pool_size = pool_size
+        self.retries = retries
+
+    def __enter__(self):
+        # Throttled responses are retried by request(), this only covers
+        # connection errors. urllib3 would otherwise retry a 429 or 503 with a
+        # Retry-After itself, behind the throttle's back.
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        retry = Retry(
+            total=self.retries,
+            backoff_factor=0.5,
+            allowed_methods=None,
+            respect_retry_after_header=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+            max_retries=retry,
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        return self.session
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.session.close()
+
+
+def request(
+    session: "requests.Session", method: str, url: str, **kwargs
+) -> "requests.Response":
+    # Retries 429s and 5xxs with jittered exponential backoff, going through
+    # the shared throttle if this process has one
+    max_retries = throttle.max_retries if throttle is not None else MAX_RETRIES
+    for attempt in range(max_retries + 1):
+        if throttle is not None:
+            with throttle.slot() as outcome:
+                res = session.request(method, url, **kwargs)
+                outcome["throttled"] = res.status_code in THROTTLE_STATUSES
+        else:
+            res = session.request(method, url, **kwargs)
+        if res.status_code not in THROTTLE_STATUSES or attempt == max_retries:
+            return res
+        delay = backoff_delay(attempt, res.headers.get("Retry-After"))
+        res.close()
+        sleep(delay)
+    return res
+
+
+def query_extensions(
+    session: "requests.Session",
+    criteria: list[dict[str, Any]],
+    flags: int = METADATA_FLAGS,
+    page_number: int = 1,
+    page_size: int = 1,
+    sort_by: int = 0,
+    base_url: str = MARKETPLACE_URL,
+) -> dict[str, Any]:
+    res = request(
+        session,
+        "POST",
+        base_url + EXTENSION_QUERY_PATH,
+        json={
+            "filters": [
+                {
+                    "criteria": criteria,
+                    "pageNumber": page_number,
+                    "pageSize": page_size,
+                    "sortBy": sort_by,
+                    "sortOrder": 0,
+                }
+            ],
+            "flags": flags,
+        },
+        headers={"Accept": f"application/json;api-version={API_VERSION}"},
+        timeout=REQUEST_TIMEOUT,
+    )
+    res.raise_for_status()
+    return res.json()["results"][0]
+
+
+def get_extension(
+    session: "requests.Session",
+    item_name: str,
+    flags: int = METADATA_FLAGS,
+    base_url: str = MARKETPLACE_URL,
+) -> Optional[dict[str, Any]]:
+    result = query_extensions(
+        session,
+        [
+            {"filterType": FILTER_TARGET, "value": "Microsoft.VisualStudio.Code"},
+            {"filterType": FILTER_EXTENSION_NAME, "value": item_name},
+        ],
+        flags=flags,
+        base_url=base_url,
+    )
+    extensions = result.get("extensions", [])
+    return extensions[0] if len(extensions) > 0 else None
+
+
+def get_latest_version(
+    session: "requests.Session", item_name: str, base_url: str = MARKETPLACE_URL
+) -> Optional[str]:
+    extension = get_extension(
+        session,
+        item_name,
+        flags=INCLUDE_VERSIONS | INCLUDE_LATEST_VERSION_ONLY,
+        base_url=base_url,
+    )
+    if extension is None or len(extension.get("versions", [])) == 0:
+        return None
+    return extension["versions"][0]["version"]
+
+
+def get_statistic(extension: dict[str, Any], name: str, default: float = 0) -> float:
+    for stat in extension.get("statistics", []):
+        if stat["statisticName"] == name:
+            return stat["value"]
+    return default
+
+
+def get_version_property(extension: dict[str, Any], names: list[str]) -> Optional[str]:
+    versions = extension.get("versions", [])
+    if len(versions) == 0:
+        return None
+    properties = {p["key"]: p["value"] for p in versions[0].get("properties", [])}
+    for name in names:
+        if properties.get(name):
+            return properties[name]
+    return None
+
+
+def download(
+    session: "requests.Session", url: str, retries: int = 3, timeout=REQUEST_TIMEOUT
+) -> bytes:
+    # Ask for the raw bytes so that Range offsets line up with what we've received
+    import requests
+
+    buf = bytearray()
+    for attempt in range(retries + 1):
+        headers = {"Accept-Encoding": "identity"}
+        if len(buf) > 0:
+            headers["Range"] = f"bytes={len(buf)}-"
+        try:
+            with request(
+                session, "GET", url, headers=headers, stream=True, timeout=timeout
+            ) as res:
+                res.raise_for_status()
+                if len(buf) > 0 and res.status_code != 206:
+                    # Server ignored the Range header, start over
+                    buf.clear()
+                expected = res.headers.get("Content-Length")
+                received = 0
+                for chunk in res.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    buf.extend(chunk)
+                    received += len(chunk)
+                if expected is not None and received < int(expected):
+                    raise requests.ConnectionError(
+                        f"Incomplete download ({received}/{expected} bytes)"
+                    )
+                return bytes(buf)
+        except (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+        ) as e:
+            if attempt == retries:
+                raise e
+    return bytes(buf)
+
+
+def get_result_count(result: dict[str, Any]) -> int:
+    for metadata in result.get("resultMetadata", []):
+        if metadata["metadataType"] == "ResultCount":
+            for item in metadata["metadataItems"]:
+                if item["name"] == "TotalCount":
+                    return item["count"]
+    return 0
+
+
+def list_entry(extension: dict[str, Any]) -> dict[str, Any]:
+    versions = extension.get("versions", [])
+    return {
+        "url": item_url(
+            f"{extension['publisher']['publisherName']}.{extension['extensionName']}"
+        ),
+        "version": versions[0]["version"] if len(versions) > 0 else None,
+        "lastUpdated": extension.get("lastUpdated"),
+    }
+
+
+def iter_theme_pages(
+    session: "requests.Session",
+    page_size: int = PAGE_SIZE,
+    max_workers: int = NUM_PAGE_WORKERS,
+    base_url: str = MARKETPLACE_URL,
+) -> Iterator[list[dict[str, Any]]]:
+    # The first page tells us how many pages there are, the rest are fetched
+    # concurrently and yielded in order
+    from concurrent.futures import ThreadPoolExecutor
+
+    fetch = lambda page_number: query_extensions(
+        session,
+        THEME_CRITERIA,
+        flags=LIST_FLAGS,
+        page_number=page_number,
+        page_size=page_size,
+        sort_by=SORT_BY_INSTALLS,
+        base_url=base_url,
+    )
+    first = fetch(1)
+    yield [list_entry(e) for e in first.get("extensions", [])]
+    num_pages = -(-get_result_count(first) // page_size)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for result in executor.map(fetch, range(2, num_pages + 1)):
+            yield [list_entry(e) for e in result.get("extensions", [])]
+
+
+def list_themes(
+    session: "requests.Session",
+    page_size: int = PAGE_SIZE,
+    max_workers: int = NUM_PAGE_WORKERS,
+    base_url: str = MARKETPLACE_URL,
+) -> list[dict[str, Any]]:
+    # Install counts can shift items across page boundaries mid-crawl
+    seen = set()
+    out = []
+    for page in iter_theme_pages(session, page_size, max_workers, base_url):
+        for entry in page:
+            if entry["url"] not in seen:
+                seen.add(entry["url"])
+                out.append(entry)
+    return out
@@ -0,0 +1,108 @@
+from dataclasses import dataclass, field
+from multiprocessing import Process, Queue
+from queue import Empty
+from typing import Any, Iterable, Iterator, Optional
+
+import metrics
+
+BATCH_SIZE = 16
+POLL_INTERVAL = 1  # seconds
+
+# Put on a JobQueue once per worker, and on a ResultQueue by each exiting worker
+SENTINEL = None
+
+
+class JobQueue:
+    # With max_batches, put() blocks while that many batches are waiting
+    def __init__(self, batch_size: int = BATCH_SIZE, max_batches: int = 0):
+        self.queue = Queue(max_batches)
+        self.batch_size = batch_size
+
+    def put(self, jobs: Iterable[Any]) -> int:
+        num_jobs = 0
+        batch = []
+        for job in jobs:
+            batch.append(job)
+            if len(batch) == self.batch_size:
+                self.queue.put(batch)
+                num_jobs += len(batch)
+                batch = []
+        if len(batch) > 0:
+            self.queue.put(batch)
+            num_jobs += len(batch)
+        return num_jobs
+
+    def close(self, num_workers: int):
+        for _ in range(num_workers):
+            self.queue.put(SENTINEL)
+
+    def batches(self) -> Iterator[list[Any]]:
+        while True:
+            with metrics.timer("queue_get"):
+                batch = self.queue.get()
+            if batch is SENTINEL:
+                return
+            yield batch
+
+
+@dataclass
+class ResultBatch:
+    stage: str
+    results: dict[str, list[Any]] = field(default_factory=dict)
+    completed: int = 0
+
+    def add(self, channel: str, item: Any):
+        self.results.setdefault(channel, []).append(item)
+
+
+class ResultBatcher:
+    def __init__(self, queue: Queue, stage: str):
+        self.queue = queue
+        self.batch = ResultBatch(stage)
+
+    def add(self, channel: str, item: Any):
+        self.batch.add(channel, item)
+
+    def job_done(self, n: int = 1):
+        self.batch.completed += n
+
+    def flush(self):
+        metrics.attach(self.batch)
+        if self.batch.completed > 0 or len(self.batch.results) > 0:
+            with metrics.timer("queue_put"):
+                self.queue.put(self.batch)
+            self.batch = ResultBatch(self.batch.stage)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+        self.queue.put(SENTINEL)
+
+
+class ResultQueue:
+    def __init__(self):
+        self.queue = Queue()
+
+    def batcher(self, stage: str) -> ResultBatcher:
+        return ResultBatcher(self.queue, stage)
+
+    def collect(
+        self, workers: list[Process], timeout: float = POLL_INTERVAL
+    ) -> Iterator[Optional[ResultBatch]]:
+        # Yields None every `timeout` seconds without results so callers can do
+        # periodic work. Stops once every worker has signed off, or has died.
+        num_running = len(workers)
+        while num_running > 0:
+            try:
+                batch = self.queue.get(timeout=timeout)
+            except Empty:
+                if not any(p.is_alive() for p in workers):
+                    return
+                yield None
+                continue
+            if batch is SENTINEL:
+                num_running -= 1
+            else:
+                yield batch
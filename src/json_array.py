@@ -0,0 +1,15 @@
+import json
+from typing import Any, Iterable, Optional, Type
+
+
+def write_json_array(
+    records: Iterable[Any], f, cls: Optional[Type[json.JSONEncoder]] = None
+):
+    # Same layout as json.dump(list(records), f, indent=2), one record at a time
+    f.write("[")
+    empty = True
+    for record in records:
+        f.write(("\n  " if empty else ",\n  "))
+        f.write(json.dumps(record, indent=2, cls=cls).replace("\n", "\n  "))
+        empty = False
+    f.write("]" if empty else "\n]")
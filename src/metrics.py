@@ -0,0 +1,280 @@
+import json
+import os
+from bisect import bisect_left
+from collections import Counter
+from multiprocessing import current_process
+from os import makedirs, path, replace
+from threading import Lock, current_thread
+from time import perf_counter, time
+from typing import Any, Optional
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    float("inf"),
+)
+MAX_ERROR_CLASS_LEN = 60
+PROMETHEUS_PREFIX = "vscode_theme_scraper"
+
+# Off unless a process turns it on, in which case every timer() records into
+# this process's registry. Workers ship what they recorded to the collector
+# with their result batches, see attach().
+enabled = False
+
+
+class Histogram:
+    # A plain class rather than a dataclass, which would cost every command
+    # that merely imports this module the import of dataclasses and inspect
+    def __init__(
+        self,
+        buckets: Optional[list[int]] = None,
+        count: int = 0,
+        sum: float = 0,
+        errors: Optional[Counter] = None,
+    ):
+        self.buckets = buckets if buckets is not None else [0] * len(BUCKETS)
+        self.count = count
+        self.sum = sum
+        self.errors = errors if errors is not None else Counter()
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Histogram) and self.__dict__ == other.__dict__
+
+    def observe(self, seconds: float, error: Optional[str] = None):
+        self.buckets[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if error is not None:
+            self.errors[error] += 1
+
+    def merge(self, other: "Histogram"):
+        for i, n in enumerate(other.buckets):
+            self.buckets[i] += n
+        self.count += other.count
+        self.sum += other.sum
+        self.errors.update(other.errors)
+
+    def quantile(self, q: float) -> float:
+        # Interpolates within the bucket holding the q-th observation
+        if self.count == 0:
+            return 0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            if seen + n >= rank and n > 0:
+                lower = BUCKETS[i - 1] if i > 0 else 0
+                upper = BUCKETS[i] if BUCKETS[i] != float("inf") else lower
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return BUCKETS[-2]
+
+
+class Registry:
+    # Histograms keyed by (stage, worker)
+    def __init__(self):
+        self.lock = Lock()
+        self.histograms: dict[tuple[str, str], Histogram] = {}
+        self.start = time()
+
+    def observe(
+        self, stage: str, seconds: float, error: Optional[str] = None, worker=None
+    ):
+        key = (stage, worker or worker_name())
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(seconds, error)
+
+    def drain(self) -> dict[tuple[str, str], Histogram]:
+        # Everything recorded since the last drain
+        with self.lock:
+            out = self.histograms
+            self.histograms = {}
+        return out
+
+    def merge(self, delta: dict[tuple[str, str], Histogram]):
+        with self.lock:
+            for key, histogram in delta.items():
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram()
+                self.histograms[key].merge(histogram)
+
+    def by_stage(self) -> dict[str, Histogram]:
+        out = {}
+        with self.lock:
+            for (stage, _), histogram in sorted(self.histograms.items()):
+                if stage not in out:
+                    out[stage] = Histogram()
+                out[stage].merge(histogram)
+        return out
+
+    def to_json(self) -> dict[str, Any]:
+        elapsed = time() - self.start
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+        return {
+            "elapsed": elapsed,
+            "buckets": [str(b) for b in BUCKETS],
+            "stages": [
+                {
+                    "stage": stage,
+                    "worker": worker,
+                    "count": h.count,
+                    "sum": h.sum,
+                    "p50": h.quantile(0.5),
+                    "p95": h.quantile(0.95),
+                    "buckets": h.buckets,
+                    "errors": dict(h.errors),
+                }
+                for (stage, worker), h in histograms
+            ],
+        }
+
+    def to_prometheus(self) -> str:
+        name = f"{PROMETHEUS_PREFIX}_stage_seconds"
+        errors_name = f"{PROMETHEUS_PREFIX}_stage_errors_total"
+        lines = [f"# TYPE {name} histogram"]
+        error_lines = [f"# TYPE {errors_name} counter"]
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+        for (stage, worker), h in histograms:
+            labels = f'stage="{escape(stage)}",worker="{escape(worker)}"'
+            cumulative = 0
+            for bound, n in zip(BUCKETS, h.buckets):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else str(bound)
+                lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f"{name}_sum{{{labels}}} {h.sum}")
+            lines.append(f"{name}_count{{{labels}}} {h.count}")
+            for error, n in sorted(h.errors.items()):
+                error_lines.append(
+                    f'{errors_name}{{{labels},error="{escape(error)}"}} {n}'
+                )
+        return "\n".join(lines + error_lines) + "\n"
+
+    def export(self, fpath: str):
+        # Writes fpath.json and fpath.prom, replacing the previous export
+        makedirs(path.dirname(fpath) or ".", exist_ok=True)
+        for ext, contents in [
+            ("json", json.dumps(self.to_json(), indent=2)),
+            ("prom", self.to_prometheus()),
+        ]:
+            with open(f"{fpath}.{ext}.tmp", "w") as f:
+                f.write(contents)
+            replace(f"{fpath}.{ext}.tmp", f"{fpath}.{ext}")
+
+    def summary_table(self) -> str:
+        elapsed = max(time() - self.start, 1e-9)
+        rows = [
+            f"{'stage':<16} {'count':>7} {'errors':>7} {'total s':>9} "
+            f"{'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'per s':>8}"
+        ]
+        for stage, h in self.by_stage().items():
+            mean = h.sum / h.count if h.count > 0 else 0
+            rows.append(
+                f"{stage:<16} {h.count:>7} {sum(h.errors.values()):>7} "
+                f"{h.sum:>9.2f} {mean * 1000:>9.1f} {h.quantile(0.5) * 1000:>9.1f} "
+                f"{h.quantile(0.95) * 1000:>9.1f} {h.count / elapsed:>8.2f}"
+            )
+            for error, n in h.errors.most_common(3):
+                rows.append(f"  {n:>5} x {error}")
+        return "\n".join(rows)
+
+
+registry = Registry()
+
+
+def reset_after_fork():
+    # Forked children would otherwise report their parent's numbers again
+    registry.lock = Lock()
+    registry.histograms = {}
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_after_fork)
+
+
+def escape(label: str) -> str:
+    return label.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def worker_name() -> str:
+    thread = current_thread()
+    if thread.name == "MainThread":
+        return current_process().name
+    return f"{current_process().name}/{thread.name}"
+
+
+def error_class(err: Any) -> Optional[str]:
+    # Groups error messages like "Download timed out. Try increasing ..." by
+    # their first sentence
+    if err is None or err == "":
+        return None
+    if isinstance(err, BaseException):
+        return type(err).__name__
+    return str(err).split(". ")[0].split(":")[0][:MAX_ERROR_CLASS_LEN]
+
+
+class Timer:
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.error = None
+
+    def fail(self, err: Any):
+        self.error = error_class(err)
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_value is not None and self.error is None:
+            self.error = error_class(exc_value)
+        registry.observe(self.stage, perf_counter() - self.start, self.error)
+
+
+class NullTimer:
+    def fail(self, err: Any):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+def enable(on: bool = True):
+    global enabled
+    enabled = on
+
+
+def timer(stage: str) -> Timer | NullTimer:
+    # Times a `with` block. Exceptions escaping it, or anything passed to
+    # .fail(), count as errors of the stage.
+    return Timer(stage) if enabled else NULL_TIMER
+
+
+def attach(batch):
+    # Moves what this process recorded so far into a job_queue.ResultBatch
+    if enabled:
+        delta = registry.drain()
+        if len(delta) > 0:
+            batch.add("metrics", delta)
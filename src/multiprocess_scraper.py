@@ -1,27 +1,66 @@
-from collections import defaultdict
-from multiprocessing import Manager, Process
-from multiprocessing.managers import ListProxy
-from os import path, readlink
+from collections import Counter, defaultdict
+from multiprocessing import Process
+from os import cpu_count, makedirs, path, readlink, remove
 from shutil import rmtree
-from time import sleep
+from time import strftime, time
+from typing import Any, Callable, Optional
 
-from tqdm import tqdm
-
-import json5
 import json
-from colorama import Fore, Style
 
+import gallery_api
+import metrics
+from json_array import write_json_array
+from crawl_state import CrawlState
+from vsix_cache import VsixCache
 import theme_scraper
+from rate_limit import Throttle
+from shards import ShardWriter
+from job_queue import JobQueue, ResultBatch, ResultBatcher, ResultQueue
 
 ANALYZE_FAILED_ONLY = True
+# Diff data/theme_list.json (from the "gallery" list backend) against the last
+# crawl and only scrape new or updated extensions. Overrides ANALYZE_FAILED_ONLY.
+DELTA_CRAWL = False
 
 SCRAPE_METADATA = True
+# "selenium", "http" (item page) or "gallery" (extensionquery)
+METADATA_BACKEND = "selenium"
 NUM_SCRAPERS = 8
 ANALYZE_VSIX = True
+DOWNLOAD_BACKEND = "selenium"  # "selenium" or "http" (direct vspackage download)
 NUM_VSIX_ANALYZERS = 12
+# Parse the downloaded archives on a pool of NUM_PARSERS processes rather than
+# in the VSIX analyzers, so that a slow parse never holds up a download
+SEPARATE_PARSERS = True
+NUM_PARSERS = cpu_count() or 1
+# Analyzers wait for the parsers once this many batches are queued up
+PARSE_QUEUE_BATCHES = 2 * NUM_PARSERS
+# Only re-parse the extensions we already downloaded, from the VSIX cache. No
+# scraping, downloading or browsers.
+REPARSE_CACHED = False
+# Only used by the "http" download backend
+USE_VSIX_CACHE = True
+VSIX_CACHE_SIZE = 4 << 30  # bytes
+# Look archives up in the cache by the version recorded from
+# data/theme_list.json (delta crawls), rather than asking the gallery for the
+# latest version of every item. The list is as fresh as the last list run.
+USE_LISTED_VERSIONS = True
 LOG_METADATA = True
 LOG_VSIX = True
-
+# Also append analyzed themes to gzipped, indexed shards in data/shards
+SHARDED_OUTPUT = True
+# How often the shards are flushed while results are coming in. A killed run
+# resumes from the crawl state, which is committed after every batch.
+CHECKPOINT_INTERVAL = 3  # seconds
+MAX_ATTEMPTS = 3
+JOB_BATCH_SIZE = 16
+# Per-stage latency histograms, exported every METRICS_INTERVAL seconds to
+# log/metrics.json and log/metrics.prom
+METRICS = True
+METRICS_INTERVAL = 10  # seconds
+
+# Share a rate limit and adaptive concurrency limit between the HTTP backends
+THROTTLE = True
 HEADLESS = True
 LOGLEVEL = 3
 
@@ -31,203 +70,469 @@ TOP_DIR = path.dirname(SRC_DIR)
 LOG_DIR = path.join(TOP_DIR, "log")
 DATA_DIR = path.join(TOP_DIR, "data")
 TEMP_DIR = path.join(TOP_DIR, "temp")
+STATE_DB = path.join(DATA_DIR, "crawl_state.sqlite")
+CACHE_DIR = path.join(TOP_DIR, "cache")
+METRICS_PATH = path.join(LOG_DIR, "metrics")
+SHARDS_DIR = path.join(DATA_DIR, "shards")
+DELTA_DIR = path.join(DATA_DIR, "deltas")
+
+
+def log(level: int, color: str, x: str):
+    # LOGLEVEL is checked on every call, so that configure() can change it
+    if LOGLEVEL > level:
+        from colorama import Fore, Style
+
+        print(getattr(Fore, color) + x + Style.RESET_ALL)
+
+
+error = lambda x: log(0, "RED", x)
+warn = lambda x: log(1, "YELLOW", x)
+info = lambda x: log(2, "CYAN", x)
+debug = lambda x: print(x) if LOGLEVEL > 3 else None
+
+# Settings above that were replaced at run time, see configure()
+overrides: dict[str, Any] = {}
+
+
+def configure(**settings: Any):
+    # Replaces the settings above, e.g. configure(NUM_SCRAPERS=4) from the CLI.
+    # Workers started with start_worker() get the same settings, which matters
+    # where they're spawned and import this module afresh.
+    for name, value in settings.items():
+        if not name.isupper() or name not in globals():
+            raise ValueError(f"Unknown setting {name}")
+        globals()[name] = value
+    overrides.update(settings)
+
+
+def run_worker(settings: dict[str, Any], target: Callable, *args):
+    configure(**settings)
+    target(*args)
 
-error = (
-    lambda x: print(Fore.RED + x + Style.RESET_ALL) if LOGLEVEL > 0 else lambda _: None
-)
-warn = (
-    lambda x: print(Fore.YELLOW + x + Style.RESET_ALL)
-    if LOGLEVEL > 1
-    else lambda _: None
-)
-info = (
-    lambda x: print(Fore.CYAN + x + Style.RESET_ALL) if LOGLEVEL > 2 else lambda _: None
-)
-debug = print if LOGLEVEL > 3 else lambda _: None
-
-
-def format_failed_jobs(urls_failed: ListProxy) -> dict[str, list[str]]:
+
+def start_worker(target: Callable, *args) -> Process:
+    p = Process(target=run_worker, args=(overrides, target, *args))
+    p.start()
+    return p
+
+
+def format_failed_jobs(urls_failed: list[dict[str, str]]) -> dict[str, list[str]]:
     out = defaultdict(list)
     for url in urls_failed:
         out[url["reason"]].append(url["url"])
     return out
 
 
-def scrape(urls: ListProxy, results: ListProxy):
-    with theme_scraper.WebdriverContext(headless=HEADLESS) as driver:
-        while len(urls) > 0:
-            try:
-                url = urls.pop(0)
-                results.append(theme_scraper.analyze_page(driver, url))
-            except Exception as e:
-                error(f"[Scraper] Ran into {e}...")
+def scrape(jobs: JobQueue, results: ResultQueue, throttle: Optional[Throttle] = None):
+    gallery_api.throttle = throttle
+    metrics.enable(METRICS)
+    if METADATA_BACKEND == "selenium":
+        context = theme_scraper.WebdriverPool(headless=HEADLESS)
+        analyze = lambda pool, url: theme_scraper.analyze_page(pool.driver(), url)
+    else:
+        context = gallery_api.HttpSessionContext()
+        analyze = lambda session, url: theme_scraper.analyze_page_http(
+            session, url, use_gallery_api=METADATA_BACKEND == "gallery"
+        )
+    with context as driver, results.batcher("metadata") as sink:
+        for batch in jobs.batches():
+            for url in batch:
+                with metrics.timer("metadata") as timer:
+                    try:
+                        sink.add("metadata", analyze(driver, url))
+                    except Exception as e:
+                        timer.fail(e)
+                        error(f"[Scraper] Ran into {e}...")
+                        sink.add(
+                            "failed",
+                            {
+                                "url": url,
+                                "stage": "metadata",
+                                "reason": f"[Metadata] {e}",
+                            },
+                        )
+                sink.job_done()
+            sink.flush()
 
 
 def analyze_vsix(
-    urls_download: ListProxy,
-    color_themes: ListProxy,
-    urls_failed: ListProxy,
+    jobs: JobQueue,
+    results: ResultQueue,
     download_dir: str = TEMP_DIR,
+    throttle: Optional[Throttle] = None,
+    parse_jobs: Optional[JobQueue] = None,
+    versions: Optional[dict[str, str]] = None,
 ):
-    with theme_scraper.WebdriverContext(
-        downloads_dir=download_dir, headless=HEADLESS
-    ) as driver:
-        while len(urls_download) > 0:
-            url = urls_download.pop(0)
-            results = theme_scraper.download_vsix(
-                driver, url, downloads_dir=download_dir
-            )
-            if not results.err:
-                analysis_results = theme_scraper.analyze_vsix(results.fpath)
-                if not analysis_results.err:
-                    debug(f"[Analyzer] Analyzed: {url}")
-                    color_themes.extend(analysis_results.analysis)
+    # With parse_jobs, downloaded archives are handed to parse_vsix workers
+    # instead of being analyzed here. Items without a known version in versions
+    # (url: version) are looked up in the gallery.
+    gallery_api.throttle = throttle
+    metrics.enable(METRICS)
+    cache = None
+    if DOWNLOAD_BACKEND == "selenium":
+        context = theme_scraper.WebdriverPool(
+            downloads_dir=download_dir, headless=HEADLESS
+        )
+        download = lambda pool, url: theme_scraper.download_vsix(
+            pool.driver(), url, downloads_dir=download_dir, extract=False
+        )
+    elif USE_VSIX_CACHE:
+        context = gallery_api.HttpSessionContext()
+        cache = VsixCache(CACHE_DIR, max_bytes=VSIX_CACHE_SIZE)
+        versions = versions or {}
+        download = lambda session, url: theme_scraper.download_vsix_cached(
+            session, cache, url, version=versions.get(url)
+        )
+    else:
+        context = gallery_api.HttpSessionContext()
+        download = lambda session, url: theme_scraper.download_vsix_http(session, url)
+    with context as driver, results.batcher("vsix") as sink:
+        for batch in jobs.batches():
+            downloaded = []
+            for url in batch:
+                if parse_jobs is None:
+                    download_and_analyze(driver, download, url, sink)
+                    sink.job_done()
+                    continue
+                with metrics.timer("download") as timer:
+                    download_results = download(driver, url)
+                    timer.fail(download_results.err)
+                if not download_results.err:
+                    downloaded.append((url, read_download(download_results)))
                 else:
-                    debug(
-                        f"[Analyzer] Could not analyze {results.fpath}, adding to failed list"
+                    analyze_download(url, download_results, sink)
+                    sink.job_done()
+            if len(downloaded) > 0:
+                with metrics.timer("parse_queue_put"):
+                    parse_jobs.put(downloaded)
+            sink.flush()
+        if cache is not None:
+            sink.add("cache", cache.stats())
+            cache.close()
+
+
+def read_download(results: theme_scraper.DownloadResults) -> bytes:
+    if results.data is not None:
+        return results.data
+    with open(results.fpath, "rb") as f:
+        data = f.read()
+    remove(results.fpath)
+    return data
+
+
+def parse_vsix(jobs: JobQueue, results: ResultQueue, from_cache=False):
+    # Jobs are (url, archive) pairs from analyze_vsix, or with from_cache urls of
+    # extensions to look up in the VSIX cache
+    metrics.enable(METRICS)
+    cache = VsixCache(CACHE_DIR, max_bytes=VSIX_CACHE_SIZE) if from_cache else None
+    with results.batcher("vsix") as sink:
+        for batch in jobs.batches():
+            for job in batch:
+                if cache is None:
+                    url, data = job
+                else:
+                    url = job
+                    data = cache.latest(gallery_api.item_name_from_url(url))
+                if data is not None:
+                    analyze_download(
+                        url, theme_scraper.DownloadResults(fpath="", data=data), sink
                     )
-                    urls_failed.append(
-                        {"url": url, "reason": f"[Analysis] {analysis_results.err}"}
+                else:
+                    debug(f"[Parser] {url} is not in the VSIX cache, skipping")
+                sink.job_done()
+            sink.flush()
+        if cache is not None:
+            sink.add("cache", cache.stats())
+            cache.close()
+
+
+def download_and_analyze(driver, download, url: str, sink: ResultBatcher):
+    with metrics.timer("download") as timer:
+        results = download(driver, url)
+        timer.fail(results.err)
+    analyze_download(url, results, sink)
+
+
+def analyze_download(
+    url: str,
+    results: theme_scraper.DownloadResults,
+    sink: ResultBatcher | ResultBatch,
+):
+    if not results.err:
+        with metrics.timer("analysis") as timer:
+            analysis_results = theme_scraper.analyze_vsix_archive(
+                results.data if results.data is not None else results.fpath,
+                name=results.fpath.replace(".vsix", "")
+                or gallery_api.item_name_from_url(url),
+            )
+            timer.fail(analysis_results.err)
+        sink.add("parsers", analysis_results.parsers)
+        if not analysis_results.err:
+            debug(f"[Analyzer] Analyzed: {url}")
+            sink.add("themes", {"url": url, "themes": analysis_results.analysis})
+        else:
+            debug(f"[Analyzer] Could not analyze {url}, adding to failed list")
+            sink.add(
+                "failed",
+                {
+                    "url": url,
+                    "stage": "analysis",
+                    "reason": f"[Analysis] {analysis_results.err}",
+                },
+            )
+
+        if results.fpath:
+            remove(results.fpath)
+    else:
+        debug(f"[Analyzer] Failed to download {url}, adding to failed list")
+        sink.add(
+            "failed",
+            {"url": url, "stage": "download", "reason": f"[Download] {results.err}"},
+        )
+
+
+class Collector:
+    # Upserts result batches into the crawl state and appends analyzed themes
+    # to the shards
+    descriptions = {
+        "list": "[Theme List]   ",
+        "metadata": "[Metadata]     ",
+        "vsix": "[VSIX Analyzer]",
+    }
+
+    def __init__(self, state: CrawlState, totals: dict[str, Optional[int]]):
+        from tqdm import tqdm
+
+        self.state = state
+        self.shards = None
+        if SHARDED_OUTPUT and LOG_VSIX:
+            self.shards = ShardWriter(SHARDS_DIR, cls=theme_scraper.EnhancedJSONEncoder)
+        self.pbars = {
+            stage: tqdm(total=total, desc=self.descriptions[stage], position=i)
+            for i, (stage, total) in enumerate(totals.items())
+        }
+        self.cache_stats = {"hits": 0, "misses": 0}
+        self.parser_tiers = Counter()
+        self.last_metrics_export = time()
+
+    def add(self, batch: ResultBatch):
+        self.pbars[batch.stage].update(batch.completed)
+        for delta in batch.results.get("metrics", []):
+            metrics.registry.merge(delta)
+        # Theme list pages from the pipeline, then every url it listed
+        self.state.sync_list(batch.results.get("listed", []), remove_unlisted=False)
+        for urls in batch.results.get("all_listed", []):
+            self.remove(self.state.remove_unlisted(urls))
+        for metadata in batch.results.get("metadata", []):
+            self.state.record_metadata(metadata.url, metadata)
+        for analysis in batch.results.get("themes", []):
+            self.state.record_themes(analysis["url"], analysis["themes"])
+        for failed in batch.results.get("failed", []):
+            self.state.record_failure(failed["url"], failed["stage"], failed["reason"])
+        with metrics.timer("state_commit"):
+            self.state.commit()
+        for parsers in batch.results.get("parsers", []):
+            self.parser_tiers.update(parsers.values())
+        for stats in batch.results.get("cache", []):
+            for k in self.cache_stats.keys():
+                self.cache_stats[k] += stats[k]
+
+        if self.shards is not None:
+            with metrics.timer("shard_write"):
+                for analysis in batch.results.get("themes", []):
+                    self.shards.write_item(
+                        gallery_api.item_name_from_url(analysis["url"]),
+                        analysis["themes"],
                     )
+        if metrics.enabled and time() - self.last_metrics_export >= METRICS_INTERVAL:
+            self.export_metrics()
+
+    def remove(self, urls: list[str]):
+        # Extensions that left the marketplace, see CrawlState.sync_list
+        if self.shards is not None:
+            for url in urls:
+                self.shards.remove_item(gallery_api.item_name_from_url(url))
+
+    def flush(self):
+        if self.shards is not None:
+            with metrics.timer("shard_flush"):
+                self.shards.flush()
+        if metrics.enabled and time() - self.last_metrics_export >= METRICS_INTERVAL:
+            self.export_metrics()
+
+    def export_metrics(self):
+        metrics.registry.export(METRICS_PATH)
+        self.last_metrics_export = time()
+
+    def close(self):
+        if self.shards is not None:
+            self.shards.close()
+        for pbar in self.pbars.values():
+            pbar.close()
+        if metrics.enabled:
+            self.export_metrics()
+
+    def print_summary(self):
+        info(f"[Summary] {json.dumps(self.state.summary())}")
+        if "vsix" in self.pbars:
+            info(f"[Summary] Files parsed per tier: {dict(self.parser_tiers)}")
+        if sum(self.cache_stats.values()) > 0:
+            info(
+                f"[Summary] VSIX cache: {self.cache_stats['hits']} hits, "
+                f"{self.cache_stats['misses']} misses"
+            )
+        if metrics.enabled:
+            info(f"[Summary] Stage timings:\n{metrics.registry.summary_table()}")
 
-                rmtree(results.fpath, ignore_errors=True)
-            else:
-                debug(f"[Analyzer] Failed to download {url}, adding to failed list")
-                urls_failed.append({"url": url, "reason": f"[Download] {results.err}"})
-
-
-def log(urls: ListProxy, results: ListProxy):
-    with tqdm(total=len(urls), desc="[Metadata]     ", position=0) as pbar:
-        previous_len = len(urls)
-        while len(urls) > 0:
-            with open(path.join(LOG_DIR, "log.json"), "w") as f:
-                json.dump(
-                    list(results), f, indent=2, cls=theme_scraper.EnhancedJSONEncoder
-                )
-            pbar.update(previous_len - len(urls))
-            previous_len = len(urls)
-            sleep(3)
-
-
-def log_vsix(urls_download: ListProxy, color_themes: ListProxy, urls_failed: ListProxy):
-    with tqdm(total=len(urls_download), desc="[VSIX Analyzer]", position=1) as pbar:
-        previous_len = len(urls_download)
-        while len(urls_download) > 0:
-            with open(path.join(LOG_DIR, "vsix_log.json"), "w") as f:
-                json5.dump(
-                    list(color_themes),
-                    f,
-                    indent=2,
-                    cls=theme_scraper.EnhancedJSONEncoder,
-                    quote_keys=True,
-                    trailing_commas=False,
-                )
-            with open(path.join(LOG_DIR, "failed_vsix_log.json"), "w") as f:
-                json5.dump(
-                    format_failed_jobs(urls_failed),
-                    f,
-                    indent=2,
-                    cls=theme_scraper.EnhancedJSONEncoder,
-                    quote_keys=True,
-                    trailing_commas=False,
-                )
-            pbar.update(previous_len - len(urls_download))
-            previous_len = len(urls_download)
-            sleep(3)
 
+def write_delta(delta: dict[str, Any]) -> str:
+    makedirs(DELTA_DIR, exist_ok=True)
+    fpath = path.join(DELTA_DIR, f"delta-{strftime('%Y%m%dT%H%M%S')}.json")
+    with open(fpath, "w") as f:
+        json.dump({"time": time(), **delta}, f, indent=2)
+    return fpath
 
-if __name__ == "__main__":
+
+def export_dataset(state: CrawlState, metadata=True, themes=True):
+    if metadata:
+        with open(path.join(DATA_DIR, "theme_metadata.json"), "w") as metadata_file:
+            write_json_array(state.iter_metadata(), metadata_file)
+
+    if themes:
+        with open(path.join(DATA_DIR, "themes.json"), "w") as theme_output_file:
+            write_json_array(state.iter_themes(), theme_output_file)
+
+        with open(path.join(DATA_DIR, "failed_vsix.json"), "w") as failed_output_file:
+            json.dump(
+                format_failed_jobs(state.failures(["download", "analysis"])),
+                failed_output_file,
+                indent=2,
+                cls=theme_scraper.EnhancedJSONEncoder,
+            )
+
+
+def run():
     rmtree(TEMP_DIR, ignore_errors=True)
-    theme_urls = []
-
-    # For retrying failed downloads:
-    if ANALYZE_FAILED_ONLY:
-        with open(path.join(DATA_DIR, "failed_vsix.json"), "r") as failed_file:
-            failed_dict = json.load(failed_file)
-            for k in failed_dict.keys():
-                if k != "[Analysis] Not a theme extension":
-                    theme_urls.extend(failed_dict[k])
-    else:
+    metrics.enable(METRICS)
+    state = CrawlState(STATE_DB, cls=theme_scraper.EnhancedJSONEncoder)
+
+    # Unfinished and retryable items are picked up again on every run. For
+    # retrying failed downloads only, set ANALYZE_FAILED_ONLY (cli.py
+    # retry-failed).
+    failed_only = ANALYZE_FAILED_ONLY and not DELTA_CRAWL
+    scrape_metadata = SCRAPE_METADATA and not failed_only and not REPARSE_CACHED
+    removed = []
+    if REPARSE_CACHED:
+        pass
+    elif DELTA_CRAWL:
+        with open(path.join(DATA_DIR, "theme_list.json"), "r") as theme_file:
+            theme_list: list[dict] = json.load(theme_file)
+        delta = state.sync_list(theme_list)
+        removed = delta["removed"]
+        fpath = write_delta(delta)
+        info(
+            f"[Delta] {len(delta['added'])} added, {len(delta['updated'])} updated, "
+            f"{len(delta['removed'])} removed, {delta['unchanged']} unchanged, "
+            f"see {fpath}"
+        )
+    elif not failed_only:
         with open(path.join(DATA_DIR, "theme_urls.json"), "r") as theme_file:
             theme_urls: list[str] = json.load(theme_file)
             assert type(theme_urls) == list
+        # Record the listed versions for the next delta crawl to compare
+        # against. A list older than theme_urls.json only makes it refetch more.
+        listed = {}
+        list_path = path.join(DATA_DIR, "theme_list.json")
+        if path.exists(list_path):
+            with open(list_path, "r") as theme_file:
+                listed = {entry["url"]: entry for entry in json.load(theme_file)}
+        state.add_entries(listed.get(url, {"url": url}) for url in theme_urls)
+
+    results = ResultQueue()
+    processes = []
+    parsers = []
+    totals = {}
+    # Only the HTTP backends go through the throttle
+    http_workers = 0
+    if scrape_metadata and METADATA_BACKEND != "selenium":
+        http_workers += NUM_SCRAPERS
+    if ANALYZE_VSIX and not REPARSE_CACHED and DOWNLOAD_BACKEND == "http":
+        http_workers += NUM_VSIX_ANALYZERS
+    throttle = None
+    if THROTTLE and http_workers > 0:
+        throttle = Throttle(workers=http_workers)
+
+    # Create workers
+    if REPARSE_CACHED:
+        parse_jobs = JobQueue(batch_size=JOB_BATCH_SIZE)
+        totals["vsix"] = parse_jobs.put(state.downloaded())
+        parse_jobs.close(NUM_PARSERS)
+        for i in range(NUM_PARSERS):
+            parsers.append(start_worker(parse_vsix, parse_jobs, results, True))
+
+    if scrape_metadata:
+        jobs = JobQueue(batch_size=JOB_BATCH_SIZE)
+        totals["metadata"] = jobs.put(state.pending("metadata", MAX_ATTEMPTS))
+        jobs.close(NUM_SCRAPERS)
+        for i in range(NUM_SCRAPERS):
+            processes.append(start_worker(scrape, jobs, results, throttle))
+
+    # Analyze VSIX
+    if ANALYZE_VSIX and not REPARSE_CACHED:
+        parse_jobs = None
+        if SEPARATE_PARSERS:
+            parse_jobs = JobQueue(
+                batch_size=JOB_BATCH_SIZE, max_batches=PARSE_QUEUE_BATCHES
+            )
+            for i in range(NUM_PARSERS):
+                parsers.append(start_worker(parse_vsix, parse_jobs, results))
+        download_jobs = JobQueue(batch_size=JOB_BATCH_SIZE)
+        totals["vsix"] = download_jobs.put(
+            state.pending("vsix", MAX_ATTEMPTS, failed_only=failed_only)
+        )
+        download_jobs.close(NUM_VSIX_ANALYZERS)
+        versions = None
+        if DOWNLOAD_BACKEND == "http" and USE_VSIX_CACHE and USE_LISTED_VERSIONS:
+            versions = state.versions()
+        for i in range(NUM_VSIX_ANALYZERS):
+            p = start_worker(
+                analyze_vsix,
+                download_jobs,
+                results,
+                path.join(TEMP_DIR, f"analyzer_{i}"),
+                throttle,
+                parse_jobs,
+                versions,
+            )
+            processes.append(p)
+
+    # Collect results in batches. The parsers are told to stop once everything
+    # that could still hand them archives has signed off.
+    collector = Collector(state, totals)
+    collector.remove(removed)
+    for workers in [processes, parsers]:
+        for batch in results.collect(workers, timeout=CHECKPOINT_INTERVAL):
+            if batch is not None:
+                collector.add(batch)
+            else:
+                collector.flush()
+        if workers is processes and len(parsers) > 0 and not REPARSE_CACHED:
+            parse_jobs.close(NUM_PARSERS)
+    collector.close()
+
+    for p in processes + parsers:
+        p.join()
+    collector.print_summary()
+    if throttle is not None:
+        info(f"[Summary] Throttle: {throttle.controller.stats()}")
+
+    export_dataset(
+        state,
+        metadata=scrape_metadata and LOG_METADATA,
+        themes=(ANALYZE_VSIX or REPARSE_CACHED) and LOG_VSIX,
+    )
+    state.close()
 
-    with Manager() as man:
-        metadata_results = man.list()
-        themes = man.list()
-        jobs = man.list(theme_urls.copy())
-        download_jobs = man.list(theme_urls.copy())
-        failed_download_jobs = man.list()
-        processes = []
-
-        # Create workers
-        if SCRAPE_METADATA and not ANALYZE_FAILED_ONLY:
-            for i in range(NUM_SCRAPERS):
-                p = Process(target=scrape, args=(jobs, metadata_results))
-                p.start()
-                processes.append(p)
-
-            # Create logger
-            if LOG_METADATA:
-                l = Process(target=log, args=(jobs, metadata_results))
-                l.start()
-                processes.append(l)
-
-        # Analyze VSIX
-        if ANALYZE_VSIX:
-            for i in range(NUM_VSIX_ANALYZERS):
-                p = Process(
-                    target=analyze_vsix,
-                    args=(
-                        download_jobs,
-                        themes,
-                        failed_download_jobs,
-                        path.join(TEMP_DIR, f"analyzer_{i}"),
-                    ),
-                )
-                p.start()
-                processes.append(p)
-
-            # Create logger
-            if LOG_VSIX:
-                l = Process(
-                    target=log_vsix, args=(download_jobs, themes, failed_download_jobs)
-                )
-                l.start()
-                processes.append(l)
-
-        for p in processes:
-            p.join()
-
-        if SCRAPE_METADATA and LOG_METADATA and not ANALYZE_FAILED_ONLY:
-            with open(path.join(DATA_DIR, "theme_metadata.json"), "w") as metadata_file:
-                json.dump(
-                    list(metadata_results),
-                    metadata_file,
-                    indent=2,
-                    cls=theme_scraper.EnhancedJSONEncoder,
-                )
-
-        if ANALYZE_VSIX and LOG_VSIX:
-            new_theme_list = list(themes)
-            if ANALYZE_FAILED_ONLY:
-                with open(path.join(DATA_DIR, "themes.json"), "r") as theme_input_file:
-                    new_theme_list.extend(json.load(theme_input_file))
-
-            with open(path.join(DATA_DIR, "themes.json"), "w") as theme_output_file:
-                json.dump(
-                    new_theme_list,
-                    theme_output_file,
-                    indent=2,
-                    cls=theme_scraper.EnhancedJSONEncoder,
-                )
-
-            with open(
-                path.join(DATA_DIR, "failed_vsix.json"), "w"
-            ) as failed_output_file:
-                json.dump(
-                    format_failed_jobs(failed_download_jobs),
-                    failed_output_file,
-                    indent=2,
-                    cls=theme_scraper.EnhancedJSONEncoder,
-                )
+
+if __name__ == "__main__":
+    run()
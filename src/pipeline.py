@@ -0,0 +1,319 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+from os import cpu_count
+from queue import Empty, Queue
+from threading import BoundedSemaphore, Thread
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Optional
+
+import gallery_api
+import metrics
+import multiprocess_scraper
+import theme_scraper
+from crawl_state import CrawlState, has_changed
+from job_queue import ResultBatch
+from rate_limit import Throttle
+from vsix_cache import VsixCache
+
+# requests is imported once gallery_api opens a session
+if TYPE_CHECKING:
+    import requests
+
+QUEUE_SIZE = 64
+# Upper bounds; with a throttle the AIMD controller decides how many are busy
+NUM_METADATA_WORKERS = 16
+NUM_DOWNLOAD_WORKERS = 16
+NUM_PARSERS = cpu_count() or 1
+SCRAPE_METADATA = True
+# Metadata from extensionquery rather than the item page
+USE_GALLERY_API = True
+
+# Put on a stage's inbox once per worker of that stage
+DONE = None
+
+
+def run_stage(
+    name: str,
+    fn: Callable[[Any], Iterable[Any]],
+    inbox: Queue,
+    outbox: Optional[Queue],
+    num_workers: int,
+    num_downstream: int = 1,
+) -> list[Thread]:
+    # Runs fn on num_workers threads, passing whatever it yields downstream.
+    # Once every worker has seen DONE, the next stage gets num_downstream DONEs.
+    def work():
+        while True:
+            item = inbox.get()
+            if item is DONE:
+                return
+            try:
+                for out in fn(item):
+                    if outbox is not None:
+                        outbox.put(out)
+            except Exception as e:
+                multiprocess_scraper.error(f"[{name}] Ran into {e}...")
+
+    threads = [
+        Thread(target=work, name=f"{name}_{i}", daemon=True) for i in range(num_workers)
+    ]
+    for t in threads:
+        t.start()
+
+    def finish():
+        for t in threads:
+            t.join()
+        if outbox is not None:
+            for _ in range(num_downstream):
+                outbox.put(DONE)
+
+    finisher = Thread(target=finish, name=f"{name}_finish", daemon=True)
+    finisher.start()
+    return threads + [finisher]
+
+
+def parse_vsix(url: str, results: theme_scraper.DownloadResults) -> ResultBatch:
+    # Runs in the parser processes
+    metrics.enable(multiprocess_scraper.METRICS)
+    batch = ResultBatch("vsix", completed=1)
+    multiprocess_scraper.analyze_download(url, results, batch)
+    metrics.attach(batch)
+    return batch
+
+
+class Pipeline:
+    # list -> metadata -> download -> parse, joined by bounded queues so that
+    # each stage blocks once the next one falls QUEUE_SIZE items behind
+    def __init__(
+        self,
+        session: "requests.Session",
+        cache: Optional[VsixCache] = None,
+        queue_size: int = QUEUE_SIZE,
+        num_metadata_workers: int = NUM_METADATA_WORKERS,
+        num_download_workers: int = NUM_DOWNLOAD_WORKERS,
+        num_parsers: int = NUM_PARSERS,
+        scrape_metadata: bool = True,
+        use_gallery_api: bool = True,
+        base_url: str = gallery_api.MARKETPLACE_URL,
+        settled: Optional[dict[str, set[str]]] = None,
+        known: Optional[dict[str, tuple]] = None,
+    ):
+        self.session = session
+        self.cache = cache
+        self.queue_size = queue_size
+        self.num_metadata_workers = num_metadata_workers
+        self.num_download_workers = num_download_workers
+        self.num_parsers = num_parsers
+        self.scrape_metadata = scrape_metadata
+        self.use_gallery_api = use_gallery_api
+        self.base_url = base_url
+        # job: urls from CrawlState.settled(), skipped so that a killed run
+        # picks up where it left off, unless the list has a new version of them
+        # (known being CrawlState.listed())
+        self.settled = settled or {}
+        self.known = known or {}
+        # Everything headed for the collector, which runs on the caller's thread
+        self.results: Queue = Queue(maxsize=queue_size)
+
+    def list_themes(self, metadata_queue: Queue):
+        try:
+            listed = []
+            for page in gallery_api.iter_theme_pages(
+                self.session, base_url=self.base_url
+            ):
+                # Register the items, and reset the updated ones, before any of
+                # their results can arrive
+                self.results.put(
+                    ResultBatch("list", {"listed": page}, completed=len(page))
+                )
+                for entry in page:
+                    listed.append(entry["url"])
+                    name = gallery_api.item_name_from_url(entry["url"])
+                    if name in self.known and has_changed(self.known[name], entry):
+                        for urls in self.settled.values():
+                            urls.discard(entry["url"])
+                    if not self.is_settled("vsix", entry["url"]) or (
+                        self.scrape_metadata
+                        and not self.is_settled("metadata", entry["url"])
+                    ):
+                        metadata_queue.put(entry)
+            # Only a complete list tells us what left the marketplace
+            self.results.put(ResultBatch("list", {"all_listed": [listed]}))
+        finally:
+            for _ in range(self.num_metadata_workers):
+                metadata_queue.put(DONE)
+
+    def is_settled(self, job: str, url: str) -> bool:
+        return url in self.settled.get(job, ())
+
+    def scrape(self, entry: dict[str, Any]) -> Iterable[dict[str, Any]]:
+        url = entry["url"]
+        if self.scrape_metadata and not self.is_settled("metadata", url):
+            batch = ResultBatch("metadata", completed=1)
+            with metrics.timer("metadata") as timer:
+                try:
+                    batch.add(
+                        "metadata",
+                        theme_scraper.analyze_page_http(
+                            self.session,
+                            url,
+                            use_gallery_api=self.use_gallery_api,
+                            base_url=self.base_url,
+                        ),
+                    )
+                except Exception as e:
+                    timer.fail(e)
+                    batch.add(
+                        "failed",
+                        {"url": url, "stage": "metadata", "reason": f"[Metadata] {e}"},
+                    )
+            self.results.put(batch)
+        if not self.is_settled("vsix", url):
+            yield entry
+
+    def download(self, entry: dict[str, Any]) -> Iterable[tuple[str, Any]]:
+        # The listed version saves asking the gallery for it
+        url, version = entry["url"], entry["version"]
+        with metrics.timer("download") as timer:
+            if self.cache is not None:
+                results = theme_scraper.download_vsix_cached(
+                    self.session,
+                    self.cache,
+                    url,
+                    base_url=self.base_url,
+                    version=version,
+                )
+            else:
+                results = theme_scraper.download_vsix_http(
+                    self.session,
+                    url,
+                    version=version or "latest",
+                    base_url=self.base_url,
+                )
+            timer.fail(results.err)
+        yield url, results
+
+    def parse(self, parse_queue: Queue):
+        in_flight = BoundedSemaphore(self.queue_size)
+
+        def done(future: Future):
+            in_flight.release()
+            try:
+                self.results.put(future.result())
+            except Exception as e:
+                multiprocess_scraper.error(f"[Parser] Ran into {e}...")
+
+        # Spawned parsers get the settings given to multiprocess_scraper.configure()
+        with ProcessPoolExecutor(
+            max_workers=self.num_parsers,
+            initializer=partial(
+                multiprocess_scraper.configure, **multiprocess_scraper.overrides
+            ),
+        ) as executor:
+            while True:
+                item = parse_queue.get()
+                if item is DONE:
+                    break
+                in_flight.acquire()
+                executor.submit(parse_vsix, *item).add_done_callback(done)
+        self.results.put(DONE)
+
+    def run(self, collector: "multiprocess_scraper.Collector"):
+        metadata_queue: Queue = Queue(maxsize=self.queue_size)
+        download_queue: Queue = Queue(maxsize=self.queue_size)
+        parse_queue: Queue = Queue(maxsize=self.queue_size)
+
+        threads = [Thread(target=self.list_themes, args=(metadata_queue,))]
+        threads[0].start()
+        threads += run_stage(
+            "metadata",
+            self.scrape,
+            metadata_queue,
+            download_queue,
+            self.num_metadata_workers,
+            num_downstream=self.num_download_workers,
+        )
+        threads += run_stage(
+            "download",
+            self.download,
+            download_queue,
+            parse_queue,
+            self.num_download_workers,
+        )
+        threads.append(Thread(target=self.parse, args=(parse_queue,)))
+        threads[-1].start()
+
+        while True:
+            try:
+                batch = self.results.get(
+                    timeout=multiprocess_scraper.CHECKPOINT_INTERVAL
+                )
+            except Empty:
+                collector.flush()
+                continue
+            if batch is DONE:
+                break
+            collector.add(batch)
+
+        for t in threads:
+            t.join()
+
+
+def run():
+    # Settings come from multiprocess_scraper (state, cache, throttle, metrics)
+    # and the top of this module, see cli.py pipeline
+    metrics.enable(multiprocess_scraper.METRICS)
+    state = CrawlState(
+        multiprocess_scraper.STATE_DB, cls=theme_scraper.EnhancedJSONEncoder
+    )
+    totals = {"list": None, "vsix": None}
+    if SCRAPE_METADATA:
+        totals = {"list": None, "metadata": None, "vsix": None}
+    collector = multiprocess_scraper.Collector(state, totals)
+    cache = None
+    if multiprocess_scraper.USE_VSIX_CACHE:
+        cache = VsixCache(
+            multiprocess_scraper.CACHE_DIR,
+            max_bytes=multiprocess_scraper.VSIX_CACHE_SIZE,
+        )
+    if multiprocess_scraper.THROTTLE:
+        workers = NUM_DOWNLOAD_WORKERS
+        if SCRAPE_METADATA:
+            workers += NUM_METADATA_WORKERS
+        gallery_api.throttle = Throttle(workers=workers)
+    settled = {
+        job: state.settled(job, multiprocess_scraper.MAX_ATTEMPTS)
+        for job in ["metadata", "vsix"]
+    }
+    pool_size = NUM_METADATA_WORKERS + NUM_DOWNLOAD_WORKERS + 2
+    with gallery_api.HttpSessionContext(pool_size=pool_size) as session:
+        Pipeline(
+            session,
+            cache=cache,
+            queue_size=QUEUE_SIZE,
+            num_metadata_workers=NUM_METADATA_WORKERS,
+            num_download_workers=NUM_DOWNLOAD_WORKERS,
+            num_parsers=NUM_PARSERS,
+            scrape_metadata=SCRAPE_METADATA,
+            use_gallery_api=USE_GALLERY_API,
+            settled=settled,
+            known=state.listed(),
+        ).run(collector)
+    collector.close()
+    if cache is not None:
+        collector.cache_stats = cache.stats()
+        cache.close()
+    collector.print_summary()
+    if gallery_api.throttle is not None:
+        multiprocess_scraper.info(
+            f"[Summary] Throttle: {gallery_api.throttle.controller.stats()}"
+        )
+    multiprocess_scraper.export_dataset(
+        state,
+        metadata=SCRAPE_METADATA and multiprocess_scraper.LOG_METADATA,
+        themes=multiprocess_scraper.LOG_VSIX,
+    )
+    state.close()
+
+
+if __name__ == "__main__":
+    run()
@@ -1,6 +1,11 @@
-import json
-from os import path, readlink
+import argparse
 import csv
+import json
+from os import cpu_count, path, readlink, remove
+from shutil import copyfileobj
+from typing import IO, Any, Iterator, Optional
+
+from shards import IndexEntry, ShardedDataset, read_records
 
 PATH = readlink(__file__) if path.islink(__file__) else __file__
 SRC_DIR = path.dirname(PATH)
@@ -8,37 +13,167 @@ TOP_DIR = path.dirname(SRC_DIR)
 LOG_DIR = path.join(TOP_DIR, "log")
 DATA_DIR = path.join(TOP_DIR, "data")
 
+SHARDS_DIR = path.join(DATA_DIR, "shards")
+CHUNK_SIZE = 1 << 16
+NUM_WORKERS = cpu_count() or 1
+THEME_CSV_HEADER = ("name", "uiTheme", "path", "format", "theme")
+WHITESPACE = " \t\n\r"
+
+
+def iter_json_records(f: IO[str], chunk_size: int = CHUNK_SIZE) -> Iterator[Any]:
+    # Yields the elements of a top-level JSON array, or the values of a JSON
+    # Lines file, holding at most one record (plus a chunk) in memory
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    eof = False
+    in_array = None
+    read_size = chunk_size
+
+    while True:
+        while pos < len(buf) and buf[pos] in WHITESPACE:
+            pos += 1
+        if pos == len(buf):
+            if eof:
+                return
+            buf = f.read(read_size)
+            pos = 0
+            eof = buf == ""
+            continue
+
+        if in_array is None:
+            in_array = buf[pos] == "["
+            if in_array:
+                pos += 1
+            continue
+        if in_array and buf[pos] == ",":
+            pos += 1
+            continue
+        if in_array and buf[pos] == "]":
+            return
+
+        try:
+            record, end = decoder.raw_decode(buf, pos)
+            # A number or literal cut off at the end of the buffer can still
+            # decode, so only trust it once there is something after it
+            if end == len(buf) and not eof:
+                raise json.JSONDecodeError("Need more data", buf, end)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # Grow reads geometrically so huge records aren't re-decoded often
+            more = f.read(max(read_size, len(buf) - pos))
+            eof = more == ""
+            buf = buf[pos:] + more
+            pos = 0
+            continue
+        yield record
+        pos = end
+        read_size = chunk_size
+        if pos > chunk_size:
+            buf = buf[pos:]
+            pos = 0
+
 
-l = []
-with open(path.join(DATA_DIR, "themes.json"), "r") as theme_input_file:
-    l: list[dict] = json.load(theme_input_file)
+def theme_csv_row(row: dict[str, Any]) -> tuple:
+    return (
+        row["name"],
+        row["theme"]["uiTheme"],
+        row["theme"]["path"],
+        row["theme"]["format"],
+        row["theme"]["contents"],
+    )
 
 
-with open(path.join(DATA_DIR, "themes.csv"), "w", encoding="utf-8") as theme_csv_file:
-    w = csv.writer(theme_csv_file, delimiter=",")
-    w.writerow(("name", "uiTheme", "path", "format", "theme"))
-    for row in l:
-        csv_row = (
-            row["name"],
-            row["theme"]["uiTheme"],
-            row["theme"]["path"],
-            row["theme"]["format"],
-            row["theme"]["contents"],
+def themes_to_csv(src: str, dst: str) -> int:
+    num_rows = 0
+    with open(src, "r", encoding="utf-8") as theme_input_file, open(
+        dst, "w", encoding="utf-8", newline=""
+    ) as theme_csv_file:
+        w = csv.writer(theme_csv_file, delimiter=",")
+        w.writerow(THEME_CSV_HEADER)
+        for row in iter_json_records(theme_input_file):
+            w.writerow(theme_csv_row(row))
+            num_rows += 1
+    return num_rows
+
+
+def shard_to_csv(shard_dir: str, entries: list[IndexEntry], dst: str) -> int:
+    # Runs in the worker processes, one shard each
+    num_rows = 0
+    with open(dst, "w", encoding="utf-8", newline="") as theme_csv_file:
+        w = csv.writer(theme_csv_file, delimiter=",")
+        for row in read_records(shard_dir, entries):
+            w.writerow(theme_csv_row(row))
+            num_rows += 1
+    return num_rows
+
+
+def shards_to_csv(shard_dir: str, dst: str, num_workers: int = NUM_WORKERS) -> int:
+    # Converts every shard to its own part in parallel, then concatenates them
+    from concurrent.futures import ProcessPoolExecutor
+
+    shards = ShardedDataset(shard_dir).by_shard()
+    parts = [f"{dst}.{i}.part" for i in range(len(shards))]
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        num_rows = sum(
+            executor.map(
+                shard_to_csv, [shard_dir] * len(shards), shards.values(), parts
+            )
         )
-        w.writerow(csv_row)
+    with open(dst, "w", encoding="utf-8", newline="") as theme_csv_file:
+        csv.writer(theme_csv_file, delimiter=",").writerow(THEME_CSV_HEADER)
+        for part in parts:
+            with open(part, "r", encoding="utf-8", newline="") as f:
+                copyfileobj(f, theme_csv_file)
+            remove(part)
+    return num_rows
 
 
-# Metadata
+def metadata_to_csv(src: str, dst: str) -> int:
+    num_rows = 0
+    with open(src, "r", encoding="utf-8") as theme_input_file, open(
+        dst, "w", encoding="utf-8", newline=""
+    ) as theme_csv_file:
+        w = csv.writer(theme_csv_file, delimiter=",")
+        for row in iter_json_records(theme_input_file):
+            if num_rows == 0:
+                w.writerow(row.keys())
+            w.writerow((row[k] for k in row.keys()))
+            num_rows += 1
+    return num_rows
 
-l = []
-with open(path.join(DATA_DIR, "theme_metadata.json"), "r") as theme_input_file:
-    l: list[dict] = json.load(theme_input_file)
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Convert themes.json and theme_metadata.json to CSV"
+    )
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument(
+        "--only", choices=["themes", "metadata"], help="Only convert one dataset"
+    )
+    parser.add_argument(
+        "--shards",
+        nargs="?",
+        const=SHARDS_DIR,
+        help="Read themes from a sharded dataset instead of themes.json",
+    )
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS)
+    args = parser.parse_args(argv)
+
+    if args.only in [None, "themes"] and args.shards:
+        shards_to_csv(args.shards, path.join(args.data_dir, "themes.csv"), args.workers)
+    elif args.only in [None, "themes"]:
+        themes_to_csv(
+            path.join(args.data_dir, "themes.json"),
+            path.join(args.data_dir, "themes.csv"),
+        )
+    if args.only in [None, "metadata"]:
+        metadata_to_csv(
+            path.join(args.data_dir, "theme_metadata.json"),
+            path.join(args.data_dir, "theme_metadata.csv"),
+        )
 
 
-with open(
-    path.join(DATA_DIR, "theme_metadata.csv"), "w", encoding="utf-8"
-) as theme_csv_file:
-    w = csv.writer(theme_csv_file, delimiter=",")
-    w.writerow(l[0].keys())
-    for row in l:
-        w.writerow((row[k] for k in row.keys()))
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+from contextlib import contextmanager
+from time import monotonic, sleep
+from typing import Iterator, Optional
+
+RATE_LIMIT = 20  # requests per second, across every worker
+BURST = 20
+INITIAL_CONCURRENCY = 8
+MIN_CONCURRENCY = 1
+# Throttle(workers=n) lowers it to the n workers sharing the throttle
+MAX_CONCURRENCY = 32
+TARGET_LATENCY = 2.0  # seconds
+DECREASE_FACTOR = 0.5
+BACKOFF_BASE = 0.5  # seconds
+BACKOFF_CAP = 60  # seconds
+MAX_RETRIES = 8
+THROTTLE_STATUSES = (429, 500, 502, 503, 504)
+
+# Everything below lives in shared memory, so one instance can be handed to
+# worker processes at creation time (and shared between threads) to coordinate
+# them all. multiprocessing is imported once one is made, as gallery_api (and
+# everything that only needs its URL helpers) imports this module.
+
+
+class TokenBucket:
+    def __init__(self, rate: float = RATE_LIMIT, capacity: float = BURST):
+        import multiprocessing
+
+        self.rate = rate
+        self.capacity = capacity
+        self.lock = multiprocessing.Lock()
+        self.tokens = multiprocessing.RawValue("d", capacity)
+        self.updated = multiprocessing.RawValue("d", monotonic())
+
+    def acquire(self, n: float = 1):
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.tokens.value = min(
+                    self.capacity,
+                    self.tokens.value + (now - self.updated.value) * self.rate,
+                )
+                self.updated.value = now
+                if self.tokens.value >= n:
+                    self.tokens.value -= n
+                    return
+                wait = (n - self.tokens.value) / self.rate
+            sleep(wait)
+
+
+class AIMDController:
+    # Caps the number of requests in flight. The cap grows by one for every
+    # `limit` fast successes and is cut by DECREASE_FACTOR on throttling or
+    # slow responses, like TCP congestion control.
+    def __init__(
+        self,
+        initial: float = INITIAL_CONCURRENCY,
+        minimum: float = MIN_CONCURRENCY,
+        maximum: float = MAX_CONCURRENCY,
+        target_latency: float = TARGET_LATENCY,
+        decrease_factor: float = DECREASE_FACTOR,
+    ):
+        import multiprocessing
+
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.decrease_factor = decrease_factor
+        self.cond = multiprocessing.Condition()
+        self.limit = multiprocessing.RawValue("d", initial)
+        self.in_flight = multiprocessing.RawValue("i", 0)
+        # Only back off once per round trip, not once per in-flight request
+        self.last_decrease = multiprocessing.RawValue("d", 0)
+        self.latency = multiprocessing.RawValue("d", 0)
+        self.successes = multiprocessing.RawValue("i", 0)
+        self.throttled = multiprocessing.RawValue("i", 0)
+
+    def acquire(self):
+        with self.cond:
+            while self.in_flight.value >= int(self.limit.value):
+                self.cond.wait()
+            self.in_flight.value += 1
+
+    def release(self, latency: float, throttled: bool = False):
+        with self.cond:
+            self.in_flight.value -= 1
+            self.latency.value += 0.2 * (latency - self.latency.value)
+            if throttled or latency > self.target_latency:
+                self.throttled.value += int(throttled)
+                now = monotonic()
+                if now - self.last_decrease.value > self.latency.value:
+                    self.limit.value = max(
+                        self.minimum, self.limit.value * self.decrease_factor
+                    )
+                    self.last_decrease.value = now
+            else:
+                self.successes.value += 1
+                self.limit.value = min(
+                    self.maximum, self.limit.value + 1 / self.limit.value
+                )
+            self.cond.notify_all()
+
+    def stats(self) -> dict[str, float]:
+        with self.cond:
+            return {
+                "limit": self.limit.value,
+                "latency": self.latency.value,
+                "successes": self.successes.value,
+                "throttled": self.throttled.value,
+            }
+
+
+class Throttle:
+    def __init__(
+        self,
+        bucket: Optional[TokenBucket] = None,
+        controller: Optional[AIMDController] = None,
+        max_retries: int = MAX_RETRIES,
+        workers: Optional[int] = None,
+    ):
+        # With a fixed number of workers, each making one request at a time, a
+        # limit above that number could never be reached
+        if controller is None:
+            maximum = MAX_CONCURRENCY
+            if workers is not None:
+                maximum = max(MIN_CONCURRENCY, min(MAX_CONCURRENCY, workers))
+            controller = AIMDController(
+                initial=min(INITIAL_CONCURRENCY, maximum), maximum=maximum
+            )
+        self.bucket = bucket if bucket is not None else TokenBucket()
+        self.controller = controller
+        self.max_retries = max_retries
+
+    @contextmanager
+    def slot(self) -> Iterator[dict]:
+        # Callers set outcome["throttled"] when the response asks us to slow down
+        self.bucket.acquire()
+        self.controller.acquire()
+        outcome = {"throttled": False}
+        start = monotonic()
+        try:
+            yield outcome
+        finally:
+            self.controller.release(monotonic() - start, outcome["throttled"])
+
+
+def backoff_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    # Full jitter, unless the server told us how long to wait
+    if retry_after is not None:
+        try:
+            return min(BACKOFF_CAP, float(retry_after))
+        except ValueError:
+            pass
+    import random
+
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt))
@@ -0,0 +1,288 @@
+import argparse
+import gzip
+import json
+from dataclasses import asdict, dataclass
+from glob import glob
+from os import makedirs, path, replace
+from sys import intern
+from time import time
+from typing import Any, Iterator, Optional, Type
+
+SHARD_RECORDS = 2000
+SHARD_BYTES = 64 << 20
+COMPRESS_LEVEL = 6
+MANIFEST = "manifest.json"
+# idx of a tombstone, an index entry without a record
+REMOVED = -1
+
+# Shards are append-only JSON Lines files in which every record is its own gzip
+# member, so a record can be read from its offset without touching the rest
+# while `zcat` or gzip.open still see one JSON Lines stream. Each shard has a
+# plain JSON Lines index next to it, and manifest.json lists the shards in the
+# order they were written. Every run starts a new shard; an item written again
+# later supersedes all of its earlier records, and a tombstone written for an
+# item that left the marketplace drops them.
+
+
+@dataclass(slots=True)
+class IndexEntry:
+    shard: str
+    offset: int
+    length: int
+    itemName: str
+    idx: int  # position of the theme within its extension
+    name: str
+    uiTheme: str
+    path: str
+    format: str
+
+
+def shard_name(prefix: str, number: int) -> str:
+    return f"{prefix}-{number:05d}.jsonl.gz"
+
+
+def index_name(shard: str) -> str:
+    return shard.replace(".jsonl.gz", ".index.jsonl")
+
+
+def read_manifest(out_dir: str) -> dict[str, Any]:
+    fpath = path.join(out_dir, MANIFEST)
+    if not path.exists(fpath):
+        return {"shards": []}
+    with open(fpath, "r") as f:
+        return json.load(f)
+
+
+def write_manifest(out_dir: str, manifest: dict[str, Any]):
+    fpath = path.join(out_dir, MANIFEST)
+    with open(fpath + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    replace(fpath + ".tmp", fpath)
+
+
+class ShardWriter:
+    def __init__(
+        self,
+        out_dir: str,
+        prefix: str = "themes",
+        max_records: int = SHARD_RECORDS,
+        max_bytes: int = SHARD_BYTES,
+        cls: Optional[Type[json.JSONEncoder]] = None,
+    ):
+        makedirs(out_dir, exist_ok=True)
+        self.out_dir = out_dir
+        self.prefix = prefix
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.cls = cls
+        self.manifest = read_manifest(out_dir)
+        self.file = None
+        self.num_written = 0
+
+    def open_shard(self):
+        # Never reuse a number, even one a crashed run left out of the manifest
+        taken = {s["name"] for s in self.manifest["shards"]} | {
+            path.basename(p) for p in glob(path.join(self.out_dir, "*.jsonl.gz"))
+        }
+        number = len(self.manifest["shards"])
+        while shard_name(self.prefix, number) in taken:
+            number += 1
+        self.entry = {
+            "name": shard_name(self.prefix, number),
+            "index": index_name(shard_name(self.prefix, number)),
+            "records": 0,
+            "bytes": 0,
+            "created": time(),
+            "closed": None,
+        }
+        self.file = open(path.join(self.out_dir, self.entry["name"]), "wb")
+        self.index_file = open(
+            path.join(self.out_dir, self.entry["index"]), "w", encoding="utf-8"
+        )
+        self.manifest["shards"].append(self.entry)
+        write_manifest(self.out_dir, self.manifest)
+
+    def close_shard(self):
+        self.file.close()
+        self.index_file.close()
+        self.file = None
+        self.entry["closed"] = time()
+        write_manifest(self.out_dir, self.manifest)
+
+    def next_shard(self):
+        if self.file is not None and (
+            self.entry["records"] >= self.max_records
+            or self.entry["bytes"] >= self.max_bytes
+        ):
+            self.close_shard()
+        if self.file is None:
+            self.open_shard()
+
+    def write_item(self, item_name: str, themes: list[dict[str, Any]]):
+        # All themes of one extension go into the same shard
+        self.next_shard()
+        for i, theme in enumerate(themes):
+            line = json.dumps({"itemName": item_name, **theme}, cls=self.cls) + "\n"
+            member = gzip.compress(line.encode("utf-8"), COMPRESS_LEVEL, mtime=0)
+            entry = IndexEntry(
+                shard=self.entry["name"],
+                offset=self.entry["bytes"],
+                length=len(member),
+                itemName=item_name,
+                idx=i,
+                name=theme["name"],
+                uiTheme=theme["theme"]["uiTheme"],
+                path=theme["theme"]["path"],
+                format=theme["theme"]["format"],
+            )
+            self.file.write(member)
+            self.index_file.write(json.dumps(asdict(entry)) + "\n")
+            self.entry["records"] += 1
+            self.entry["bytes"] += len(member)
+            self.num_written += 1
+
+    def remove_item(self, item_name: str):
+        self.next_shard()
+        entry = IndexEntry(
+            shard=self.entry["name"],
+            offset=self.entry["bytes"],
+            length=0,
+            itemName=item_name,
+            idx=REMOVED,
+            name="",
+            uiTheme="",
+            path="",
+            format="",
+        )
+        self.index_file.write(json.dumps(asdict(entry)) + "\n")
+
+    def flush(self):
+        # Data before index, so the index never points past the end of a shard
+        if self.file is not None:
+            self.file.flush()
+            self.index_file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.close_shard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_index(out_dir: str, shard: dict[str, Any]) -> Iterator[IndexEntry]:
+    size = path.getsize(path.join(out_dir, shard["name"]))
+    with open(path.join(out_dir, shard["index"]), "r") as f:
+        lines = f.read().split("\n")
+    # Everything up to the last newline was written completely. Decoding it as
+    # one array is much quicker than a line at a time.
+    try:
+        rows = json.loads("[" + ",".join(lines[:-1]) + "]")
+    except json.JSONDecodeError:
+        # Truncated by a crash
+        rows = []
+        for line in lines[:-1]:
+            try:
+                rows.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+    for row in rows:
+        entry = IndexEntry(**row)
+        if entry.offset + entry.length > size:
+            return
+        # Shared by most entries, so keep one copy of each
+        entry.shard = intern(entry.shard)
+        entry.uiTheme = intern(entry.uiTheme)
+        entry.format = intern(entry.format)
+        yield entry
+
+
+def read_record(out_dir: str, entry: IndexEntry) -> dict[str, Any]:
+    with open(path.join(out_dir, entry.shard), "rb") as f:
+        f.seek(entry.offset)
+        return json.loads(gzip.decompress(f.read(entry.length)))
+
+
+def read_records(out_dir: str, entries: list[IndexEntry]) -> Iterator[dict[str, Any]]:
+    # Entries of one shard, read in a single pass over the file
+    handles = {}
+    try:
+        for entry in sorted(entries, key=lambda e: (e.shard, e.offset)):
+            if entry.shard not in handles:
+                handles[entry.shard] = open(path.join(out_dir, entry.shard), "rb")
+            f = handles[entry.shard]
+            f.seek(entry.offset)
+            yield json.loads(gzip.decompress(f.read(entry.length)))
+    finally:
+        for f in handles.values():
+            f.close()
+
+
+class ShardedDataset:
+    # The current record of every theme across all shards
+    def __init__(self, out_dir: str):
+        self.out_dir = out_dir
+        self.manifest = read_manifest(out_dir)
+        self.items: dict[str, list[IndexEntry]] = {}
+        for shard in self.manifest["shards"]:
+            for entry in read_index(out_dir, shard):
+                if entry.idx == REMOVED:
+                    self.items.pop(entry.itemName, None)
+                    continue
+                if entry.idx == 0:
+                    self.items[entry.itemName] = []
+                self.items.setdefault(entry.itemName, []).append(entry)
+        self.entries = {
+            (e.itemName, e.path): e for entries in self.items.values() for e in entries
+        }
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key: tuple[str, str]) -> bool:
+        return key in self.entries
+
+    def get(self, item_name: str, theme_path: str) -> dict[str, Any]:
+        return read_record(self.out_dir, self.entries[(item_name, theme_path)])
+
+    def themes_of(self, item_name: str) -> list[dict[str, Any]]:
+        return list(read_records(self.out_dir, self.items.get(item_name, [])))
+
+    def by_shard(self) -> dict[str, list[IndexEntry]]:
+        out = {}
+        for entry in self.entries.values():
+            out.setdefault(entry.shard, []).append(entry)
+        for entries in out.values():
+            entries.sort(key=lambda e: e.offset)
+        return out
+
+    def __iter__(self) -> Iterator[dict[str, Any]]:
+        for entries in self.by_shard().values():
+            yield from read_records(self.out_dir, entries)
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description="Inspect a sharded theme dataset")
+    parser.add_argument("shard_dir")
+    parser.add_argument("--item", help="Print the themes of this itemName")
+    parser.add_argument("--path", help="Only the theme at this path of --item")
+    args = parser.parse_args(argv)
+
+    dataset = ShardedDataset(args.shard_dir)
+    if args.item and args.path:
+        print(json.dumps(dataset.get(args.item, args.path), indent=2))
+    elif args.item:
+        print(json.dumps(dataset.themes_of(args.item), indent=2))
+    else:
+        shards = dataset.manifest["shards"]
+        print(
+            f"{len(shards)} shards, {sum(s['bytes'] for s in shards)} bytes, "
+            f"{len(dataset.items)} extensions, {len(dataset)} themes"
+        )
+
+
+if __name__ == "__main__":
+    main()
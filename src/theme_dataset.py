@@ -0,0 +1,245 @@
+import argparse
+import gzip
+import json
+import mmap
+from dataclasses import dataclass
+from os import path
+from sys import intern
+from typing import Any, Container, Iterator, Optional
+
+import gallery_api
+from postprocess import DATA_DIR, SHARDS_DIR, iter_json_records
+from shards import IndexEntry, ShardedDataset
+
+METADATA_PATH = path.join(DATA_DIR, "theme_metadata.json")
+
+# Opening a dataset only reads the shard indexes. Theme contents are decoded
+# from the memory-mapped shards whenever they're asked for, and extension
+# metadata is loaded the first time a filter or record needs it.
+
+
+@dataclass(slots=True)
+class ExtensionRecord:
+    # theme_scraper.Theme, minus the per-instance __dict__
+    item_name: str
+    url: str
+    name: str
+    author: str
+    verified: bool
+    num_installs: int
+    num_ratings: int
+    average_rating: float
+    description: str
+    price: str
+    categories: tuple[str, ...]
+    tags: tuple[str, ...]
+    repository: Optional[str]
+
+    @classmethod
+    def from_json(cls, metadata: dict[str, Any]) -> "ExtensionRecord":
+        return cls(
+            item_name=gallery_api.item_name_from_url(metadata["url"]),
+            url=metadata["url"],
+            name=metadata["name"],
+            author=intern(metadata["author"]),
+            verified=metadata["verified"],
+            num_installs=metadata["num_installs"],
+            num_ratings=metadata["num_ratings"],
+            average_rating=metadata["average_rating"],
+            description=metadata["description"],
+            price=intern(metadata["price"]),
+            categories=tuple(intern(c) for c in metadata["categories"]),
+            tags=tuple(intern(t) for t in metadata["tags"]),
+            repository=metadata["repository"],
+        )
+
+
+class ThemeRecord:
+    __slots__ = ("dataset", "entry")
+
+    def __init__(self, dataset: "ThemeDataset", entry: IndexEntry):
+        self.dataset = dataset
+        self.entry = entry
+
+    @property
+    def item_name(self) -> str:
+        return self.entry.itemName
+
+    @property
+    def name(self) -> str:
+        return self.entry.name
+
+    @property
+    def ui_theme(self) -> str:
+        return self.entry.uiTheme
+
+    @property
+    def path(self) -> str:
+        return self.entry.path
+
+    @property
+    def format(self) -> str:
+        return self.entry.format
+
+    @property
+    def extension(self) -> Optional[ExtensionRecord]:
+        return self.dataset.extension(self.entry.itemName)
+
+    def record(self) -> dict[str, Any]:
+        return self.dataset.read(self.entry)
+
+    @property
+    def contents(self) -> Any:
+        # Decoded on every access rather than kept around
+        return self.record()["theme"]["contents"]
+
+    def __repr__(self) -> str:
+        return f"ThemeRecord({self.item_name!r}, {self.path!r})"
+
+
+def matches(value: Any, wanted: Optional[str | Container[str]]) -> bool:
+    if wanted is None:
+        return True
+    if isinstance(wanted, str):
+        return value == wanted
+    return value in wanted
+
+
+class ThemeDataset:
+    def __init__(self, shards_dir: str = SHARDS_DIR, metadata_path=METADATA_PATH):
+        self.shards_dir = shards_dir
+        self.metadata_path = metadata_path
+        self.index = ShardedDataset(shards_dir)
+        # In file order, so that iterating reads each shard front to back
+        self.entries = [
+            entry for entries in self.index.by_shard().values() for entry in entries
+        ]
+        self.maps: dict[str, tuple[Any, mmap.mmap]] = {}
+        self._extensions: Optional[dict[str, ExtensionRecord]] = None
+
+    def close(self):
+        for f, m in self.maps.values():
+            m.close()
+            f.close()
+        self.maps = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __getitem__(self, i: int) -> ThemeRecord:
+        return ThemeRecord(self, self.entries[i])
+
+    def __iter__(self) -> Iterator[ThemeRecord]:
+        for entry in self.entries:
+            yield ThemeRecord(self, entry)
+
+    def get(self, item_name: str, theme_path: str) -> ThemeRecord:
+        return ThemeRecord(self, self.index.entries[(item_name, theme_path)])
+
+    def themes_of(self, item_name: str) -> list[ThemeRecord]:
+        return [ThemeRecord(self, e) for e in self.index.items.get(item_name, [])]
+
+    def read(self, entry: IndexEntry) -> dict[str, Any]:
+        if entry.shard not in self.maps:
+            f = open(path.join(self.shards_dir, entry.shard), "rb")
+            self.maps[entry.shard] = (
+                f,
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ),
+            )
+        m = self.maps[entry.shard][1]
+        return json.loads(
+            gzip.decompress(m[entry.offset : entry.offset + entry.length])
+        )
+
+    @property
+    def extensions(self) -> dict[str, ExtensionRecord]:
+        if self._extensions is None:
+            self._extensions = {}
+            if path.exists(self.metadata_path):
+                with open(self.metadata_path, "r") as f:
+                    for metadata in iter_json_records(f):
+                        record = ExtensionRecord.from_json(metadata)
+                        self._extensions[record.item_name] = record
+        return self._extensions
+
+    def extension(self, item_name: str) -> Optional[ExtensionRecord]:
+        return self.extensions.get(item_name)
+
+    def filter(
+        self,
+        ui_theme: Optional[str | Container[str]] = None,
+        format: Optional[str | Container[str]] = None,
+        author: Optional[str | Container[str]] = None,
+        min_installs: Optional[int] = None,
+        max_installs: Optional[int] = None,
+        verified: Optional[bool] = None,
+    ) -> Iterator[ThemeRecord]:
+        # Themes are matched on the index and their extension's metadata, so
+        # nothing is decoded until the caller asks for contents. Themes without
+        # metadata never match a metadata filter.
+        by_extension = (
+            author is not None
+            or min_installs is not None
+            or max_installs is not None
+            or verified is not None
+        )
+        for entry in self.entries:
+            if not matches(entry.uiTheme, ui_theme) or not matches(
+                entry.format, format
+            ):
+                continue
+            if by_extension:
+                extension = self.extension(entry.itemName)
+                if (
+                    extension is None
+                    or not matches(extension.author, author)
+                    or (
+                        min_installs is not None
+                        and extension.num_installs < min_installs
+                    )
+                    or (
+                        max_installs is not None
+                        and extension.num_installs > max_installs
+                    )
+                    or (verified is not None and extension.verified != verified)
+                ):
+                    continue
+            yield ThemeRecord(self, entry)
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description="List themes in the dataset")
+    parser.add_argument("--shards", default=SHARDS_DIR)
+    parser.add_argument("--metadata", default=METADATA_PATH)
+    parser.add_argument("--ui-theme", action="append")
+    parser.add_argument("--format", action="append", choices=["json", "tmTheme"])
+    parser.add_argument("--author", action="append")
+    parser.add_argument("--min-installs", type=int)
+    parser.add_argument("--max-installs", type=int)
+    parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    with ThemeDataset(args.shards, args.metadata) as dataset:
+        found = dataset.filter(
+            ui_theme=args.ui_theme,
+            format=args.format,
+            author=args.author,
+            min_installs=args.min_installs,
+            max_installs=args.max_installs,
+        )
+        num_found = 0
+        for theme in found:
+            if num_found < args.limit:
+                print(f"{theme.item_name}  {theme.name}  ({theme.path})")
+            num_found += 1
+        print(f"{num_found} of {len(dataset)} themes")
+
+
+if __name__ == "__main__":
+    main()
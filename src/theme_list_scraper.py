@@ -6,27 +6,33 @@
 import json
 from os import path, readlink
 from time import sleep, time
-from typing import Callable
-
-import requests
-from bs4 import BeautifulSoup
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
+from typing import TYPE_CHECKING, Callable, Optional
 
+import gallery_api
 import theme_scraper
 
+if TYPE_CHECKING:
+    import requests
+    from bs4 import BeautifulSoup
+    from selenium import webdriver
+
+# "selenium" (infinite scroll) or "gallery" (paged extensionquery)
+LIST_BACKEND = "selenium"
 TIMEOUT = 120  # seconds
 PATH = readlink(__file__) if path.islink(__file__) else __file__
 SRC_DIR = path.dirname(PATH)
 TOP_DIR = path.dirname(SRC_DIR)
 DATA_DIR = path.join(TOP_DIR, "data")
 
-get_html: Callable[[str], BeautifulSoup] = lambda url: BeautifulSoup(
-    requests.get(url).text, "html.parser"
-)
 
-num_installs: Callable[[BeautifulSoup], str] = (
+def get_html(url: str) -> "BeautifulSoup":
+    import requests
+    from bs4 import BeautifulSoup
+
+    return BeautifulSoup(requests.get(url).text, "html.parser")
+
+
+num_installs: Callable[["BeautifulSoup"], str] = (
     lambda soup: soup.find_all(class_="installs-text")[0]
     .text.replace(",", "")
     .replace(" installs", "")
@@ -34,7 +40,10 @@ num_installs: Callable[[BeautifulSoup], str] = (
 )
 
 
-def get_all_themes(driver: webdriver.Chrome) -> list:
+def get_all_themes(driver: "webdriver.Chrome") -> list:
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.common.keys import Keys
+
     driver.get(
         "https://marketplace.visualstudio.com/search?target=VSCode&category=Themes&sortBy=Installs"
     )
@@ -66,8 +75,22 @@ def get_all_themes(driver: webdriver.Chrome) -> list:
     return [el.get_attribute("href") for el in els]
 
 
-def scrape_list():
-    with theme_scraper.WebdriverContext(headless=True) as driver:
+def get_all_themes_http(session: "requests.Session") -> list[dict]:
+    return gallery_api.list_themes(session)
+
+
+def scrape_list(backend: Optional[str] = None, headless=True):
+    if (backend or LIST_BACKEND) == "gallery":
+        with gallery_api.HttpSessionContext() as session:
+            theme_list = get_all_themes_http(session)
+        theme_links = [entry["url"] for entry in theme_list]
+        with open(path.join(DATA_DIR, "theme_list.json"), "w") as f:
+            json.dump(theme_list, f, indent=2)
+        with open(path.join(DATA_DIR, "theme_urls.json"), "w") as f:
+            json.dump(theme_links, f, indent=2)
+        return
+
+    with theme_scraper.WebdriverContext(headless=headless) as driver:
         theme_links = get_all_themes(driver)
         with open(path.join(DATA_DIR, "theme_urls.json"), "w") as f:
             json.dump(theme_links, f, indent=2)
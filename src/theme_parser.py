@@ -0,0 +1,109 @@
+import argparse
+import json
+import re
+from glob import glob
+from os import path
+from time import perf_counter
+from typing import Any, Optional
+
+TIER_JSON = "json"
+TIER_JSONC = "jsonc"
+TIER_JSON5 = "json5"
+TIERS = [TIER_JSON, TIER_JSONC, TIER_JSON5]
+
+# Strings are matched first so that comment markers and commas inside them
+# are left alone
+COMMENTS = re.compile(r'("(?:\\.|[^"\\])*")|//[^\n]*|/\*.*?\*/', re.S)
+TRAILING_COMMAS = re.compile(r'("(?:\\.|[^"\\])*")|,(\s*[}\]])', re.S)
+
+
+def strip_jsonc(text: str) -> str:
+    text = COMMENTS.sub(lambda m: m.group(1) or " ", text)
+    return TRAILING_COMMAS.sub(lambda m: m.group(1) or m.group(2), text)
+
+
+def parse_json(data: str | bytes) -> tuple[Any, str]:
+    text = data.decode("utf8") if isinstance(data, bytes) else data
+    text = text.lstrip("\ufeff")
+    try:
+        return json.loads(text), TIER_JSON
+    except ValueError:
+        pass
+    try:
+        return json.loads(strip_jsonc(text)), TIER_JSONC
+    except ValueError:
+        pass
+    # Only the few themes that need it pay for importing json5
+    import json5
+
+    return json5.loads(text), TIER_JSON5
+
+
+def loads(data: str | bytes) -> Any:
+    return parse_json(data)[0]
+
+
+def benchmark(fpaths: list[str], repeat: int = 3) -> dict[str, Any]:
+    import json5
+
+    files = []
+    for fpath in fpaths:
+        with open(fpath, "rb") as f:
+            files.append(f.read())
+
+    def time_parser(parse) -> float:
+        best = float("inf")
+        for _ in range(repeat):
+            start = perf_counter()
+            for data in files:
+                try:
+                    parse(data)
+                except ValueError:
+                    pass
+            best = min(best, perf_counter() - start)
+        return best
+
+    tiers = {tier: 0 for tier in TIERS}
+    mismatches = []
+    for fpath, data in zip(fpaths, files):
+        try:
+            expected = json5.loads(data)
+        except ValueError:
+            continue
+        out, tier = parse_json(data)
+        tiers[tier] += 1
+        if out != expected:
+            mismatches.append(fpath)
+
+    json5_time = time_parser(json5.loads)
+    tiered_time = time_parser(parse_json)
+    return {
+        "files": len(files),
+        "bytes": sum(len(data) for data in files),
+        "tiers": tiers,
+        "json5_seconds": json5_time,
+        "tiered_seconds": tiered_time,
+        "speedup": json5_time / tiered_time if tiered_time > 0 else float("inf"),
+        "mismatches": mismatches,
+    }
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Compare the tiered parser against json5 on a folder of themes"
+    )
+    parser.add_argument("paths", nargs="+", help="JSON files or folders of them")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    fpaths = []
+    for p in args.paths:
+        if path.isdir(p):
+            fpaths.extend(sorted(glob(path.join(p, "**", "*.json"), recursive=True)))
+        else:
+            fpaths.append(p)
+    print(json.dumps(benchmark(fpaths, repeat=args.repeat), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,62 @@
 import json
-import plistlib
-from dataclasses import asdict, dataclass, is_dataclass
+import posixpath
+from base64 import b64encode
+from collections import defaultdict
+from dataclasses import asdict, dataclass, field, is_dataclass
+from datetime import datetime
 from glob import glob
+from io import BytesIO
+from mmap import PAGESIZE
 from os import path, remove
-from pprint import pprint
-from time import sleep, time
-from typing import Any, Optional
-from zipfile import ZipFile
+from typing import TYPE_CHECKING, Any, BinaryIO, Callable, Optional
+from urllib.parse import quote
 
-import json5
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
+import gallery_api
+import theme_parser
+from vsix_cache import VsixCache
+
+# selenium, bs4 and requests are imported by the functions that drive a browser
+# or read a page, so that analyzing archives doesn't pay for them. Likewise
+# zipfile and plistlib, which the crawl's main process never needs.
+if TYPE_CHECKING:
+    import requests
+    from selenium import webdriver
 
 PAGELOAD_TIMEOUT = 10
 DOWNLOAD_TIMEOUT = 60
+MAX_PAGES_PER_DRIVER = 500
+MAX_DRIVER_RSS = 1 << 30  # bytes
+RSS_CHECK_INTERVAL = 20  # pages
+# Merge the themes a json theme "include"s into it, the way VS Code loads them.
+# Off by default, which keeps every file's contents exactly as shipped.
+RESOLVE_INCLUDES = False
+MAX_INCLUDE_DEPTH = 16
+BLOCKED_URL_PATTERNS = [
+    "*.png",
+    "*.jpg",
+    "*.jpeg",
+    "*.gif",
+    "*.svg",
+    "*.webp",
+    "*.ico",
+    "*.woff",
+    "*.woff2",
+    "*.ttf",
+    "*.css",
+]
 
-# def parse_xml_dict(xml_dict: dict) -> dict:
-#     for k in xml_dict['key']:
-#     return xml_dict
-
-# def tmtheme_to_json(tmtheme: dict) -> dict:
-#     if 'plist' in tmtheme.keys() and 'dict' in tmtheme['plist'].keys():
-#         out = tmtheme['plist']['dict']
 
-#         return out
-#     return tmtheme
+def tmtheme_to_json(tmtheme: Any) -> Any:
+    # plistlib gives us <date> and <data> values too, which json can't encode
+    if isinstance(tmtheme, dict):
+        return {k: tmtheme_to_json(v) for k, v in tmtheme.items()}
+    if isinstance(tmtheme, list):
+        return [tmtheme_to_json(v) for v in tmtheme]
+    if isinstance(tmtheme, datetime):
+        return tmtheme.isoformat()
+    if isinstance(tmtheme, bytes):
+        return b64encode(tmtheme).decode("ascii")
+    return tmtheme
 
 
 def filter_chars(text: str, filter_chars: list[str]) -> str:
@@ -40,30 +71,115 @@ class EnhancedJSONEncoder(json.JSONEncoder):
 
 
 class WebdriverContext:
-    def __init__(self, downloads_dir=None, headless=True):
+    def __init__(self, downloads_dir=None, headless=True, block_resources=True):
         self.headless = headless
         self.downloads_dir = downloads_dir
+        self.block_resources = block_resources
 
     def __enter__(self):
+        from selenium import webdriver
+        from selenium.webdriver.chrome.options import Options
+
         options = Options()
         options.headless = self.headless
         options.add_argument("--log-level=3")
         options.add_argument("--disable-gpu")
         options.add_argument("--disable-dev-shm-usage")
+        # Don't wait for images and stylesheets before handing back control
+        options.page_load_strategy = "eager"
+        prefs = {}
+        if self.block_resources:
+            prefs["profile.managed_default_content_settings.images"] = 2
         if self.downloads_dir:
-            prefs = {
-                "download.default_directory": self.downloads_dir,
-                "safebrowsing.disable_download_protection": True,
-            }
-            options.add_experimental_option("prefs", prefs)
+            prefs["download.default_directory"] = self.downloads_dir
+            prefs["safebrowsing.disable_download_protection"] = True
             # options.add_argument(f"download.default_directory={self.downloads_dir}")
+        options.add_experimental_option("prefs", prefs)
         self.driver = webdriver.Chrome(options=options)
+        if self.block_resources:
+            self.driver.execute_cdp_cmd("Network.enable", {})
+            self.driver.execute_cdp_cmd(
+                "Network.setBlockedURLs", {"urls": BLOCKED_URL_PATTERNS}
+            )
         return self.driver
 
     def __exit__(self, exc_type, exc_value, traceback):
         self.driver.quit()
 
 
+def process_tree_rss(pid: int) -> int:
+    # Resident memory in bytes of pid and all of its descendants, read from
+    # /proc. Returns 0 where /proc isn't available.
+    children = defaultdict(list)
+    rss = {}
+    for stat_path in glob("/proc/[0-9]*/stat"):
+        try:
+            with open(stat_path, "r") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        child = int(stat_path.split("/")[2])
+        children[int(fields[1])].append(child)
+        rss[child] = int(fields[21]) * PAGESIZE
+    total = 0
+    stack = [pid]
+    while len(stack) > 0:
+        p = stack.pop()
+        total += rss.get(p, 0)
+        stack.extend(children[p])
+    return total
+
+
+class WebdriverPool:
+    # Hands out one lean Chrome at a time and replaces it after
+    # MAX_PAGES_PER_DRIVER pages or once its process tree grows past
+    # MAX_DRIVER_RSS, since Chrome's memory use creeps up over long crawls
+    def __init__(
+        self,
+        downloads_dir=None,
+        headless=True,
+        max_pages=MAX_PAGES_PER_DRIVER,
+        max_rss=MAX_DRIVER_RSS,
+    ):
+        self.max_pages = max_pages
+        self.max_rss = max_rss
+        self.make_context = lambda: WebdriverContext(
+            downloads_dir=downloads_dir, headless=headless
+        )
+        self.context = None
+        self.pages = 0
+        self.num_recycled = 0
+
+    def driver(self) -> "webdriver.Chrome":
+        if self.context is not None and self.needs_recycling():
+            self.context.__exit__(None, None, None)
+            self.context = None
+            self.num_recycled += 1
+        if self.context is None:
+            self.context = self.make_context()
+            self.context.__enter__()
+            self.pages = 0
+        self.pages += 1
+        return self.context.driver
+
+    def needs_recycling(self) -> bool:
+        if self.pages >= self.max_pages:
+            return True
+        if self.max_rss and self.pages % RSS_CHECK_INTERVAL == 0:
+            return process_tree_rss(self.context.driver.service.process.pid) > (
+                self.max_rss
+            )
+        return False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.context is not None:
+            self.context.__exit__(exc_type, exc_value, traceback)
+            self.context = None
+
+
 @dataclass
 class Theme:
     url: str
@@ -80,17 +196,21 @@ class Theme:
     repository: str | None
 
 
-def analyze_page(driver: webdriver.Chrome, url: str) -> Theme:
+def analyze_page(driver: "webdriver.Chrome", url: str) -> Theme:
+    from selenium.common.exceptions import TimeoutException
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+
     driver.get(url)
-    categories_and_tags = []
-    start = time()
-    while (time() - start) < PAGELOAD_TIMEOUT:
-        sleep(0.1)
-        categories_and_tags = driver.find_elements(
-            by=By.CSS_SELECTOR, value="a.meta-data-list-link"
+    try:
+        categories_and_tags = WebDriverWait(driver, PAGELOAD_TIMEOUT).until(
+            EC.presence_of_all_elements_located(
+                (By.CSS_SELECTOR, "a.meta-data-list-link")
+            )
         )
-        if len(categories_and_tags) > 0:
-            break
+    except TimeoutException:
+        categories_and_tags = []
     repo_els = driver.find_elements(by=By.LINK_TEXT, value="Repository")
     if len(repo_els) > 0:
         repo_url = repo_els[0].get_attribute("href")
@@ -152,138 +272,384 @@ def analyze_page(driver: webdriver.Chrome, url: str) -> Theme:
     )
 
 
+def parse_count(text: str) -> int:
+    return int(
+        text.replace(",", "")
+        .replace("(", "")
+        .replace(")", "")
+        .replace(" install", "")
+        .replace("s", "")
+        .strip()
+    )
+
+
+def theme_from_extension(url: str, extension: dict[str, Any]) -> Theme:
+    publisher = extension.get("publisher", {})
+    return Theme(
+        url=url,
+        name=extension.get("displayName") or extension.get("extensionName", ""),
+        author=publisher.get("displayName", ""),
+        verified=publisher.get("isDomainVerified", False),
+        num_installs=int(gallery_api.get_statistic(extension, "install")),
+        num_ratings=int(gallery_api.get_statistic(extension, "ratingcount")),
+        average_rating=float(gallery_api.get_statistic(extension, "averagerating")),
+        description=extension.get("shortDescription", ""),
+        price="Paid" if "paid" in extension.get("flags", "") else "Free",
+        categories=extension.get("categories", []),
+        tags=[
+            t
+            for t in extension.get("tags", [])
+            if not t.startswith("__") and not t.startswith("$")
+        ],
+        repository=gallery_api.get_version_property(
+            extension, gallery_api.SOURCE_LINK_PROPERTIES
+        ),
+    )
+
+
+def theme_from_html(url: str, html: str) -> Theme:
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "html.parser")
+    extension_el = soup.select_one("script.vss-extension")
+    if extension_el is not None:
+        return theme_from_extension(url, json.loads(extension_el.string))
+
+    categories_and_tags = soup.select("a.meta-data-list-link")
+    repo_els = soup.find_all("a", string="Repository")
+    installs_els = soup.select("span.installs-text")
+    return Theme(
+        url=url,
+        name=soup.select_one("span.ux-item-name").text,
+        author=soup.select_one("a.ux-item-publisher-link").text,
+        verified=soup.select_one("div.verified-domain-icon") is not None,
+        num_installs=parse_count(installs_els[0].text) if installs_els else 0,
+        num_ratings=parse_count(soup.select_one("span.ux-item-rating-count").text),
+        average_rating=float(
+            soup.select_one("span.ux-item-review-rating")["title"]
+            .replace("Average rating:", "")
+            .replace("out of 5", "")
+            .strip()
+        ),
+        description=soup.select_one("div.ux-item-shortdesc").text,
+        price=soup.select_one("span.item-price-category").text,
+        categories=[
+            el.text
+            for el in categories_and_tags
+            if "Category" in el.get("aria-label", "")
+        ],
+        tags=[
+            el.text for el in categories_and_tags if "Tag" in el.get("aria-label", "")
+        ],
+        repository=repo_els[0]["href"] if repo_els else None,
+    )
+
+
+def analyze_page_http(
+    session: "requests.Session",
+    url: str,
+    use_gallery_api: bool = False,
+    base_url: str = gallery_api.MARKETPLACE_URL,
+) -> Theme:
+    name = gallery_api.item_name_from_url(url)
+    if use_gallery_api:
+        extension = gallery_api.get_extension(session, name, base_url=base_url)
+        if extension is None:
+            raise ValueError(f"{name} not found in gallery")
+        return theme_from_extension(url, extension)
+    res = gallery_api.request(
+        session,
+        "GET",
+        f"{base_url}/items",
+        params={"itemName": name},
+        timeout=gallery_api.REQUEST_TIMEOUT,
+    )
+    res.raise_for_status()
+    return theme_from_html(url, res.text)
+
+
 @dataclass
 class DownloadResults:
     fpath: str
     err: Optional[str] = None
+    data: Optional[bytes] = None
 
 
 def download_vsix(
-    driver: webdriver.Chrome, url: str, downloads_dir=""
+    driver: "webdriver.Chrome", url: str, downloads_dir="", extract=True
 ) -> DownloadResults:
-    name = url.replace("https://marketplace.visualstudio.com/items?itemName=", "")
+    from selenium.common.exceptions import TimeoutException
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    name = gallery_api.item_name_from_url(url)
     driver.get(url)
-    start = time()
-    but = []
-    while (time() - start) < PAGELOAD_TIMEOUT:
-        sleep(0.1)
-        but = driver.find_elements(by=By.CSS_SELECTOR, value="button.root-47")
-        if len(but) > 0:
-            but[0].click()
-            start = time()
-            files = []
-            while (time() - start) < DOWNLOAD_TIMEOUT:
-                files = glob(path.join(downloads_dir, name) + "*.vsix")
-                if len(files) > 0:
-                    if len(files) > 1:
-                        return DownloadResults(fpath="", err="Multiple files found")
-                    folder_path = files[0].replace(".vsix", "")
-                    try:
-                        with ZipFile(files[0], "r") as zip_ref:
-                            zip_ref.extractall(folder_path)
-                        remove(files[0])
-                    except Exception as e:
-                        remove(files[0])
-                        return DownloadResults(fpath="", err=str(e).split("'c:")[0])
-                    start = time()
-                    folder_paths = []
-                    while (time() - start) < DOWNLOAD_TIMEOUT:
-                        folder_paths = glob(path.join(downloads_dir, name) + "*")
-                        if len(folder_paths) > 0:
-                            return DownloadResults(fpath=folder_paths[0])
-                sleep(0.1)
-            return DownloadResults(
-                fpath="", err="Download timed out. Try increasing DOWNLOAD_TIMEOUT."
-            )
+    try:
+        button = WebDriverWait(driver, PAGELOAD_TIMEOUT).until(
+            EC.element_to_be_clickable((By.CSS_SELECTOR, "button.root-47"))
+        )
+    except TimeoutException:
+        return DownloadResults(
+            fpath="",
+            err="No button found. Try increasing PAGELOAD_TIMEOUT or rerunning theme_list_scraper.py.",
+        )
+    button.click()
 
-    return DownloadResults(
-        fpath="",
-        err="No button found. Try increasing PAGELOAD_TIMEOUT or rerunning theme_list_scraper.py.",
-    )
+    try:
+        files = WebDriverWait(driver, DOWNLOAD_TIMEOUT, poll_frequency=0.1).until(
+            lambda _: glob(path.join(downloads_dir, name) + "*.vsix")
+        )
+    except TimeoutException:
+        return DownloadResults(
+            fpath="", err="Download timed out. Try increasing DOWNLOAD_TIMEOUT."
+        )
+    if len(files) > 1:
+        return DownloadResults(fpath="", err="Multiple files found")
+    if not extract:
+        return DownloadResults(fpath=files[0])
+    from zipfile import ZipFile
+
+    folder_path = files[0].replace(".vsix", "")
+    try:
+        with ZipFile(files[0], "r") as zip_ref:
+            zip_ref.extractall(folder_path)
+        remove(files[0])
+    except Exception as e:
+        remove(files[0])
+        return DownloadResults(fpath="", err=str(e).split("'c:")[0])
+    return DownloadResults(fpath=folder_path)
+
+
+def download_vsix_http(
+    session: "requests.Session",
+    url: str,
+    version: str = "latest",
+    retries: int = 3,
+    base_url: str = gallery_api.MARKETPLACE_URL,
+) -> DownloadResults:
+    name = gallery_api.item_name_from_url(url)
+    try:
+        data = gallery_api.download(
+            session, gallery_api.vsix_url(name, version, base_url), retries=retries
+        )
+    except Exception as e:
+        return DownloadResults(fpath="", err=str(e))
+    if data[:2] != b"PK":
+        return DownloadResults(fpath="", err="Downloaded file is not a VSIX archive")
+    return DownloadResults(fpath="", data=data)
+
+
+def download_vsix_cached(
+    session: "requests.Session",
+    cache: VsixCache,
+    url: str,
+    base_url: str = gallery_api.MARKETPLACE_URL,
+    version: Optional[str] = None,
+) -> DownloadResults:
+    # The gallery is only asked for the latest version when we weren't told it,
+    # e.g. by the theme list
+    name = gallery_api.item_name_from_url(url)
+    if version is None:
+        try:
+            version = gallery_api.get_latest_version(session, name, base_url=base_url)
+        except Exception as e:
+            return DownloadResults(fpath="", err=str(e))
+    if version is None:
+        return DownloadResults(fpath="", err=f"{name} not found in gallery")
+    data = cache.get(name, version)
+    if data is not None:
+        return DownloadResults(fpath="", data=data)
+    results = download_vsix_http(session, url, version=version, base_url=base_url)
+    if not results.err:
+        cache.put(name, version, results.data)
+    return results
 
 
 @dataclass
 class AnalysisResults:
     analysis: list[dict[str, Any]]
     err: Optional[str] = None
+    # Which theme_parser tier handled each JSON file
+    parsers: dict[str, str] = field(default_factory=dict)
 
 
-def analyze_vsix(full_path: str) -> AnalysisResults:
+def merge_included(base: dict[str, Any], theme: dict[str, Any]) -> dict[str, Any]:
+    # Builds new dicts and lists, since base may be shared with other themes
+    out = {**base, **theme}
+    for key in ["colors", "semanticTokenColors"]:
+        if isinstance(base.get(key), dict) and isinstance(theme.get(key), dict):
+            out[key] = {**base[key], **theme[key]}
+    if isinstance(base.get("tokenColors"), list) and isinstance(
+        theme.get("tokenColors"), list
+    ):
+        out["tokenColors"] = base["tokenColors"] + theme["tokenColors"]
+    out.pop("include", None)
+    return out
+
+
+def analyze_extension(
+    read_file: Callable[[str], bytes],
+    name: str,
+    resolve_includes: Optional[bool] = None,
+) -> AnalysisResults:
+    if resolve_includes is None:
+        resolve_includes = RESOLVE_INCLUDES
     out = []
-    for _ in range(5):
-        try:
-            with open(
-                path.join(full_path, "extension", "package.json"),
-                "r",
-                encoding="utf8",
-            ) as f:
-                package_text = f.read()
-                package = json5.loads(package_text)
-                if (
-                    "contributes" in package.keys()
-                    and "themes" in package["contributes"].keys()
-                ):
-                    # uiTheme
-                    for p in filter(
-                        lambda p: "path" in p.keys(), package["contributes"]["themes"]
-                    ):
-                        t = p["path"].replace("./", "")
-                        u = p["uiTheme"] if "uiTheme" in p.keys() else ""
-                        # print(
-                        #     f"\tin for loop, opening {path.join(full_path, 'extension', t)}"
-                        # )
-                        with open(
-                            path.join(full_path, "extension", t),
-                            "rb",
-                        ) as f:
-                            if "displayName" in package.keys():
-                                displayName = package["displayName"]
-                            else:
-                                displayName = full_path
-                            if t[-4:] == "json":
-                                text = f.read()
-                                out.append(
-                                    {
-                                        "name": displayName,
-                                        "theme": {
-                                            "uiTheme": u,
-                                            "path": t,
-                                            "format": "json",
-                                            "contents": json5.loads(text),
-                                        },
-                                    }
-                                )
-                            elif t[-7:].lower() == "tmtheme":
-                                text = f.read()
-                                out.append(
-                                    {
-                                        "name": displayName,
-                                        "theme": {
-                                            "uiTheme": u,
-                                            "path": t,
-                                            "format": "tmTheme",
-                                            "contents": plistlib.loads(text),
-                                        },
-                                    }
-                                )
-                            else:
-                                # TODO: verbosity levels
-                                print(f"Skipping {t}, not a json or tmTheme file")
-                                return AnalysisResults(
-                                    analysis=out, err="Unknown file type"
-                                )
+    parsers = {}
+    # Variants often share a base file, and some extensions list a file twice
+    parsed = {}
+    resolved = {}
+
+    def parse_json(member: str) -> Any:
+        if member not in parsed:
+            parsed[member], parsers[member] = theme_parser.parse_json(read_file(member))
+        return parsed[member]
+
+    def parse_tmtheme(member: str) -> Any:
+        import plistlib
+
+        if member not in parsed:
+            parsed[member] = tmtheme_to_json(plistlib.loads(read_file(member)))
+        return parsed[member]
+
+    def resolve(member: str, depth: int = 0) -> Any:
+        # A theme with whatever it includes (recursively) merged in
+        if member in resolved:
+            return resolved[member]
+        if depth > MAX_INCLUDE_DEPTH:
+            raise ValueError(f"Includes nested too deeply in {member}")
+        theme = parse_json(member)
+        if isinstance(theme, dict):
+            tokens = theme.get("tokenColors")
+            if isinstance(tokens, str):
+                # Token colors kept in a tmTheme next to the theme
+                tokens_path = posixpath.join(posixpath.dirname(member), tokens)
+                settings = parse_tmtheme(posixpath.normpath(tokens_path))
+                theme = {**theme, "tokenColors": settings.get("settings", [])}
+            include = theme.get("include")
+            if isinstance(include, str):
+                base_path = posixpath.join(posixpath.dirname(member), include)
+                base_path = posixpath.normpath(base_path)
+                if base_path.lower().endswith("tmtheme"):
+                    base = {"tokenColors": parse_tmtheme(base_path).get("settings", [])}
                 else:
-                    # print(
-                    #     f"[analyze_vsix] {full_path} is not a theme extension after all"
-                    # )
-                    return AnalysisResults(analysis=out, err="Not a theme extension")
-            break
-        except Exception as e:
-            return AnalysisResults(analysis=out, err=str(e).split("'c:")[0])
-    return AnalysisResults(analysis=out, err=None)
+                    base = resolve(base_path, depth + 1)
+                theme = merge_included(base, theme)
+        resolved[member] = theme
+        return theme
+
+    try:
+        package = parse_json("package.json")
+        if (
+            "contributes" in package.keys()
+            and "themes" in package["contributes"].keys()
+        ):
+            if "displayName" in package.keys():
+                displayName = package["displayName"]
+            else:
+                displayName = name
+            # uiTheme
+            for p in filter(
+                lambda p: "path" in p.keys(), package["contributes"]["themes"]
+            ):
+                t = p["path"].replace("./", "")
+                u = p["uiTheme"] if "uiTheme" in p.keys() else ""
+                if t[-4:] == "json":
+                    out.append(
+                        {
+                            "name": displayName,
+                            "theme": {
+                                "uiTheme": u,
+                                "path": t,
+                                "format": "json",
+                                "contents": (
+                                    resolve(t) if resolve_includes else parse_json(t)
+                                ),
+                            },
+                        }
+                    )
+                elif t[-7:].lower() == "tmtheme":
+                    out.append(
+                        {
+                            "name": displayName,
+                            "theme": {
+                                "uiTheme": u,
+                                "path": t,
+                                "format": "tmTheme",
+                                "contents": parse_tmtheme(t),
+                            },
+                        }
+                    )
+                else:
+                    # TODO: verbosity levels
+                    print(f"Skipping {t}, not a json or tmTheme file")
+                    return AnalysisResults(
+                        analysis=out, err="Unknown file type", parsers=parsers
+                    )
+        else:
+            return AnalysisResults(
+                analysis=out, err="Not a theme extension", parsers=parsers
+            )
+    except Exception as e:
+        return AnalysisResults(
+            analysis=out, err=str(e).split("'c:")[0], parsers=parsers
+        )
+    return AnalysisResults(analysis=out, err=None, parsers=parsers)
+
+
+def missing_member(member: str) -> FileNotFoundError:
+    # The same error from an extracted folder and an archive, so that both
+    # record the same failure reason
+    return FileNotFoundError(
+        f"No such file in extension: '{posixpath.normpath(member)}'"
+    )
+
+
+def analyze_vsix(full_path: str) -> AnalysisResults:
+    def read_file(member: str) -> bytes:
+        try:
+            with open(path.join(full_path, "extension", member), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            raise missing_member(member) from None
+
+    return analyze_extension(read_file, full_path)
+
+
+def analyze_vsix_archive(
+    vsix: str | bytes | BinaryIO, name: Optional[str] = None
+) -> AnalysisResults:
+    from zipfile import ZipFile
+
+    if name is None:
+        name = vsix if isinstance(vsix, str) else ""
+    try:
+        zip_ref = ZipFile(BytesIO(vsix) if isinstance(vsix, bytes) else vsix, "r")
+    except Exception as e:
+        return AnalysisResults(analysis=[], err=str(e).split("'c:")[0])
+
+    with zip_ref:
+        # Extracted folders are looked up case-insensitively on Windows, and OPC
+        # percent-encodes some characters in member names
+        members = {m.lower(): m for m in zip_ref.namelist()}
+
+        def read_file(member: str) -> bytes:
+            full_member = posixpath.normpath(posixpath.join("extension", member))
+            for candidate in [full_member, quote(full_member)]:
+                if candidate.lower() in members:
+                    return zip_ref.read(members[candidate.lower()])
+            raise missing_member(member)
+
+        return analyze_extension(read_file, name)
 
 
 if __name__ == "__main__":
+    from pprint import pprint
+
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+
     woptions = Options()
     woptions.headless = True
     wdriver = webdriver.Chrome(options=woptions)
@@ -0,0 +1,155 @@
+import sqlite3
+from os import makedirs, path, remove, replace
+from threading import RLock
+from time import time
+from typing import Optional
+
+CACHE_SIZE = 4 << 30  # bytes
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+"""
+
+
+def cache_key(item_name: str, version: str) -> str:
+    return f"{item_name}@{version}"
+
+
+class VsixCache:
+    # Archives are stored once per content hash under cache_dir, and looked up
+    # through an index keyed by publisher.name@version
+    def __init__(self, cache_dir: str, max_bytes: int = CACHE_SIZE):
+        makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # Several workers share one cache, so wait on each other's writes. Within
+        # a process the connection may be shared between threads.
+        self.lock = RLock()
+        self.db = sqlite3.connect(
+            path.join(cache_dir, "index.sqlite"), timeout=60, check_same_thread=False
+        )
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def blob_path(self, sha256: str) -> str:
+        return path.join(self.cache_dir, sha256[:2], sha256 + ".vsix")
+
+    def get(self, item_name: str, version: str) -> Optional[bytes]:
+        with self.lock:
+            return self._get(item_name, version)
+
+    def put(self, item_name: str, version: str, data: bytes) -> str:
+        with self.lock:
+            return self._put(item_name, version, data)
+
+    def latest(self, item_name: str) -> Optional[bytes]:
+        # Whichever version of the extension was cached or used last
+        with self.lock:
+            prefix = cache_key(item_name, "")
+            row = self.db.execute(
+                """
+                SELECT key FROM entries WHERE substr(key, 1, ?) = ?
+                ORDER BY last_used DESC LIMIT 1
+                """,
+                (len(prefix), prefix),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            return self._get(item_name, row[0][len(prefix) :])
+
+    def _get(self, item_name: str, version: str) -> Optional[bytes]:
+        # Imported here, as the crawl's main process opens no cache
+        import hashlib
+
+        key = cache_key(item_name, version)
+        row = self.db.execute(
+            "SELECT sha256 FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is not None:
+            try:
+                with open(self.blob_path(row[0]), "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                data = None
+            if data is not None and hashlib.sha256(data).hexdigest() == row[0]:
+                with self.db:
+                    self.db.execute(
+                        "UPDATE entries SET last_used = ? WHERE key = ?", (time(), key)
+                    )
+                self.hits += 1
+                return data
+            # Missing or corrupted blob, forget about it
+            with self.db:
+                self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+        self.misses += 1
+        return None
+
+    def _put(self, item_name: str, version: str, data: bytes) -> str:
+        import hashlib
+
+        sha256 = hashlib.sha256(data).hexdigest()
+        fpath = self.blob_path(sha256)
+        if not path.exists(fpath):
+            makedirs(path.dirname(fpath), exist_ok=True)
+            tmp_path = f"{fpath}.{time()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            replace(tmp_path, fpath)
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                (cache_key(item_name, version), sha256, len(data), time()),
+            )
+        self.evict()
+        return sha256
+
+    def size(self) -> int:
+        # Entries sharing a blob only take up disk space once
+        row = self.db.execute(
+            "SELECT SUM(size) FROM (SELECT DISTINCT sha256, size FROM entries)"
+        ).fetchone()
+        return row[0] or 0
+
+    def evict(self):
+        total = self.size()
+        if total <= self.max_bytes:
+            return
+        rows = self.db.execute(
+            "SELECT key, sha256, size FROM entries ORDER BY last_used"
+        ).fetchall()
+        for key, sha256, size in rows:
+            if total <= self.max_bytes:
+                break
+            with self.db:
+                self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                shared = self.db.execute(
+                    "SELECT 1 FROM entries WHERE sha256 = ?", (sha256,)
+                ).fetchone()
+            if shared is None:
+                try:
+                    remove(self.blob_path(sha256))
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
@@ -0,0 +1,45 @@
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import path
+from threading import Thread
+from typing import Callable, Iterator
+
+import pytest
+
+TESTS_DIR = path.dirname(path.abspath(__file__))
+FIXTURES_DIR = path.join(TESTS_DIR, "fixtures")
+sys.path.insert(0, path.join(path.dirname(TESTS_DIR), "src"))
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    # Quiet by default, tests don't need an access log
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status: int, body: bytes, content_type: str, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def stand_in() -> Iterator[Callable[[type], str]]:
+    # Starts a local stand-in for the marketplace with the given handler class
+    # and returns its base URL. Servers are shut down after the test.
+    servers = []
+
+    def start(handler: type) -> str:
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        server.daemon_threads = True
+        Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
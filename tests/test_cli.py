@@ -0,0 +1,49 @@
+import pytest
+
+import cli
+import multiprocess_scraper
+import pipeline
+
+
+@pytest.fixture
+def settings(monkeypatch):
+    # Put back whatever the command line changes
+    monkeypatch.setattr(multiprocess_scraper, "overrides", {})
+    for name in ["LOGLEVEL", "STATE_DB", "THROTTLE"]:
+        monkeypatch.setattr(
+            multiprocess_scraper, name, getattr(multiprocess_scraper, name)
+        )
+    for name in cli.PIPELINE_SETTINGS.values():
+        monkeypatch.setattr(pipeline, name, getattr(pipeline, name))
+
+
+def test_pipeline_settings(settings):
+    num_parsers = pipeline.NUM_PARSERS
+    cli.main(
+        [
+            "--startup-only",
+            "pipeline",
+            "--state",
+            "pipeline.sqlite",
+            "--log-level",
+            "1",
+            "--no-throttle",
+            "--no-metadata",
+            "--download-workers",
+            "3",
+        ]
+    )
+    assert pipeline.SCRAPE_METADATA is False
+    assert pipeline.NUM_DOWNLOAD_WORKERS == 3
+    assert pipeline.NUM_PARSERS == num_parsers
+    assert multiprocess_scraper.overrides == {
+        "STATE_DB": "pipeline.sqlite",
+        "LOGLEVEL": 1,
+        "THROTTLE": False,
+    }
+    assert multiprocess_scraper.LOGLEVEL == 1
+
+
+def test_pipeline_rejects_crawl_options(settings):
+    with pytest.raises(SystemExit):
+        cli.main(["--startup-only", "pipeline", "--batch-size", "4"])
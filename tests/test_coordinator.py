@@ -0,0 +1,169 @@
+import io
+import json
+import multiprocessing
+import os
+from time import monotonic, sleep
+from zipfile import ZipFile
+
+import pytest
+
+import coordinator
+import gallery_api
+import multiprocess_scraper
+import theme_scraper
+from coordinator import Coordinator, CoordinatorClient
+from crawl_state import CrawlState
+from job_queue import ResultBatch
+
+NUM_ITEMS = 40
+URLS = [gallery_api.item_url(f"pub.theme-{i}") for i in range(NUM_ITEMS)]
+LEASE_SECONDS = 1.5
+
+# Nodes are forked so that they share the stand-in downloads patched in below
+pytestmark = pytest.mark.skipif(
+    multiprocessing.get_start_method() != "fork", reason="needs forked nodes"
+)
+
+
+def make_vsix() -> bytes:
+    buf = io.BytesIO()
+    with ZipFile(buf, "w") as zip_ref:
+        zip_ref.writestr(
+            "extension/package.json",
+            json.dumps(
+                {
+                    "displayName": "Theme",
+                    "contributes": {
+                        "themes": [{"uiTheme": "vs-dark", "path": "./theme.json"}]
+                    },
+                }
+            ),
+        )
+        zip_ref.writestr("extension/theme.json", '{"colors": {}}')
+    return buf.getvalue()
+
+
+VSIX = make_vsix()
+
+
+def download(session, url, *args, **kwargs) -> theme_scraper.DownloadResults:
+    sleep(0.01)
+    return theme_scraper.DownloadResults(fpath="", data=VSIX)
+
+
+def hang(session, url, *args, **kwargs):
+    # Holds on to the job until the node that leased it is killed
+    node = os.getppid()
+    while os.getppid() == node:
+        sleep(0.05)
+    os._exit(0)
+
+
+def themes_per_item(state: CrawlState) -> dict[str, int]:
+    rows = state.db.execute("SELECT item_name, COUNT(*) FROM themes GROUP BY 1")
+    return dict(rows.fetchall())
+
+
+@pytest.fixture
+def crawl(tmp_path, monkeypatch):
+    monkeypatch.setattr(multiprocess_scraper, "TEMP_DIR", str(tmp_path / "temp"))
+    monkeypatch.setattr(multiprocess_scraper, "DOWNLOAD_BACKEND", "http")
+    monkeypatch.setattr(multiprocess_scraper, "USE_VSIX_CACHE", False)
+    monkeypatch.setattr(multiprocess_scraper, "SHARDED_OUTPUT", False)
+    monkeypatch.setattr(multiprocess_scraper, "METRICS", False)
+    monkeypatch.setattr(multiprocess_scraper, "THROTTLE", False)
+    monkeypatch.setattr(multiprocess_scraper, "LOGLEVEL", 0)
+    # Read by the coordinator when it's used, not when it's imported
+    monkeypatch.setattr(multiprocess_scraper, "JOB_BATCH_SIZE", 4)
+    monkeypatch.setattr(coordinator, "POLL_INTERVAL", 0.2)
+    monkeypatch.setattr(coordinator, "RENEW_INTERVAL", LEASE_SECONDS / 3)
+
+    state = CrawlState(str(tmp_path / "state.sqlite"))
+    state.add_urls(URLS)
+    collector = multiprocess_scraper.Collector(state, {"vsix": NUM_ITEMS})
+    coord = Coordinator(state, collector, "vsix", lease_seconds=LEASE_SECONDS)
+    server, _ = coordinator.serve(coord, host="127.0.0.1", port=0)
+    yield coord, f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+    collector.close()
+    state.close()
+
+
+def start_node(url: str, name: str) -> multiprocessing.Process:
+    return multiprocess_scraper.start_worker(
+        coordinator.run_node, CoordinatorClient(url), "vsix", 2, name
+    )
+
+
+def test_killed_node_is_released(crawl, monkeypatch):
+    coord, url = crawl
+    state = coord.state
+
+    monkeypatch.setattr(theme_scraper, "download_vsix_http", hang)
+    doomed = start_node(url, "doomed")
+    deadline = monotonic() + 10
+    leased = []
+    while len(leased) == 0 and monotonic() < deadline:
+        sleep(0.05)
+        with coord.lock:
+            leased = [
+                row[0]
+                for row in state.db.execute(
+                    "SELECT item_name FROM leases WHERE node = 'doomed'"
+                )
+            ]
+    # Two batches of JOB_BATCH_SIZE per worker
+    assert len(leased) == 2 * 4 * 2
+    doomed.kill()
+    doomed.join()
+
+    monkeypatch.setattr(theme_scraper, "download_vsix_http", download)
+    nodes = [start_node(url, f"node-{i}") for i in range(2)]
+    coord.finished.wait(30)
+    for p in nodes:
+        p.join(10)
+        assert p.exitcode == 0
+    coord.flush()
+
+    assert coord.finished.is_set()
+    assert state.pending("vsix") == []
+    assert state.summary()["analysis"] == {"done": NUM_ITEMS}
+    with coord.lock:
+        nodes_by_item = dict(
+            state.db.execute("SELECT item_name, node FROM leases").fetchall()
+        )
+    assert all(nodes_by_item[name] != "doomed" for name in leased)
+    assert themes_per_item(state) == {
+        gallery_api.item_name_from_url(u): 1 for u in URLS
+    }
+
+
+def test_duplicate_complete(crawl, monkeypatch):
+    coord, url = crawl
+    state = coord.state
+    monkeypatch.setattr(theme_scraper, "download_vsix_http", download)
+    node = start_node(url, "node")
+    coord.finished.wait(30)
+    node.join(10)
+
+    with coord.lock:
+        lease_id, item_url = state.db.execute(
+            """
+            SELECT lease_id, url FROM leases JOIN items USING (item_name)
+            ORDER BY lease_id LIMIT 1
+            """
+        ).fetchone()
+    before = themes_per_item(state)
+    theme = {"name": "Theme", "theme": {"path": "theme.json"}}
+    client = CoordinatorClient(url)
+    for results in [
+        {"themes": [{"url": item_url, "themes": [theme, theme]}]},
+        {"failed": [{"url": item_url, "stage": "download", "reason": "late"}]},
+    ]:
+        client.complete([lease_id], ResultBatch("vsix", results, completed=1))
+
+    assert themes_per_item(state) == before
+    assert sum(before.values()) == NUM_ITEMS
+    assert state.is_done("vsix", item_url)
+    assert state.failures(["download", "analysis"]) == []
@@ -0,0 +1,99 @@
+import gallery_api
+from crawl_state import CrawlState
+from shards import ShardedDataset, ShardWriter
+
+ITEMS = [f"pub.theme-{i}" for i in range(4)]
+URLS = [gallery_api.item_url(name) for name in ITEMS]
+
+
+def entry(i: int, version: str = "1.0.0") -> dict[str, str]:
+    return {"url": URLS[i], "version": version, "lastUpdated": f"2024-0{i + 1}-01"}
+
+
+def complete(state: CrawlState, urls: list[str]):
+    for url in urls:
+        state.record_metadata(url, {"url": url})
+        state.record_themes(url, [])
+
+
+def test_sync_list(tmp_path):
+    with CrawlState(str(tmp_path / "state.sqlite")) as state:
+        # theme-0 to 2 crawled from the list with versions, theme-3 from a list
+        # of urls only
+        state.add_entries([entry(0), entry(1), entry(2)])
+        state.add_urls([URLS[3]])
+        complete(state, URLS)
+        assert state.pending("vsix") == []
+
+        delta = state.sync_list([entry(0), entry(1, "2.0.0"), entry(3)])
+        assert delta["added"] == []
+        assert delta["updated"] == [
+            {
+                "url": URLS[1],
+                "from": "1.0.0",
+                "to": "2.0.0",
+                "lastUpdated": "2024-02-01",
+            },
+            {"url": URLS[3], "from": None, "to": "1.0.0", "lastUpdated": "2024-04-01"},
+        ]
+        assert delta["removed"] == [URLS[2]]
+        assert delta["unchanged"] == 1
+        assert state.pending("metadata") == [URLS[1], URLS[3]]
+        assert state.pending("vsix") == [URLS[1], URLS[3]]
+        assert state.versions()[URLS[1]] == "2.0.0"
+
+        # Back on the marketplace, and a new one
+        delta = state.sync_list([entry(0), entry(1, "2.0.0"), entry(2), entry(3)])
+        assert delta["updated"] == [
+            {
+                "url": URLS[2],
+                "from": "1.0.0",
+                "to": "1.0.0",
+                "lastUpdated": "2024-03-01",
+            }
+        ]
+        assert delta["removed"] == []
+        delta = state.sync_list([entry(0)])
+        assert sorted(delta["removed"]) == URLS[1:]
+        new_url = gallery_api.item_url("pub.new-theme")
+        delta = state.sync_list([entry(0), {"url": new_url, "version": "0.1.0"}])
+        assert delta["added"] == [new_url]
+        assert delta["unchanged"] == 1
+
+
+def test_add_entries_keeps_known_versions(tmp_path):
+    with CrawlState(str(tmp_path / "state.sqlite")) as state:
+        state.add_entries([entry(0)])
+        state.add_entries([entry(0, "2.0.0"), entry(1)])
+        assert state.versions() == {URLS[0]: "1.0.0", URLS[1]: "1.0.0"}
+
+
+def test_removed_items_leave_failures_and_shards(tmp_path):
+    shards_dir = str(tmp_path / "shards")
+    with CrawlState(str(tmp_path / "state.sqlite")) as state:
+        state.add_entries([entry(0), entry(1)])
+        state.record_failure(URLS[0], "download", "[Download] 404")
+        state.record_failure(URLS[1], "download", "[Download] 404")
+        delta = state.sync_list([entry(1)])
+        assert state.failures(["download"]) == [
+            {"url": URLS[1], "reason": "[Download] 404"}
+        ]
+
+    theme = {
+        "name": "Dark",
+        "theme": {"uiTheme": "vs-dark", "path": "dark.json", "format": "json"},
+    }
+    with ShardWriter(shards_dir) as writer:
+        writer.write_item(ITEMS[0], [theme])
+        writer.write_item(ITEMS[1], [theme])
+    with ShardWriter(shards_dir) as writer:
+        for url in delta["removed"]:
+            writer.remove_item(gallery_api.item_name_from_url(url))
+    dataset = ShardedDataset(shards_dir)
+    assert list(dataset.items) == [ITEMS[1]]
+    assert len(dataset) == 1
+
+    # Written again once it's back
+    with ShardWriter(shards_dir) as writer:
+        writer.write_item(ITEMS[0], [theme])
+    assert sorted(ShardedDataset(shards_dir).items) == ITEMS[:2]
@@ -0,0 +1,110 @@
+import json
+from threading import Lock
+from time import sleep
+
+import pytest
+from conftest import StandInHandler
+
+import gallery_api
+
+NUM_EXTENSIONS = 237
+PAGE_SIZE = 10  # 24 pages, the last one short
+
+CATALOG = [
+    {
+        "publisher": {"publisherName": f"pub{i % 7}"},
+        "extensionName": f"theme-{i}",
+        "versions": [{"version": f"1.{i}.0"}],
+        "lastUpdated": f"2024-01-{1 + i % 28:02d}T00:00:00Z",
+    }
+    for i in range(NUM_EXTENSIONS)
+]
+
+
+class GalleryHandler(StandInHandler):
+    # Pages of CATALOG sorted by installs, slow enough that concurrent page
+    # fetches overlap. With overlap, every page after the first starts one item
+    # early, like a theme that moved up a page between requests.
+    overlap = 0
+    active = 0
+    max_active = 0
+    queries: list[dict] = []
+    lock = Lock()
+
+    def do_POST(self):
+        query = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        cls = type(self)
+        with cls.lock:
+            cls.queries.append(query)
+            cls.active += 1
+            cls.max_active = max(cls.max_active, cls.active)
+        sleep(0.05)
+        with cls.lock:
+            cls.active -= 1
+
+        page = query["filters"][0]
+        start = (page["pageNumber"] - 1) * page["pageSize"]
+        if page["pageNumber"] > 1:
+            start -= self.overlap
+        result = {
+            "extensions": CATALOG[start : start + page["pageSize"]],
+            "resultMetadata": [
+                {
+                    "metadataType": "ResultCount",
+                    "metadataItems": [{"name": "TotalCount", "count": len(CATALOG)}],
+                }
+            ],
+        }
+        body = json.dumps({"results": [result]}).encode()
+        self.send_body(200, body, "application/json")
+
+
+@pytest.fixture
+def gallery(stand_in):
+    def start(overlap: int = 0) -> tuple[type, str]:
+        handler = type("Handler", (GalleryHandler,), {"overlap": overlap})
+        handler.queries = []
+        return handler, stand_in(handler)
+
+    with gallery_api.HttpSessionContext() as session:
+        yield session, start
+
+
+def test_iter_theme_pages(gallery):
+    session, start = gallery
+    handler, base_url = start()
+    pages = list(
+        gallery_api.iter_theme_pages(
+            session, page_size=PAGE_SIZE, max_workers=4, base_url=base_url
+        )
+    )
+
+    assert [len(page) for page in pages] == [PAGE_SIZE] * 23 + [7]
+    entries = [entry for page in pages for entry in page]
+    assert entries == [gallery_api.list_entry(e) for e in CATALOG]
+    assert len({entry["url"] for entry in entries}) == NUM_EXTENSIONS
+    assert entries[5] == {
+        "url": gallery_api.item_url("pub5.theme-5"),
+        "version": "1.5.0",
+        "lastUpdated": "2024-01-06T00:00:00Z",
+    }
+
+    page_numbers = sorted(q["filters"][0]["pageNumber"] for q in handler.queries)
+    assert page_numbers == list(range(1, 25))
+    assert handler.max_active > 1
+    for query in handler.queries:
+        assert query["flags"] == gallery_api.LIST_FLAGS
+        assert query["filters"][0]["criteria"] == gallery_api.THEME_CRITERIA
+
+
+def test_list_themes_drops_shifted_duplicates(gallery):
+    session, start = gallery
+    _, base_url = start(overlap=1)
+    themes = gallery_api.list_themes(
+        session, page_size=PAGE_SIZE, max_workers=4, base_url=base_url
+    )
+
+    urls = [entry["url"] for entry in themes]
+    assert len(urls) == len(set(urls))
+    assert themes == [gallery_api.list_entry(e) for e in CATALOG]
+    assert all(entry["version"] and entry["lastUpdated"] for entry in themes)
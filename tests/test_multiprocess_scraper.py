@@ -0,0 +1,34 @@
+import pytest
+
+import multiprocess_scraper
+
+
+@pytest.fixture
+def settings(monkeypatch):
+    # configure() replaces module globals and records them for workers, both
+    # of which are put back after the test
+    monkeypatch.setattr(multiprocess_scraper, "overrides", {})
+    monkeypatch.setattr(multiprocess_scraper, "LOGLEVEL", multiprocess_scraper.LOGLEVEL)
+
+
+def test_log_level_is_read_when_logging(settings, capsys):
+    multiprocess_scraper.configure(LOGLEVEL=4)
+    multiprocess_scraper.debug("debug")
+    multiprocess_scraper.info("info")
+    multiprocess_scraper.configure(LOGLEVEL=1)
+    multiprocess_scraper.debug("hidden")
+    multiprocess_scraper.warn("hidden")
+    multiprocess_scraper.error("error")
+    out = capsys.readouterr().out
+    assert "debug" in out and "info" in out and "error" in out
+    assert "hidden" not in out
+
+
+def test_configure(settings):
+    multiprocess_scraper.configure(LOGLEVEL=0)
+    assert multiprocess_scraper.LOGLEVEL == 0
+    assert multiprocess_scraper.overrides == {"LOGLEVEL": 0}
+    with pytest.raises(ValueError, match="Unknown setting"):
+        multiprocess_scraper.configure(NUM_WORKERS=2)
+    with pytest.raises(ValueError, match="Unknown setting"):
+        multiprocess_scraper.configure(log=None)
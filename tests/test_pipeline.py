@@ -0,0 +1,165 @@
+import io
+import json
+from zipfile import ZipFile
+
+import pytest
+from conftest import StandInHandler
+
+import gallery_api
+import multiprocess_scraper
+from crawl_state import CrawlState
+from pipeline import Pipeline
+from vsix_cache import VsixCache
+
+ITEMS = [f"pub.theme-{i}" for i in range(6)]
+URLS = [gallery_api.item_url(name) for name in ITEMS]
+
+
+def make_vsix(name: str) -> bytes:
+    buf = io.BytesIO()
+    with ZipFile(buf, "w") as zip_ref:
+        zip_ref.writestr(
+            "extension/package.json",
+            json.dumps(
+                {
+                    "displayName": name,
+                    "contributes": {
+                        "themes": [{"uiTheme": "vs-dark", "path": "./theme.json"}]
+                    },
+                }
+            ),
+        )
+        zip_ref.writestr(
+            "extension/theme.json",
+            json.dumps({"colors": {"editor.background": "#000000"}}),
+        )
+    return buf.getvalue()
+
+
+class GalleryHandler(StandInHandler):
+    # One page listing items (ITEMS) at their versions (2.0.0), and their
+    # archives
+    downloads: list[str] = []
+    queries: list[dict] = []
+    items: list[str] = ITEMS
+    versions: dict[str, str] = {}
+
+    def do_POST(self):
+        query = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.queries.append(query)
+        extensions = [
+            {
+                "publisher": {"publisherName": name.split(".")[0]},
+                "extensionName": name.split(".")[1],
+                "versions": [{"version": self.versions.get(name, "2.0.0")}],
+                "lastUpdated": "2024-05-01T00:00:00Z",
+            }
+            for name in self.items
+        ]
+        result = {
+            "extensions": extensions,
+            "resultMetadata": [
+                {
+                    "metadataType": "ResultCount",
+                    "metadataItems": [{"name": "TotalCount", "count": len(self.items)}],
+                }
+            ],
+        }
+        body = json.dumps({"results": [result]}).encode()
+        self.send_body(200, body, "application/json")
+
+    def do_GET(self):
+        # /_apis/public/gallery/publishers/<publisher>/vsextensions/<name>/<version>/vspackage
+        parts = self.path.split("/")
+        self.downloads.append(self.path)
+        self.send_body(
+            200, make_vsix(f"{parts[5]}.{parts[7]}"), "application/octet-stream"
+        )
+
+
+@pytest.fixture
+def gallery(stand_in, monkeypatch):
+    monkeypatch.setattr(multiprocess_scraper, "SHARDED_OUTPUT", False)
+    GalleryHandler.downloads = []
+    GalleryHandler.queries = []
+    GalleryHandler.items = ITEMS
+    GalleryHandler.versions = {}
+    base_url = stand_in(GalleryHandler)
+    with gallery_api.HttpSessionContext() as session:
+        yield session, base_url
+
+
+def run_pipeline(session, base_url: str, state: CrawlState):
+    settled = {job: state.settled(job) for job in ["metadata", "vsix"]}
+    collector = multiprocess_scraper.Collector(state, {"list": None, "vsix": None})
+    Pipeline(
+        session,
+        num_metadata_workers=2,
+        num_download_workers=2,
+        num_parsers=1,
+        scrape_metadata=False,
+        base_url=base_url,
+        settled=settled,
+        known=state.listed(),
+    ).run(collector)
+    collector.close()
+
+
+def test_resumes_killed_run(gallery, tmp_path):
+    session, base_url = gallery
+    with CrawlState(str(tmp_path / "state.sqlite")) as state:
+        # What a run killed after two archives would have left behind
+        state.add_entries(
+            {"url": url, "version": "2.0.0", "lastUpdated": "2024-05-01T00:00:00Z"}
+            for url in URLS
+        )
+        for url in URLS[:2]:
+            state.record_themes(url, [{"theme": {"path": "theme.json"}}])
+        state.record_failure(URLS[2], "analysis", "[Analysis] Not a theme extension")
+        state.commit()
+
+        run_pipeline(session, base_url, state)
+
+        downloaded = sorted(path.split("/")[5:9] for path in GalleryHandler.downloads)
+        assert downloaded == [
+            ["pub", "vsextensions", f"theme-{i}", "2.0.0"] for i in range(3, 6)
+        ]
+        assert state.pending("vsix") == []
+        assert state.summary()["analysis"]["done"] == 5
+
+        # Nothing is left to do the second time
+        GalleryHandler.downloads.clear()
+        run_pipeline(session, base_url, state)
+        assert GalleryHandler.downloads == []
+
+
+def test_refreshes_updated_items(gallery, tmp_path):
+    session, base_url = gallery
+    with CrawlState(str(tmp_path / "state.sqlite")) as state:
+        run_pipeline(session, base_url, state)
+        assert len(GalleryHandler.downloads) == len(ITEMS)
+
+        # theme-1 was updated and theme-5 left the marketplace
+        GalleryHandler.downloads.clear()
+        GalleryHandler.versions = {ITEMS[1]: "3.0.0"}
+        GalleryHandler.items = ITEMS[:5]
+        run_pipeline(session, base_url, state)
+        assert [path.split("/")[7:9] for path in GalleryHandler.downloads] == [
+            ["theme-1", "3.0.0"]
+        ]
+        assert state.versions()[URLS[1]] == "3.0.0"
+        assert state.summary()["analysis"]["done"] == len(ITEMS)
+        assert [t["theme"]["path"] for t in state.iter_themes()] == ["theme.json"] * 5
+
+
+def test_listed_version_skips_lookup(gallery, tmp_path):
+    session, base_url = gallery
+    entry = {"url": URLS[0], "version": "2.0.0", "lastUpdated": None}
+    with VsixCache(str(tmp_path)) as cache:
+        pipeline = Pipeline(session, cache=cache, base_url=base_url)
+        [(url, results)] = pipeline.download(entry)
+        assert results.err is None
+        assert cache.get(ITEMS[0], "2.0.0") == results.data
+    # Only the theme list would have queried the gallery
+    assert GalleryHandler.queries == []
+    assert GalleryHandler.downloads[0].endswith("/theme-0/2.0.0/vspackage")
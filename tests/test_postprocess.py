@@ -0,0 +1,74 @@
+import csv
+import json
+
+import postprocess
+from shards import ShardWriter
+
+# Multi-line contents and non-ASCII names are where line endings and encodings
+# can go wrong
+THEMES = [
+    {
+        "name": "Café Noir",
+        "theme": {
+            "uiTheme": "vs-dark",
+            "path": "themes/noir.json",
+            "format": "json",
+            "contents": {"name": "Noir\nline two", "colors": {"a": "#000"}},
+        },
+    },
+    {
+        "name": 'Quoted "Light", with commas',
+        "theme": {
+            "uiTheme": "vs",
+            "path": "themes/light.tmTheme",
+            "format": "tmTheme",
+            "contents": {"settings": [{"name": "crlf\r\nin a string"}]},
+        },
+    },
+]
+
+
+def test_themes_csv_matches_shards_csv(tmp_path):
+    src = tmp_path / "themes.json"
+    src.write_text(json.dumps(THEMES, ensure_ascii=False), encoding="utf-8")
+    shards_dir = str(tmp_path / "shards")
+    writer = ShardWriter(shards_dir)
+    for i, theme in enumerate(THEMES):
+        writer.write_item(f"pub.theme-{i}", [theme])
+    writer.close()
+
+    from_json = str(tmp_path / "from_json.csv")
+    from_shards = str(tmp_path / "from_shards.csv")
+    assert postprocess.themes_to_csv(str(src), from_json) == len(THEMES)
+    assert postprocess.shards_to_csv(shards_dir, from_shards, num_workers=1) == 2
+
+    with open(from_json, "rb") as f:
+        data = f.read()
+    with open(from_shards, "rb") as f:
+        assert f.read() == data
+    assert b"\r\r\n" not in data
+
+    with open(from_json, "r", encoding="utf-8", newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == list(postprocess.THEME_CSV_HEADER)
+    assert [row[0] for row in rows[1:]] == [theme["name"] for theme in THEMES]
+    assert "Noir\\nline two" in rows[1][4]
+    assert len(rows) == 1 + len(THEMES)
+
+
+def test_metadata_csv(tmp_path):
+    src = tmp_path / "theme_metadata.json"
+    metadata = [
+        {"url": "a", "name": "Ünïcode", "description": "two\nlines"},
+        {"url": "b", "name": "Plain", "description": ""},
+    ]
+    src.write_text(json.dumps(metadata, ensure_ascii=False), encoding="utf-8")
+    dst = str(tmp_path / "metadata.csv")
+    assert postprocess.metadata_to_csv(str(src), dst) == 2
+    with open(dst, "r", encoding="utf-8", newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows == [
+        ["url", "name", "description"],
+        ["a", "Ünïcode", "two\nlines"],
+        ["b", "Plain", ""],
+    ]
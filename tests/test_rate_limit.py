@@ -0,0 +1,151 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import monotonic, sleep
+
+import pytest
+from conftest import StandInHandler
+
+import gallery_api
+import rate_limit
+from rate_limit import AIMDController, Throttle, TokenBucket, backoff_delay
+
+MAX_CONCURRENT = 3
+INITIAL_CONCURRENCY = 12
+
+
+class OverloadedHandler(StandInHandler):
+    # Answers 429 whenever more than MAX_CONCURRENT requests are in flight,
+    # every other time with a Retry-After
+    lock = Lock()
+    active = 0
+    throttled = {"with_retry_after": 0, "without_retry_after": 0}
+
+    def do_GET(self):
+        cls = type(self)
+        with cls.lock:
+            cls.active += 1
+            overloaded = cls.active > MAX_CONCURRENT
+            if overloaded:
+                with_retry_after = sum(cls.throttled.values()) % 2 == 0
+                key = "with" if with_retry_after else "without"
+                cls.throttled[f"{key}_retry_after"] += 1
+        try:
+            if overloaded:
+                headers = {"Retry-After": "0"} if with_retry_after else {}
+                self.send_body(429, b"Too many requests", "text/plain", headers)
+            else:
+                sleep(0.05)
+                self.send_body(200, b"ok", "text/plain")
+        finally:
+            with cls.lock:
+                cls.active -= 1
+
+
+def test_throttled_requests_succeed(stand_in, monkeypatch):
+    monkeypatch.setattr(rate_limit, "BACKOFF_BASE", 0.01)
+    monkeypatch.setattr(rate_limit, "BACKOFF_CAP", 0.2)
+    throttle = Throttle(
+        TokenBucket(rate=1000, capacity=1000),
+        AIMDController(initial=INITIAL_CONCURRENCY, maximum=16),
+        max_retries=50,
+    )
+    monkeypatch.setattr(gallery_api, "throttle", throttle)
+    monkeypatch.setattr(
+        OverloadedHandler, "throttled", dict.fromkeys(OverloadedHandler.throttled, 0)
+    )
+    base_url = stand_in(OverloadedHandler)
+
+    with gallery_api.HttpSessionContext(pool_size=16) as session:
+
+        def get(i: int) -> int:
+            res = gallery_api.request(session, "GET", f"{base_url}/{i}", timeout=10)
+            res.close()
+            return res.status_code
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            statuses = list(executor.map(get, range(40)))
+
+    assert statuses == [200] * 40
+    stats = throttle.controller.stats()
+    assert stats["throttled"] > 0
+    assert stats["limit"] < INITIAL_CONCURRENCY
+    assert OverloadedHandler.throttled["with_retry_after"] > 0
+    assert OverloadedHandler.throttled["without_retry_after"] > 0
+    # Every 429 went through the throttle, none were retried by urllib3
+    assert stats["throttled"] == sum(OverloadedHandler.throttled.values())
+
+
+class FakeClock:
+    # Stands in for rate_limit's monotonic() and sleep(), so that the bucket's
+    # timing doesn't depend on how busy the machine is
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit, "monotonic", clock.monotonic)
+    monkeypatch.setattr(rate_limit, "sleep", clock.sleep)
+    return clock
+
+
+def test_token_bucket_burst_then_rate(clock):
+    bucket = TokenBucket(rate=50, capacity=5)
+    for _ in range(5):
+        bucket.acquire()
+    assert clock.now == 1000.0
+    for _ in range(10):
+        bucket.acquire()
+    # 10 more tokens at 50 per second
+    assert clock.now == pytest.approx(1000.2)
+
+
+def test_token_bucket_refills_up_to_capacity(clock):
+    bucket = TokenBucket(rate=100, capacity=2)
+    bucket.acquire(2)
+    clock.sleep(0.1)  # Worth 10 tokens, but only 2 fit
+    bucket.acquire(2)
+    assert clock.now == pytest.approx(1000.1)
+    bucket.acquire(1)
+    assert clock.now == pytest.approx(1000.11)
+
+
+@pytest.mark.parametrize(
+    "workers, maximum, initial",
+    [(None, rate_limit.MAX_CONCURRENCY, rate_limit.INITIAL_CONCURRENCY), (4, 4, 4)],
+)
+def test_concurrency_limit_capped_at_workers(workers, maximum, initial):
+    controller = Throttle(workers=workers).controller
+    assert (controller.maximum, controller.limit.value) == (maximum, initial)
+    for _ in range(1000):
+        controller.acquire()
+        controller.release(0.01)
+    assert controller.stats()["limit"] == maximum
+
+
+def test_backoff_delay_retry_after():
+    assert backoff_delay(0, "3") == 3
+    assert backoff_delay(5, "0.5") == 0.5
+    assert backoff_delay(0, str(10 * rate_limit.BACKOFF_CAP)) == rate_limit.BACKOFF_CAP
+    # An HTTP date isn't understood, so it falls back to the jittered backoff
+    date = "Wed, 21 Oct 2015 07:28:00 GMT"
+    assert 0 <= backoff_delay(0, date) <= rate_limit.BACKOFF_BASE
+
+
+@pytest.mark.parametrize("attempt", [0, 1, 3, 6, 7, 20])
+def test_backoff_delay_jitter(attempt):
+    random.seed(attempt)
+    bound = min(rate_limit.BACKOFF_CAP, rate_limit.BACKOFF_BASE * 2**attempt)
+    delays = [backoff_delay(attempt) for _ in range(500)]
+    assert all(0 <= delay <= bound for delay in delays)
+    # Full jitter spreads the retries over the whole window
+    assert min(delays) < 0.1 * bound
+    assert max(delays) > 0.9 * bound
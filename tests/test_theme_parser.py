@@ -0,0 +1,44 @@
+from glob import glob
+from os import path
+
+import json5
+import pytest
+from conftest import FIXTURES_DIR
+
+import theme_parser
+
+# themes/<tier>/*.json: each file is expected to need exactly that tier
+THEMES_DIR = path.join(FIXTURES_DIR, "themes")
+FIXTURES = sorted(
+    path.relpath(fpath, THEMES_DIR)
+    for fpath in glob(path.join(THEMES_DIR, "*", "*.json"))
+)
+
+
+def read_fixture(name: str) -> bytes:
+    with open(path.join(THEMES_DIR, name), "rb") as f:
+        return f.read()
+
+
+def test_fixtures_cover_every_tier():
+    assert {path.dirname(name) for name in FIXTURES} == set(theme_parser.TIERS)
+
+
+@pytest.mark.parametrize("name", FIXTURES)
+def test_matches_json5(name):
+    data = read_fixture(name)
+    out, tier = theme_parser.parse_json(data)
+    assert out == json5.loads(data)
+    assert tier == path.dirname(name)
+    assert theme_parser.parse_json(data.decode("utf8")) == (out, tier)
+
+
+@pytest.mark.parametrize(
+    "text",
+    ['{"a": 1', '{"a": }', "{'a: 1}", ""],
+)
+def test_invalid(text):
+    with pytest.raises(ValueError):
+        json5.loads(text)
+    with pytest.raises(ValueError):
+        theme_parser.parse_json(text)
@@ -0,0 +1,331 @@
+import json
+import plistlib
+from os import path
+from urllib.parse import parse_qs, urlparse
+from zipfile import ZipFile
+
+import pytest
+import requests
+from conftest import FIXTURES_DIR, StandInHandler
+
+import gallery_api
+import theme_scraper
+from theme_scraper import Theme
+from vsix_cache import VsixCache
+
+PAGES_DIR = path.join(FIXTURES_DIR, "item_pages")
+EXTENSIONS_DIR = path.join(FIXTURES_DIR, "extensionquery")
+
+
+class MarketplaceHandler(StandInHandler):
+    # Saved item pages at /items?itemName=..., and the extensionquery endpoint
+    # answering FILTER_EXTENSION_NAME lookups from saved extension JSON
+    queries: list[str] = []
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        name = parse_qs(url.query).get("itemName", [""])[0]
+        fpath = path.join(PAGES_DIR, f"{name}.html")
+        if url.path != "/items" or not path.exists(fpath):
+            self.send_body(404, b"Not found", "text/plain")
+            return
+        with open(fpath, "rb") as f:
+            self.send_body(200, f.read(), "text/html")
+
+    def do_POST(self):
+        query = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        extensions = []
+        for criterion in query["filters"][0]["criteria"]:
+            if criterion["filterType"] == gallery_api.FILTER_EXTENSION_NAME:
+                self.queries.append(criterion["value"])
+                fpath = path.join(EXTENSIONS_DIR, f"{criterion['value']}.json")
+                if path.exists(fpath):
+                    with open(fpath, "r") as f:
+                        extensions.append(json.load(f))
+        body = json.dumps({"results": [{"extensions": extensions}]}).encode()
+        self.send_body(200, body, "application/json")
+
+
+PALENIGHT = Theme(
+    url=gallery_api.item_url("whizkydee.material-palenight-theme"),
+    name="Palenight Theme",
+    author="Olaolu Olawuyi",
+    verified=True,
+    num_installs=1957339,
+    num_ratings=45,
+    average_rating=4.6,
+    description="An elegant and juicy material-like theme for Visual Studio Code.",
+    price="Free",
+    categories=["Themes"],
+    tags=["dark", "palenight"],
+    repository="https://github.com/whizkydee/vscode-material-palenight-theme",
+)
+
+MONOKAI_PRO = Theme(
+    url=gallery_api.item_url("monokai.theme-monokai-pro-vscode"),
+    name="Monokai Pro",
+    author="monokai",
+    verified=True,
+    num_installs=2315466,
+    num_ratings=132,
+    average_rating=4.25,
+    description="Professional theme and matching icons, from the author of the "
+    "original Monokai color scheme.",
+    price="Paid",
+    categories=["Themes"],
+    tags=["color-theme", "monokai", "theme"],
+    repository="https://github.com/Monokai/monokai-pro-vscode",
+)
+
+PLAIN = Theme(
+    url=gallery_api.item_url("nobody.plain-theme"),
+    name="Plain Theme",
+    author="nobody",
+    verified=False,
+    num_installs=0,
+    num_ratings=0,
+    average_rating=0.0,
+    description="A theme with no repository and no installs yet",
+    price="Free",
+    categories=["Themes"],
+    tags=["light"],
+    repository=None,
+)
+
+
+@pytest.fixture
+def marketplace(stand_in):
+    MarketplaceHandler.queries.clear()
+    with gallery_api.HttpSessionContext() as session:
+        yield session, stand_in(MarketplaceHandler)
+
+
+@pytest.mark.parametrize("expected", [PALENIGHT, MONOKAI_PRO, PLAIN])
+def test_item_page(marketplace, expected):
+    session, base_url = marketplace
+    theme = theme_scraper.analyze_page_http(session, expected.url, base_url=base_url)
+    assert theme == expected
+
+
+@pytest.mark.parametrize("expected", [MONOKAI_PRO, PLAIN])
+def test_extension_query(marketplace, expected):
+    session, base_url = marketplace
+    theme = theme_scraper.analyze_page_http(
+        session, expected.url, use_gallery_api=True, base_url=base_url
+    )
+    assert theme == expected
+
+
+def test_embedded_extension_matches_query(marketplace):
+    # The vss-extension JSON on the page and the extensionquery result are the
+    # same document, and must give the same Theme
+    session, base_url = marketplace
+    url = MONOKAI_PRO.url
+    from_page = theme_scraper.analyze_page_http(session, url, base_url=base_url)
+    from_query = theme_scraper.analyze_page_http(
+        session, url, use_gallery_api=True, base_url=base_url
+    )
+    assert from_page == from_query
+
+
+def test_missing_extension(marketplace):
+    session, base_url = marketplace
+    url = gallery_api.item_url("nobody.missing-theme")
+    with pytest.raises(ValueError, match="not found in gallery"):
+        theme_scraper.analyze_page_http(
+            session, url, use_gallery_api=True, base_url=base_url
+        )
+    with pytest.raises(requests.HTTPError):
+        theme_scraper.analyze_page_http(session, url, base_url=base_url)
+
+
+def test_cached_download_version(marketplace, tmp_path):
+    # The gallery is only asked for the latest version when it isn't known
+    session, base_url = marketplace
+    with VsixCache(str(tmp_path)) as cache:
+        cache.put("nobody.plain-theme", "0.0.1", b"archive")
+        results = theme_scraper.download_vsix_cached(
+            session, cache, PLAIN.url, base_url=base_url, version="0.0.1"
+        )
+        assert results.data == b"archive"
+        assert MarketplaceHandler.queries == []
+
+        results = theme_scraper.download_vsix_cached(
+            session, cache, PLAIN.url, base_url=base_url
+        )
+        assert results.data == b"archive"
+        assert MarketplaceHandler.queries == ["nobody.plain-theme"]
+
+
+## VSIX archives
+# Small extensions covering the shapes analyze_extension handles: plain JSON,
+# JSONC with comments and trailing commas, includes (of JSON and of a tmTheme),
+# tokenColors kept in a tmTheme, tmTheme themes, a theme path that isn't in the
+# package, and an extension that contributes no themes
+
+TMTHEME = plistlib.dumps(
+    {
+        "name": "Monokai",
+        "settings": [
+            {"settings": {"background": "#272822", "foreground": "#F8F8F2"}},
+            {
+                "name": "Comment",
+                "scope": "comment",
+                "settings": {"foreground": "#75715E"},
+            },
+        ],
+    }
+)
+
+EXTENSIONS = {
+    "plain": {
+        "package.json": json.dumps(
+            {
+                "displayName": "Plain",
+                "contributes": {
+                    "themes": [
+                        {
+                            "label": "Dark",
+                            "uiTheme": "vs-dark",
+                            "path": "./themes/dark.json",
+                        }
+                    ]
+                },
+            }
+        ),
+        "themes/dark.json": json.dumps(
+            {"name": "Dark", "colors": {"editor.background": "#000000"}}
+        ),
+    },
+    "includes": {
+        "package.json": """{
+            // Hand-written, like most
+            "displayName": "Includes",
+            "contributes": {
+                "themes": [
+                    {"uiTheme": "vs-dark", "path": "./themes/variant.json"},
+                    {"uiTheme": "vs", "path": "./themes/tokens.json"},
+                ],
+            },
+        }""",
+        "themes/base.json": """{
+            /* shared by the variants */
+            "colors": {"editor.background": "#111111", "editor.foreground": "#eeeeee",},
+            "tokenColors": [{"scope": "string", "settings": {"foreground": "#a5e844"}}],
+        }""",
+        "themes/variant.json": """{
+            "include": "./base.json",
+            "colors": {"editor.background": "#222222"}, // darker
+            "tokenColors": [{"scope": "comment", "settings": {"fontStyle": "italic"}}]
+        }""",
+        "themes/tokens.json": json.dumps(
+            {
+                "colors": {"editor.background": "#ffffff"},
+                "tokenColors": "./Monokai.tmTheme",
+            }
+        ),
+        "themes/Monokai.tmTheme": TMTHEME,
+    },
+    "tmtheme": {
+        "package.json": json.dumps(
+            {
+                "displayName": "TextMate",
+                "contributes": {
+                    "themes": [
+                        {"uiTheme": "vs-dark", "path": "./themes/Monokai.tmTheme"}
+                    ]
+                },
+            }
+        ),
+        "themes/Monokai.tmTheme": TMTHEME,
+    },
+    "missing": {
+        "package.json": json.dumps(
+            {
+                "displayName": "Missing",
+                "contributes": {
+                    "themes": [
+                        {"uiTheme": "vs-dark", "path": "./themes/dark.json"},
+                        {"uiTheme": "vs", "path": "./themes/light.json"},
+                    ]
+                },
+            }
+        ),
+        "themes/dark.json": json.dumps({"colors": {"editor.background": "#000000"}}),
+    },
+    "not-a-theme": {
+        "package.json": json.dumps(
+            {"displayName": "Snippets", "contributes": {"snippets": []}}
+        ),
+    },
+}
+
+
+@pytest.fixture(scope="module")
+def vsix_corpus(tmp_path_factory) -> dict[str, tuple[str, str]]:
+    # name: (.vsix path, extracted folder)
+    root = tmp_path_factory.mktemp("vsix")
+    corpus = {}
+    for name, files in EXTENSIONS.items():
+        vsix_path = str(root / f"{name}.vsix")
+        with ZipFile(vsix_path, "w") as zip_ref:
+            zip_ref.writestr("extension.vsixmanifest", "<PackageManifest/>")
+            for member, data in files.items():
+                zip_ref.writestr(f"extension/{member}", data)
+        folder = str(root / name)
+        with ZipFile(vsix_path, "r") as zip_ref:
+            zip_ref.extractall(folder)
+        corpus[name] = (vsix_path, folder)
+    return corpus
+
+
+@pytest.mark.parametrize("resolve_includes", [False, True])
+@pytest.mark.parametrize("name", list(EXTENSIONS))
+def test_archive_matches_folder(vsix_corpus, monkeypatch, name, resolve_includes):
+    monkeypatch.setattr(theme_scraper, "RESOLVE_INCLUDES", resolve_includes)
+    vsix_path, folder = vsix_corpus[name]
+    with open(vsix_path, "rb") as f:
+        data = f.read()
+    from_folder = theme_scraper.analyze_vsix(folder)
+    assert theme_scraper.analyze_vsix_archive(vsix_path) == from_folder
+    assert theme_scraper.analyze_vsix_archive(data) == from_folder
+
+
+def test_archive_results(vsix_corpus, monkeypatch):
+    # Pins what the shared results look like, not just that they agree
+    monkeypatch.setattr(theme_scraper, "RESOLVE_INCLUDES", True)
+    results = {
+        name: theme_scraper.analyze_vsix_archive(vsix_path)
+        for name, (vsix_path, _) in vsix_corpus.items()
+    }
+
+    assert results["plain"].err is None
+    assert results["plain"].parsers == {
+        "package.json": "json",
+        "themes/dark.json": "json",
+    }
+
+    includes = results["includes"]
+    assert includes.err is None
+    variant, tokens = [t["theme"] for t in includes.analysis]
+    assert variant["contents"]["colors"] == {
+        "editor.background": "#222222",
+        "editor.foreground": "#eeeeee",
+    }
+    assert [r["scope"] for r in variant["contents"]["tokenColors"]] == [
+        "string",
+        "comment",
+    ]
+    assert "include" not in variant["contents"]
+    assert tokens["contents"]["tokenColors"][1]["scope"] == "comment"
+    assert includes.parsers["package.json"] == "jsonc"
+
+    tmtheme = results["tmtheme"].analysis[0]["theme"]
+    assert tmtheme["format"] == "tmTheme"
+    assert tmtheme["contents"]["name"] == "Monokai"
+
+    missing = results["missing"]
+    assert missing.err == "No such file in extension: 'themes/light.json'"
+    assert [t["theme"]["path"] for t in missing.analysis] == ["themes/dark.json"]
+
+    assert results["not-a-theme"].err == "Not a theme extension"